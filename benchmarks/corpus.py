@@ -0,0 +1,133 @@
+"""
+合成语料生成器：按目标大小生成中英混合的 Agent 对话记录，
+包含代码块、文件路径、sk- 密钥与工具输出，并返回受保护实体的标准答案。
+另有 JSON 响应、日志与堆栈的单一类型语料，用于单独测试各专用压缩器。
+"""
+import json
+import random
+import string
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+ZH_SUBJECTS = ["配置文件", "数据库连接", "缓存策略", "部署脚本", "日志系统", "权限模块", "消息队列", "前端页面", "定时任务", "监控面板"]
+ZH_VERBS = ["需要检查", "已经更新了", "出现了异常", "建议重构", "请帮我优化", "暂时无法访问", "已经迁移到", "依赖于"]
+ZH_OBJECTS = ["生产环境", "测试服务器", "本地目录", "新的版本", "备份节点", "容器镜像", "旧的接口", "第三方服务"]
+EN_SUBJECTS = ["The gateway", "Redis", "The worker pool", "Telegram bot", "DeepSeek provider", "The scheduler", "Docker", "Celery"]
+EN_VERBS = ["failed to connect to", "was restarted on", "now depends on", "timed out while calling", "is configured for", "reported high latency on"]
+EN_OBJECTS = ["port 6379", "the staging cluster", "the primary database", "the webhook endpoint", "the metrics exporter", "the auth service"]
+LOG_LEVELS = ["INFO", "WARN", "ERROR", "DEBUG"]
+
+@dataclass
+class Corpus:
+    """一份合成对话及其受保护实体的标准答案"""
+    text: str
+    keys: List[str] = field(default_factory=list)
+    paths: List[str] = field(default_factory=list)
+    latest_code: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.text.encode("utf-8"))
+
+def _api_key(rng: random.Random) -> str:
+    return "sk-" + "".join(rng.choices(string.ascii_letters + string.digits, k=32))
+
+def _path(rng: random.Random) -> str:
+    parts = [rng.choice(["src", "core", "data", "logs", "config", "app", "lib"]) for _ in range(rng.randint(2, 5))]
+    name = rng.choice(["main", "settings", "worker", "utils", "handler"]) + rng.choice([".py", ".json", ".yaml", ".log"])
+    if rng.random() < 0.3:
+        return "C:\\Users\\dev\\" + "\\".join(parts) + "\\" + name
+    return "/home/dev/" + "/".join(parts) + "/" + name
+
+def _code_block(rng: random.Random, n: int) -> str:
+    body = [f"def handler_{n}(event):"]
+    for i in range(rng.randint(3, 12)):
+        body.append(f"    value_{i} = event.get('field_{i}', {rng.randint(0, 999)})")
+    body.append(f"    return value_0  # revision {n}")
+    return "```python\n" + "\n".join(body) + "\n```"
+
+def _zh_sentence(rng: random.Random) -> str:
+    return f"{rng.choice(ZH_SUBJECTS)}{rng.choice(ZH_VERBS)}{rng.choice(ZH_OBJECTS)}。"
+
+def _en_sentence(rng: random.Random) -> str:
+    return f"{rng.choice(EN_SUBJECTS)} {rng.choice(EN_VERBS)} {rng.choice(EN_OBJECTS)}."
+
+def _log_line(rng: random.Random) -> str:
+    return (f"2024-05-0{rng.randint(1, 9)} 12:{rng.randint(10, 59)}:{rng.randint(10, 59)} "
+            f"{rng.choice(LOG_LEVELS)} worker-{rng.randint(1, 8)} processed job {rng.randint(1000, 9999)} "
+            f"in {rng.randint(1, 500)}ms")
+
+def _json_payload(rng: random.Random) -> str:
+    items = [{"id": rng.randint(1, 10 ** 6), "status": rng.choice(["ok", "failed", "pending"]),
+              "latency_ms": rng.randint(1, 900)} for _ in range(rng.randint(2, 40))]
+    return json.dumps({"items": items, "total": len(items)}, indent=2 if rng.random() < 0.5 else None)
+
+def _stack_trace(rng: random.Random) -> str:
+    frames = []
+    for depth in range(rng.randint(3, 40)):
+        frames.append(f'  File "/home/dev/app/{rng.choice(["worker", "handler", "utils"])}.py", '
+                      f'line {rng.randint(10, 400)}, in step_{depth}')
+        frames.append(f"    return step_{depth + 1}(event)")
+    return ("Traceback (most recent call last):\n" + "\n".join(frames) +
+            f"\nKeyError: 'field_{rng.randint(0, 20)}'")
+
+def _tool_output(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.4:
+        lines = [_log_line(rng) for _ in range(rng.randint(3, 15))]
+        return "Tool: RUN: tail -n 20 app.log\n" + "\n".join(lines)
+    if kind < 0.7:
+        items = [{"id": rng.randint(1, 10 ** 6), "status": rng.choice(["ok", "failed", "pending"]),
+                  "latency_ms": rng.randint(1, 900)} for _ in range(rng.randint(2, 10))]
+        return "Tool: " + json.dumps({"items": items, "total": len(items)})
+    return ("Tool: Traceback (most recent call last):\n"
+            f'  File "/home/dev/app/worker.py", line {rng.randint(10, 400)}, in run\n'
+            "    result = handler(event)\n"
+            f"KeyError: 'field_{rng.randint(0, 20)}'")
+
+def generate_transcript(size_bytes: int, seed: int = 0) -> Corpus:
+    """生成约 size_bytes 大小的对话记录 (UTF-8 字节数)"""
+    rng = random.Random(seed)
+    corpus = Corpus(text="")
+    turns = ["System: You are OmniGate, a local assistant for Clawdbot.", "User: 你好，我们继续昨天的部署工作。"]
+    size = sum(len(t.encode("utf-8")) + 1 for t in turns)
+    n = 0
+    while size < size_bytes:
+        n += 1
+        roll = rng.random()
+        if roll < 0.05:
+            key = _api_key(rng)
+            corpus.keys.append(key)
+            turn = f"User: 新的 API Key 是 {key}，请记下来。"
+        elif roll < 0.15:
+            path = _path(rng)
+            corpus.paths.append(path)
+            turn = f"AI: 我已修改 {path} 中的配置。"
+        elif roll < 0.22:
+            code = _code_block(rng, n)
+            corpus.latest_code = code
+            turn = f"AI: 这是更新后的代码：\n{code}"
+        elif roll < 0.40:
+            turn = _tool_output(rng)
+        elif roll < 0.70:
+            turn = "User: " + "".join(_zh_sentence(rng) for _ in range(rng.randint(1, 3)))
+        else:
+            turn = "AI: " + " ".join(_en_sentence(rng) for _ in range(rng.randint(1, 3)))
+        turns.append(turn)
+        size += len(turn.encode("utf-8")) + 1
+    corpus.text = "\n".join(turns)
+    corpus.keys = list(dict.fromkeys(corpus.keys))
+    corpus.paths = list(dict.fromkeys(corpus.paths))
+    return corpus
+
+def generate_typed(kind: str, size_bytes: int, seed: int = 0) -> Corpus:
+    """生成单一类型的工具输出语料：json / log / trace"""
+    rng = random.Random(seed)
+    make = {"json": _json_payload, "log": _log_line, "trace": _stack_trace}[kind]
+    parts = []
+    size = 0
+    while size < size_bytes:
+        part = make(rng)
+        parts.append(part)
+        size += len(part.encode("utf-8")) + 1
+    return Corpus(text="\n".join(parts))
@@ -0,0 +1,170 @@
+"""
+压缩基准与质量测试：对每种压缩模式、每个语料规模测量吞吐 (MB/s)、峰值内存、
+压缩率与受保护实体召回率，输出机器可读的 JSON，并可与历史结果对比以发现回退。
+专用压缩器 (JSON / 日志 / 堆栈) 在各自的单一类型语料上单独测量。
+
+用法:
+    python -m benchmarks.shrink_bench --sizes 1K,100K,1M,10M --out bench.json
+    python -m benchmarks.shrink_bench --compressors json,log,trace --modes default
+    python -m benchmarks.shrink_bench --baseline bench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from benchmarks.corpus import Corpus, generate_transcript, generate_typed
+from core.compression.pipeline import shrink_text
+from core.compression.structured import compress_structured
+from core.tokenizer import count_tokens
+
+# 压缩模式注册表：新增的压缩模式在此登记即可纳入基准
+MODES: Dict[str, Callable[[str], str]] = {
+    "default": lambda text: shrink_text(text).text,
+    "no_dedup": lambda text: shrink_text(text, dedup=False).text,
+    "no_structured": lambda text: shrink_text(text, structured=False).text,
+    "code_diff": lambda text: shrink_text(text, code_diff=True).text,
+    "budget_30": lambda text: shrink_text(text, target_ratio=0.3).text,
+}
+
+# 专用压缩器：在对应类型的语料上单独运行，结果以 "compressor:<名称>" 记录
+COMPRESSORS: Dict[str, Callable[[str], str]] = {
+    "json": lambda text: compress_structured(text)[0],
+    "log": lambda text: compress_structured(text)[0],
+    "trace": lambda text: compress_structured(text)[0],
+}
+
+DEFAULT_SIZES = "1K,10K,100K,1M,10M"
+# 对比阈值：吞吐下降超过 20%，或召回率/压缩率变差超过 0.05 视为回退
+SPEED_TOLERANCE = 0.20
+QUALITY_TOLERANCE = 0.05
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2}
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def _recall(expected: List[str], output: str) -> Optional[float]:
+    if not expected:
+        return None
+    return round(sum(1 for item in expected if item in output) / len(expected), 4)
+
+def bench_one(mode: str, corpus: Corpus, repeats: int = 3,
+              compress: Optional[Callable[[str], str]] = None) -> Dict[str, Any]:
+    compress = compress or MODES[mode]
+    timings = []
+    output = ""
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = compress(corpus.text)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+
+    # 峰值内存单独测量，避免 tracemalloc 的开销影响计时
+    tracemalloc.start()
+    compress(corpus.text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    original_tokens = count_tokens(corpus.text)
+    output_tokens = count_tokens(output)
+    return {
+        "mode": mode,
+        "bytes": corpus.size,
+        "seconds": round(best, 6),
+        "throughput_mb_s": round(corpus.size / 1024 ** 2 / best, 3) if best > 0 else None,
+        "peak_mem_mb": round(peak / 1024 ** 2, 3),
+        "char_ratio": round(len(output) / len(corpus.text), 4),
+        "token_ratio": round(output_tokens / original_tokens, 4) if original_tokens else None,
+        "key_recall": _recall(corpus.keys, output),
+        "path_recall": _recall(corpus.paths, output),
+        "code_recall": None if corpus.latest_code is None else float(corpus.latest_code in output),
+    }
+
+def run(sizes: List[int], modes: List[str], repeats: int = 3, seed: int = 0,
+        compressors: Sequence[str] = ()) -> Dict[str, Any]:
+    results = []
+    for size in sizes:
+        corpus = generate_transcript(size, seed=seed)
+        for mode in modes:
+            results.append(bench_one(mode, corpus, repeats))
+        for name in compressors:
+            typed = generate_typed(name, size, seed=seed)
+            results.append(bench_one(f"compressor:{name}", typed, repeats, COMPRESSORS[name]))
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """返回相对基线的回退项描述，空列表表示没有回退"""
+    base = {(r["mode"], r["bytes"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in current["results"]:
+        b = base.get((r["mode"], r["bytes"]))
+        if b is None:
+            continue
+        tag = f"{r['mode']}@{r['bytes']}B"
+        if b.get("throughput_mb_s") and r["throughput_mb_s"] is not None \
+                and r["throughput_mb_s"] < b["throughput_mb_s"] * (1 - SPEED_TOLERANCE):
+            regressions.append(f"{tag}: throughput {b['throughput_mb_s']} -> {r['throughput_mb_s']} MB/s")
+        for metric in ("key_recall", "path_recall", "code_recall"):
+            if b.get(metric) is not None and r.get(metric) is not None \
+                    and r[metric] < b[metric] - QUALITY_TOLERANCE:
+                regressions.append(f"{tag}: {metric} {b[metric]} -> {r[metric]}")
+        if b.get("token_ratio") is not None and r.get("token_ratio") is not None \
+                and r["token_ratio"] > b["token_ratio"] + QUALITY_TOLERANCE:
+            regressions.append(f"{tag}: token_ratio {b['token_ratio']} -> {r['token_ratio']}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="OmniGate compress_context benchmark")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="语料规模列表，如 1K,1M,10M")
+    parser.add_argument("--modes", default=",".join(MODES), help="压缩模式列表")
+    parser.add_argument("--compressors", default="", help="单独测量的专用压缩器列表，如 json,log,trace")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="结果 JSON 输出路径 (默认输出到标准输出)")
+    parser.add_argument("--baseline", help="与历史结果 JSON 对比，发现回退时返回非零退出码")
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+
+    compressors = [c.strip() for c in args.compressors.split(",") if c.strip()]
+    unknown = [c for c in compressors if c not in COMPRESSORS]
+    if unknown:
+        parser.error(f"unknown compressors: {', '.join(unknown)}")
+
+    report = run(sizes, modes, args.repeats, args.seed, compressors)
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f))
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -99,7 +99,7 @@ def make_layout() -> Layout:
 
 def get_memory_panel():
     from core.omni_engine import omni_engine
-    mems = omni_engine.memory.memory.get("long_term_facts", [])
+    mems = omni_engine.memory.recent_facts(4)
     table = Table.grid(expand=True)
     if not mems:
         table.add_row("[dim]暂无长效记忆记录[/dim]")
@@ -128,6 +128,8 @@ def get_token_panel():
     table.add_column("原始", justify="right")
     table.add_column("Omni 优化", justify="right")
     table.add_column("节省率", style="green", justify="right")
+    table.add_column(f"花费 ({stats['currency']})", justify="right")
+    table.add_column("省下", style="green", justify="right")
     
     for provider, data in stats["providers"].items():
         if data["original"] > 0:
@@ -135,12 +137,20 @@ def get_token_panel():
                 provider.capitalize(), 
                 f"{data['original']}", 
                 f"{data['optimized']}", 
-                f"{round(data['saved']/data['original']*100)}%"
+                f"{round(data['saved']/data['original']*100)}%",
+                f"{data.get('cost_spent', 0):.4f}",
+                f"{data.get('cost_avoided', 0):.4f}"
             )
     
     summary = (
         f"总节省率: [bold green]{stats['savings_rate']}%[/bold green]  "
-        f"累计节省: [bold yellow]{stats['total_saved']}[/bold yellow]"
+        f"累计节省: [bold yellow]{stats['total_saved']}[/bold yellow] Token "
+        f"[dim]({stats['total_saved_chars']} 字符)[/dim]  "
+        f"花费: [bold]{stats['cost_spent']:.4f}[/bold] / 省下: [bold green]{stats['cost_avoided']:.4f}[/bold green] "
+        f"{stats['currency']}  "
+        f"缓存命中率: [bold cyan]{stats['cache_hit_rate']}%[/bold cyan]  "
+        f"提示词缓存: [bold cyan]{stats['prompt_cache_hit_rate']}%[/bold cyan]  "
+        f"摘要净节省: [bold cyan]{stats['summary_net_saved']}[/bold cyan] Token"
     )
     
     from rich.console import Group
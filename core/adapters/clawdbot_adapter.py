@@ -1,5 +1,9 @@
+import asyncio
 from core.adapters.base import BaseAdapter, APIResponse
+from core.compression.stream import resolve_file
+from core.config import settings
 from core.omni_engine import omni_engine
+from core.token_tracker import token_tracker, prompt_cache_usage
 import logging
 
 logger = logging.getLogger("omni.adapters.clawdbot")
@@ -17,14 +21,80 @@ class ClawdbotAdapter(BaseAdapter):
             if method == "offload":
                 # 将 Clawdbot 的任务卸载到本地执行
                 task = kwargs.get("task")
-                res = await omni_engine.execute_task(task)
+                res = await omni_engine.execute_task(task, kwargs.get("aliases"), kwargs.get("namespace"))
                 return APIResponse(status="success", data=res)
             
             elif method == "shrink":
                 # 本地 Token 压缩服务
                 ctx = kwargs.get("context", "")
-                summary = omni_engine.compress_context(ctx)
-                return APIResponse(status="success", data={"summary": summary})
+                session_id = kwargs.get("session_id")
+                if kwargs.get("messages") is not None:
+                    # 消息数组模式：按角色压缩，返回可直接转发的消息数组
+                    result = omni_engine.compress_messages_result(
+                        kwargs["messages"],
+                        keep_turns=kwargs.get("keep_turns"),
+                        target_tokens=kwargs.get("target_tokens"),
+                        target_ratio=kwargs.get("target_ratio"),
+                        code_diff=kwargs.get("code_diff", False),
+                        layout=kwargs.get("layout", "default"),
+                        alias=kwargs.get("alias", False),
+                        namespace=kwargs.get("namespace")
+                    )
+                    data = {"messages": result.messages}
+                    if kwargs.get("alias"):
+                        data["aliases"] = dict(result.aliases or {})
+                    return APIResponse(status="success", data=data)
+                if kwargs.get("path"):
+                    # 文件模式：超大文本按内存映射流式压缩
+                    path = resolve_file(settings.SHRINK_FILE_ROOT, kwargs["path"])
+                    summary = await asyncio.to_thread(
+                        omni_engine.compress_file, path, layout=kwargs.get("layout", "default"),
+                        namespace=kwargs.get("namespace")
+                    )
+                    return APIResponse(status="success", data={"summary": summary})
+                if session_id:
+                    # 增量模式：ctx 只包含新增的对话轮次
+                    summary = omni_engine.compress_incremental(
+                        session_id, ctx, reset=kwargs.get("reset", False), layout=kwargs.get("layout", "default"),
+                        namespace=kwargs.get("namespace")
+                    )
+                    aliases = None
+                else:
+                    result = omni_engine.compress_context_result(
+                        ctx,
+                        target_tokens=kwargs.get("target_tokens"),
+                        target_ratio=kwargs.get("target_ratio"),
+                        code_diff=kwargs.get("code_diff", False),
+                        layout=kwargs.get("layout", "default"),
+                        alias=kwargs.get("alias", False),
+                        namespace=kwargs.get("namespace")
+                    )
+                    summary, aliases = result.text, result.aliases
+                data = {"summary": summary}
+                if kwargs.get("alias") and not session_id:
+                    data["aliases"] = dict(aliases or {})
+                return APIResponse(status="success", data=data)
+
+            elif method == "shrink_batch":
+                # 批量压缩：在常驻进程池中并行执行，结果按输入顺序返回
+                summaries = await omni_engine.compress_batch(
+                    kwargs.get("contexts", []),
+                    target_tokens=kwargs.get("target_tokens"),
+                    target_ratio=kwargs.get("target_ratio"),
+                    code_diff=kwargs.get("code_diff", False),
+                    layout=kwargs.get("layout", "default"),
+                    namespace=kwargs.get("namespace")
+                )
+                return APIResponse(status="success", data={"summaries": summaries})
+
+            elif method == "report_usage":
+                # 回报厂商 usage，记录提示词缓存命中情况 (缓存节省从压缩时记账的花费中扣除)
+                cache_usage = prompt_cache_usage(kwargs.get("usage") or {})
+                if cache_usage:
+                    token_tracker.record_prompt_cache(kwargs.get("provider", "deepseek"), *cache_usage,
+                                                      model=kwargs.get("model"), scene=kwargs.get("scene"),
+                                                      user=kwargs.get("namespace"))
+                return APIResponse(status="success", data={"recorded": cache_usage is not None})
 
             return APIResponse(status="error", error=f"Unsupported: {method}")
         except Exception as e:
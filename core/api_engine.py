@@ -1,10 +1,15 @@
 import logging
 import asyncio
+import time
 from typing import Dict, Any, Optional, Type
 from core.adapters.base import BaseAdapter, APIResponse
+from core.metrics import registry
 
 logger = logging.getLogger("omni.api.engine")
 
+API_CALL_DURATION = registry.histogram("omni_api_call_duration_seconds", "第三方 API 调用耗时",
+                                       ("adapter", "method", "status"))
+
 class APIEngine:
     """
     通用 API 调用引擎 (Clawdbot-style)
@@ -49,8 +54,16 @@ class APIEngine:
             
             logger.info(f"Executing API call: {pointer} with params {kwargs}")
             
-            # 执行调用
-            return await adapter.call(method_name, **kwargs)
+            # 执行调用 (按适配器与方法记录耗时；方法名来自调用方，标签组合数由注册表封顶)
+            start_ns = time.perf_counter_ns()
+            status = "exception"
+            try:
+                response = await adapter.call(method_name, **kwargs)
+                status = response.status
+                return response
+            finally:
+                API_CALL_DURATION.labels(adapter_name, method_name, status).observe_ns(
+                    time.perf_counter_ns() - start_ns)
             
         except Exception as e:
             logger.error(f"APIEngine execution error for pointer [{pointer}]: {str(e)}")
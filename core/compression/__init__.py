@@ -0,0 +1,10 @@
+from .session import ShrinkSession, ShrinkSessionStore
+from .cache import ShrinkCache, ShrinkResult
+from .pipeline import shrink_text
+from .messages import shrink_messages
+from .pool import ShrinkPool
+from .alias import alias_entities, expand_aliases
+from .stream import StreamShrinker
+
+__all__ = ["ShrinkSession", "ShrinkSessionStore", "ShrinkCache", "ShrinkResult", "shrink_text", "shrink_messages", "ShrinkPool",
+           "alias_entities", "expand_aliases", "StreamShrinker"]
@@ -0,0 +1,84 @@
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+# 分层摘要树：每 SUMMARY_FANOUT 个相邻摘要再合并为上一层摘要
+SUMMARY_FANOUT = 4
+# 单条摘要的目标长度 (字)
+SUMMARY_MAX_CHARS = 300
+
+SEGMENT_PROMPT = (
+    "请用不超过 {limit} 字概括以下对话片段，保留文件路径、命令、关键结论与未解决的问题，只输出摘要：\n\n{text}"
+)
+MERGE_PROMPT = (
+    "以下是按时间顺序排列的若干段对话摘要，请合并为一段不超过 {limit} 字的摘要，"
+    "保留文件路径、命令、关键结论与未解决的问题，只输出摘要：\n\n{text}"
+)
+
+# 摘要任务: (层级, 层内序号, 待摘要文本, 覆盖的原文 Token 数)
+SummaryJob = Tuple[int, int, str, int]
+
+def summary_prompt(level: int, text: str) -> str:
+    template = SEGMENT_PROMPT if level == 0 else MERGE_PROMPT
+    return template.format(limit=SUMMARY_MAX_CHARS, text=text)
+
+class SummaryTree:
+    """
+    会话的分层摘要树。第 0 层每个节点对应一个原文段，第 k 层节点覆盖 FANOUT^k 个原文段。
+    摘要由后台任务异步写入；一组兄弟节点全部就绪后产生上一层的合并任务，合并完成后释放子节点，
+    因此常驻的摘要数只与层数 (对话长度的对数) 相关。
+    """
+    def __init__(self, fanout: int = SUMMARY_FANOUT):
+        self.fanout = fanout
+        self.lock = Lock()
+        self.segments = 0
+        # 层级 -> 层内序号 -> (摘要, 覆盖的原文 Token 数)
+        self._levels: List[Dict[int, Tuple[str, int]]] = []
+
+    def add_segment(self, text: str, raw_tokens: int) -> SummaryJob:
+        """登记一个新的原文段，返回其第 0 层摘要任务"""
+        with self.lock:
+            index = self.segments
+            self.segments += 1
+        return 0, index, text, raw_tokens
+
+    def complete(self, level: int, index: int, summary: str, raw_tokens: int) -> Optional[SummaryJob]:
+        """写入一条摘要；若同组兄弟节点已全部就绪，返回上一层的合并任务"""
+        with self.lock:
+            while len(self._levels) <= level:
+                self._levels.append({})
+            nodes = self._levels[level]
+            nodes[index] = (summary, raw_tokens)
+            group = index // self.fanout
+            siblings = [nodes.get(group * self.fanout + i) for i in range(self.fanout)]
+            if any(node is None for node in siblings):
+                return None
+            return level + 1, group, "\n".join(s for s, _ in siblings), sum(t for _, t in siblings)
+
+    def release_children(self, level: int, index: int):
+        """上一层摘要就绪后释放被它覆盖的子节点"""
+        if level == 0:
+            return
+        with self.lock:
+            nodes = self._levels[level - 1]
+            for i in range(index * self.fanout, (index + 1) * self.fanout):
+                nodes.pop(i, None)
+
+    def cover(self) -> List[Tuple[str, int]]:
+        """
+        按时间顺序返回当前可用的摘要 [(摘要, 覆盖的原文 Token 数)]：每个位置优先使用已就绪的最高层节点，
+        尚未摘要的原文段直接跳过 (由关键词摘要兜底)。从不等待进行中的任务。
+        """
+        out: List[Tuple[str, int]] = []
+        with self.lock:
+            i = 0
+            while i < self.segments:
+                for level in range(len(self._levels) - 1, -1, -1):
+                    span = self.fanout ** level
+                    node = self._levels[level].get(i // span) if i % span == 0 else None
+                    if node is not None:
+                        out.append(node)
+                        i += span
+                        break
+                else:
+                    i += 1
+        return out
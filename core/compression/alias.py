@@ -0,0 +1,60 @@
+import re
+from typing import Dict, Optional, Tuple
+
+from core.compression.patterns import KEY_RE
+
+# 可替换为短句柄的长实体：(句柄字母, 规则)，按优先级排列
+URL_RE = re.compile(r'https?://[^\s"\'<>)\]]+')
+UUID_RE = re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b')
+# 绝对路径：Windows 盘符路径或至少两级的 Unix 路径
+ABS_PATH_RE = re.compile(r'[a-zA-Z]:\\[^\s"\'<>|]+|(?<![\w.:/])/[\w.-]+(?:/[\w.-]+)+')
+ALIAS_PATTERNS = (("K", KEY_RE), ("U", URL_RE), ("I", UUID_RE), ("P", ABS_PATH_RE))
+
+HANDLE_PREFIX = "§"
+HANDLE_RE = re.compile(r'§[A-Z]\d+')
+# 只替换足够长、且至少出现两次的实体，否则别名表本身的开销抵消节省
+MIN_ALIAS_CHARS = 16
+MIN_OCCURRENCES = 2
+
+def alias_entities(text: str) -> Tuple[str, Dict[str, str]]:
+    """
+    可逆别名替换：把重复出现的长实体替换为 §P1 之类的短句柄。
+    返回 (替换后的文本, 句柄 -> 原值)；原文已含句柄前缀时不做替换，保证可逆。
+    """
+    if HANDLE_PREFIX in text:
+        return text, {}
+    counts: Dict[str, int] = {}
+    kinds: Dict[str, str] = {}
+    for kind, pattern in ALIAS_PATTERNS:
+        for value in pattern.findall(text):
+            if len(value) >= MIN_ALIAS_CHARS and value not in kinds:
+                kinds[value] = kind
+    if not kinds:
+        return text, {}
+    for value in kinds:
+        counts[value] = text.count(value)
+
+    # 按首次出现的位置编号，保证相同文本得到相同句柄
+    chosen = sorted((v for v in kinds if counts[v] >= MIN_OCCURRENCES), key=text.find)
+    numbers: Dict[str, int] = {}
+    legend: Dict[str, str] = {}
+    for value in chosen:
+        kind = kinds[value]
+        numbers[kind] = numbers.get(kind, 0) + 1
+        legend[f"{HANDLE_PREFIX}{kind}{numbers[kind]}"] = value
+    if not legend:
+        return text, {}
+
+    handles = {value: handle for handle, value in legend.items()}
+    # 较长的实体优先匹配，避免路径前缀被先替换
+    pattern = re.compile("|".join(re.escape(v) for v in sorted(handles, key=len, reverse=True)))
+    return pattern.sub(lambda m: handles[m.group(0)], text), legend
+
+def render_legend(legend: Dict[str, str]) -> str:
+    return "[别名表: " + "; ".join(f"{handle}={value}" for handle, value in legend.items()) + "]"
+
+def expand_aliases(text: str, legend: Optional[Dict[str, str]]) -> str:
+    """把模型输出中的句柄还原为完整值，未知句柄保持原样"""
+    if not legend or HANDLE_PREFIX not in text:
+        return text
+    return HANDLE_RE.sub(lambda m: legend.get(m.group(0), m.group(0)), text)
@@ -0,0 +1,188 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, replace
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("omni.compression.cache")
+
+@dataclass
+class ShrinkResult:
+    """一次压缩的完整结果，命中缓存时直接复用，无需重新计算 Token"""
+    text: str
+    original_tokens: int = 0
+    optimized_tokens: int = 0
+    original_chars: int = 0
+    optimized_chars: int = 0
+    compressed: bool = True  # False 表示未达到压缩阈值，原样返回
+    messages: Optional[List[Dict[str, Any]]] = None  # 消息数组模式的输出
+    aliases: Optional[Dict[str, str]] = None  # 别名替换模式的句柄 -> 原值
+
+def _detached(result: ShrinkResult) -> ShrinkResult:
+    """复制结果中的可变部分，调用方修改返回值不会影响缓存中的条目"""
+    if result.messages is None and result.aliases is None:
+        return result
+    return replace(result, messages=copy.deepcopy(result.messages),
+                   aliases=dict(result.aliases) if result.aliases is not None else None)
+
+class ShrinkCache:
+    """
+    内容寻址的压缩结果缓存：按 (内容哈希, 厂商, 场景, 记忆版本, 压缩参数) 寻址。
+    内存层为按字节数限制的 LRU，可选的磁盘层在重启后依然有效，同样按字节数做 LRU 淘汰
+    (启动时按文件修改时间恢复顺序，命中时刷新修改时间)。
+    存入与取出时都复制消息数组等可变字段，缓存条目不会被调用方修改。
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.lock = Lock()
+        self.current_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (ShrinkResult, size)
+        self._disk_entries: "OrderedDict[str, int]" = OrderedDict()  # key -> 文件大小，按最近使用排序
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(context: str, provider: str, scene: str, facts_version: int, namespace: Optional[str] = None,
+                 **options: Any) -> str:
+        digest = hashlib.sha256(context.encode("utf-8", "surrogatepass")).hexdigest()
+        extra = ",".join(f"{k}={options[k]}" for k in sorted(options))
+        # 记忆命名空间不同时注入的记忆不同；默认命名空间不计入，保持已有缓存键不变
+        version = f"{namespace}:{facts_version}" if namespace else facts_version
+        meta = f"{provider}|{scene}|{version}|{extra}"
+        return hashlib.sha256(f"{digest}|{meta}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[ShrinkResult]:
+        with self.lock:
+            item = self._entries.get(key)
+            if item is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _detached(item[0])
+
+        result = self._disk_get(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put_memory(key, result)
+        return _detached(result)
+
+    def put(self, key: str, result: ShrinkResult):
+        with self.lock:
+            self._put_memory(key, _detached(result))
+        self._disk_put(key, result)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 1) if lookups else 0,
+                "disk_tier": bool(self.disk_dir),
+                "disk_entries": len(self._disk_entries),
+                "disk_bytes": self.disk_bytes
+            }
+
+    def _put_memory(self, key: str, result: ShrinkResult):
+        size = len(result.text.encode("utf-8", "surrogatepass")) + len(key)
+        if result.messages is not None:
+            size += len(json.dumps(result.messages, ensure_ascii=False).encode("utf-8", "surrogatepass"))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old[1]
+        self._entries[key] = (result, size)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _scan_disk(self):
+        """按修改时间恢复磁盘层的 LRU 顺序与总字节数，并淘汰超出上限的部分"""
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, name[:-len(".json")], st.st_size))
+        for _, key, size in sorted(files):
+            self._disk_entries[key] = size
+            self.disk_bytes += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.disk_max_bytes and self._disk_entries:
+            key, size = self._disk_entries.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass  # 其他进程已删除
+            except OSError as e:
+                logger.error(f"Failed to evict shrink cache entry {key}: {e}")
+
+    def _disk_get(self, key: str) -> Optional[ShrinkResult]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = ShrinkResult(**json.load(f))
+            os.utime(path)
+        except Exception as e:
+            logger.error(f"Failed to read shrink cache entry {key}: {e}")
+            return None
+        with self.lock:
+            if key in self._disk_entries:
+                self._disk_entries.move_to_end(key)
+        return result
+
+    def _disk_put(self, key: str, result: ShrinkResult):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(asdict(result), f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Failed to write shrink cache entry {key}: {e}")
+            return
+        with self.lock:
+            self.disk_bytes += size - self._disk_entries.pop(key, 0)
+            self._disk_entries[key] = size
+            self._evict_disk()
@@ -0,0 +1,121 @@
+import difflib
+import re
+from typing import List, Optional, Tuple
+
+# 代码块：```语言 [文件名]\n 正文 \n```
+FENCE_RE = re.compile(r'```([^\n]*)\n([\s\S]*?)\n?```')
+FILENAME_RE = re.compile(r'[\w./\\-]+\.[A-Za-z0-9]{1,8}')
+# 首行注释中的文件名，如 "# app.py"、"// file: src/index.ts"
+COMMENT_FILENAME_RE = re.compile(r'^\s*(?:#|//|--|/\*|<!--)\s*(?:file(?:name)?:\s*)?([\w./\\-]+\.[A-Za-z0-9]{1,8})')
+
+# 只分析最近的若干个代码块，保证开销与历史长度无关
+MAX_CODE_BLOCKS = 32
+# 最多保留的文件/代码组数，以及每组最多保留的历史 diff 数
+MAX_CODE_GROUPS = 3
+MAX_CODE_DIFFS = 3
+# 无文件名的代码块按行相似度归组
+SIMILARITY_THRESHOLD = 0.6
+DIFF_CONTEXT = 1
+
+class CodeBlock:
+    """一个代码块及其归组依据"""
+    __slots__ = ("raw", "lang", "filename", "lines")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        match = FENCE_RE.match(raw)
+        info, body = (match.group(1), match.group(2)) if match else ("", raw.strip("`"))
+        parts = info.split()
+        self.lang = parts[0] if parts and not FILENAME_RE.fullmatch(parts[0]) else ""
+        self.lines = body.split("\n")
+        self.filename = _find_filename(parts, self.lines)
+
+def _find_filename(info_parts: List[str], lines: List[str]) -> Optional[str]:
+    for part in info_parts:
+        if FILENAME_RE.fullmatch(part):
+            return part
+    if lines:
+        match = COMMENT_FILENAME_RE.match(lines[0])
+        if match:
+            return match.group(1)
+    return None
+
+def _similar(a: CodeBlock, b: CodeBlock) -> bool:
+    if a.lang != b.lang:
+        return False
+    matcher = difflib.SequenceMatcher(None, a.lines, b.lines, autojunk=False)
+    return matcher.real_quick_ratio() >= SIMILARITY_THRESHOLD and matcher.ratio() >= SIMILARITY_THRESHOLD
+
+def group_blocks(snippets: List[str]) -> List[List[CodeBlock]]:
+    """
+    按文件名 (优先) 或行相似度把代码块归组，组内按出现顺序排列；
+    返回的组按最后一次出现的先后排序。
+    """
+    groups: List[List[CodeBlock]] = []
+    for raw in snippets[-MAX_CODE_BLOCKS:]:
+        block = CodeBlock(raw)
+        target = None
+        # 优先与最近更新过的组比较
+        for group in reversed(groups):
+            latest = group[-1]
+            if block.filename or latest.filename:
+                matched = block.filename == latest.filename
+            else:
+                matched = _similar(latest, block)
+            if matched:
+                target = group
+                break
+        if target is None:
+            groups.append([block])
+        else:
+            groups.remove(target)
+            target.append(block)
+            groups.append(target)
+    return groups
+
+def version_diffs(group: List[CodeBlock]) -> Tuple[List[str], int]:
+    """
+    相邻版本之间的 unified diff (旧 -> 新)，只保留最近 MAX_CODE_DIFFS 个。
+    与后继版本完全相同、或 diff 不比旧版本本身更短 (整体重写) 的版本视为已被取代，直接丢弃。
+    返回 (diff 列表, 被丢弃的版本数)。
+    """
+    diffs: List[str] = []
+    dropped = 0
+    for older, newer in zip(group, group[1:]):
+        if older.lines == newer.lines:
+            dropped += 1
+            continue
+        # 去掉 ---/+++ 文件头，只保留 hunk
+        diff = "\n".join(list(difflib.unified_diff(older.lines, newer.lines, lineterm="", n=DIFF_CONTEXT))[2:])
+        if len(diff) >= len("\n".join(older.lines)):
+            dropped += 1
+            continue
+        diffs.append(diff)
+    if len(diffs) > MAX_CODE_DIFFS:
+        dropped += len(diffs) - MAX_CODE_DIFFS
+        diffs = diffs[-MAX_CODE_DIFFS:]
+    return diffs, dropped
+
+def render_code_history(snippets: List[str]) -> Optional[str]:
+    """
+    代码演进模式：每组保留最新的完整版本，较早的版本以紧凑的 unified diff 表示。
+    返回可直接附加在摘要后的代码段文本；没有代码块时返回 None。
+    """
+    if not snippets:
+        return None
+    groups = group_blocks(snippets)[-MAX_CODE_GROUPS:]
+    sections = []
+    for group in groups:
+        diffs, dropped = version_diffs(group)
+        name = group[-1].filename or group[-1].lang or "code"
+        parts = []
+        if len(group) > 1:
+            note = f"[代码演进: {name} 共 {len(group)} 个版本"
+            if dropped:
+                note += f"，省略 {dropped} 个已被取代的版本"
+            parts.append(note + "]")
+        for diff in diffs:
+            parts.append(f"```diff\n{diff}\n```")
+        parts.append(group[-1].raw)
+        sections.append("\n".join(parts))
+    return "\n\n".join(sections)
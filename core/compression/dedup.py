@@ -0,0 +1,173 @@
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from core.compression.patterns import KEY_RE, PATH_RE, HEAD_LINES, DEDUP_MARKER_PREFIX
+
+# 特征：英文单词 / 数字 (归一化为 0) / 单个非 ASCII 字符；以相邻特征二元组作为 shingle
+FEATURE_RE = re.compile(r'[a-z_]+|0|[^\x00-\x7f]|\x01')
+UNIT_SEP = "\x01"  # 拼接各单元的分隔符，使整批文本只需一次正则扫描
+DIGITS_RE = re.compile(r'\d+')
+# 过短的行替换为引用反而更长，只处理长度不低于该值的单元
+MIN_UNIT_CHARS = 32
+# SimHash 近似判定：64 位指纹汉明距离不超过 3；分 4 段 16 位建 LSH 索引 (鸽巢原理保证不漏检)
+MAX_DISTANCE = 3
+BANDS = 4
+BAND_BITS = 64 // BANDS
+MAX_CANDIDATES = 8
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 终混函数，把特征对编号打散成均匀的 64 位哈希"""
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+def simhash_many(texts: Sequence[str]) -> List[int]:
+    """
+    批量计算 64 位 SimHash：整批文本一次正则切分特征，特征对哈希与逐位投票全部向量化，
+    内存占用与特征总数成线性关系。
+    """
+    if not texts:
+        return []
+    n = len(texts)
+    joined = UNIT_SEP.join(t.replace(UNIT_SEP, " ") for t in texts)
+    features = FEATURE_RE.findall(DIGITS_RE.sub("0", joined.lower()))
+    vocab: Dict[str, int] = {UNIT_SEP: 0}
+    all_ids = np.fromiter((vocab.setdefault(f, len(vocab)) for f in features), dtype=np.uint64, count=len(features))
+    is_sep = all_ids == 0
+    owner_all = np.cumsum(is_sep)
+    id_arr = all_ids[~is_sep]
+    owner_arr = owner_all[~is_sep].astype(np.int64)
+    if len(id_arr) == 0:
+        return [0] * n
+
+    # 相邻且属于同一文本的特征组成 shingle；只有一个特征的文本用单特征本身
+    same = owner_arr[1:] == owner_arr[:-1]
+    pair_keys = id_arr[:-1][same] * np.uint64(len(vocab)) + id_arr[1:][same]
+    pair_owner = owner_arr[1:][same]
+    singles = np.bincount(owner_arr, minlength=n) == 1
+    if singles.any():
+        single_mask = singles[owner_arr]
+        pair_keys = np.concatenate((pair_keys, id_arr[single_mask] + np.uint64(1 << 40)))
+        pair_owner = np.concatenate((pair_owner, owner_arr[single_mask]))
+    hashes = _mix64(pair_keys)
+
+    fingerprints = np.zeros(n, dtype=np.uint64)
+    for bit in range(64):
+        bits = ((hashes >> np.uint64(bit)) & np.uint64(1)).astype(np.float64)
+        votes = np.bincount(pair_owner, weights=2 * bits - 1, minlength=n)
+        fingerprints |= (votes > 0).astype(np.uint64) << np.uint64(bit)
+    return [int(fp) for fp in fingerprints]
+
+def _units(lines: List[str]) -> List[Tuple[int, int]]:
+    """把行切分成去重单元 [start, end)：代码块整体为一个单元，其余每行一个单元"""
+    units = []
+    i = 0
+    while i < len(lines):
+        if lines[i].strip().startswith("```"):
+            j = i + 1
+            while j < len(lines) and not lines[j].strip().startswith("```"):
+                j += 1
+            if j < len(lines):
+                units.append((i, j + 1))
+                i = j + 1
+                continue
+        units.append((i, i + 1))
+        i += 1
+    return units
+
+def dedup_text(text: str) -> Tuple[str, int]:
+    """
+    近重复行/代码块消除：保留最后一次出现，较早的重复被替换为简短的回溯引用，
+    连续被替换的行合并为一条引用。头部 (系统提示) 与受保护实体不同的单元不参与合并。
+    返回 (去重后的文本, 被省略的行数)。整体为线性时间。
+    """
+    lines = text.split("\n")
+    units = _units(lines)
+
+    # 跳过头部的非空行
+    seen_head = 0
+    first_unit = 0
+    for first_unit, (start, end) in enumerate(units):
+        if seen_head >= HEAD_LINES:
+            break
+        seen_head += sum(1 for line in lines[start:end] if line.strip())
+    else:
+        return text, 0
+
+    candidates = [u for u in units[first_unit:] if sum(len(l) for l in lines[u[0]:u[1]]) >= MIN_UNIT_CHARS]
+    if not candidates:
+        return text, 0
+    bodies = ["\n".join(lines[s:e]) for s, e in candidates]
+    fingerprints = simhash_many(bodies)
+
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    kept_fp: List[int] = []
+    kept_idx: List[int] = []
+    entity_cache: Dict[int, frozenset] = {}
+    removed = [False] * len(lines)
+
+    def entities_of(i: int) -> frozenset:
+        # 受保护实体只在指纹命中后才提取
+        if i not in entity_cache:
+            body = bodies[i]
+            entity_cache[i] = frozenset(KEY_RE.findall(body)) | frozenset(PATH_RE.findall(body))
+        return entity_cache[i]
+
+    # 从后往前扫描：较晚的出现先入索引，因此总是保留最新的一次
+    for idx in range(len(candidates) - 1, -1, -1):
+        fp = fingerprints[idx]
+        bands = [(b, (fp >> (b * BAND_BITS)) & 0xFFFF) for b in range(BANDS)]
+
+        duplicate = False
+        for band in bands:
+            for kept in buckets.get(band, [])[-MAX_CANDIDATES:]:
+                if (fp ^ kept_fp[kept]).bit_count() <= MAX_DISTANCE and entities_of(kept_idx[kept]) == entities_of(idx):
+                    duplicate = True
+                    break
+            if duplicate:
+                break
+
+        if duplicate:
+            start, end = candidates[idx]
+            for i in range(start, end):
+                removed[i] = True
+            continue
+
+        slot = len(kept_fp)
+        kept_fp.append(fp)
+        kept_idx.append(idx)
+        for band in bands:
+            buckets.setdefault(band, []).append(slot)
+
+    out: List[str] = []
+    total_removed = 0
+    run: List[str] = []
+
+    def close_run():
+        nonlocal total_removed
+        marker = dedup_marker(len(run))
+        # 引用不比原文短时保留原文
+        if sum(len(line) for line in run) > len(marker):
+            out.append(marker)
+            total_removed += len(run)
+        else:
+            out.extend(run)
+        run.clear()
+
+    for i, line in enumerate(lines):
+        if removed[i]:
+            if line.strip():
+                run.append(line)
+            continue
+        if run:
+            close_run()
+        out.append(line)
+    if run:
+        close_run()
+    return "\n".join(out), total_removed
+
+def dedup_marker(count: int) -> str:
+    return f"{DEDUP_MARKER_PREFIX}已省略 {count} 行重复内容，见后文最新一次]"
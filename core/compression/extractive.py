@@ -0,0 +1,101 @@
+import re
+from typing import List, Sequence
+
+import numpy as np
+
+from core.compression.patterns import KEY_RE, PATH_RE, DEDUP_MARKER_PREFIX
+
+# 句子切分：中文标点后直接切分，英文句号需后随空白，避免切断路径与版本号
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[。！？；!?;])|(?<=\.)\s+')
+# 检索词：英文单词/标识符 + 中文字符二元组
+WORD_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]+|[\u4e00-\u9fa5]+')
+
+# 综合打分权重：与尾部对话的相关度 / 实体密度 / 时间新近度
+W_RELEVANCE = 0.6
+W_ENTITY = 0.25
+W_RECENCY = 0.15
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def split_sentences(lines: Sequence[str]) -> List[str]:
+    """把中间层的行切成句子，代码块内的行被跳过 (最新代码块会单独附带)"""
+    sentences = []
+    in_fence = False
+    for line in lines:
+        if line.startswith("```"):
+            in_fence = not in_fence
+            continue
+        if in_fence or line.startswith(DEDUP_MARKER_PREFIX):
+            continue
+        for part in SENTENCE_SPLIT_RE.split(line):
+            part = part.strip()
+            if part:
+                sentences.append(part)
+    return sentences
+
+def _terms(text: str) -> List[str]:
+    terms = []
+    for word in WORD_RE.findall(text):
+        if "\u4e00" <= word[0] <= "\u9fa5":
+            terms.extend(word[i:i + 2] for i in range(max(len(word) - 1, 1)))
+        else:
+            terms.append(word.lower())
+    return terms
+
+def score_sentences(sentences: Sequence[str], query: str) -> np.ndarray:
+    """
+    为每个句子计算重要度：以最近对话为查询的 BM25 相关度、受保护实体密度与新近度加权求和。
+    词项统计在一次 NumPy 向量化计算中完成。
+    """
+    n = len(sentences)
+    if n == 0:
+        return np.zeros(0)
+
+    vocab = {}
+    sent_ids: List[int] = []
+    term_ids: List[int] = []
+    entity_counts = np.zeros(n)
+    for i, sentence in enumerate(sentences):
+        for term in _terms(sentence):
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            sent_ids.append(i)
+        entity_counts[i] = len(KEY_RE.findall(sentence)) + len(PATH_RE.findall(sentence))
+
+    relevance = np.zeros(n)
+    query_ids = [vocab[t] for t in set(_terms(query)) if t in vocab]
+    if term_ids and query_ids:
+        sent_arr = np.asarray(sent_ids, dtype=np.int64)
+        term_arr = np.asarray(term_ids, dtype=np.int64)
+        v = len(vocab)
+        # (句子, 词项) 去重得到词频，再得到文档频率
+        pairs, tf = np.unique(sent_arr * v + term_arr, return_counts=True)
+        pair_sent, pair_term = pairs // v, pairs % v
+        df = np.bincount(pair_term, minlength=v)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        doc_len = np.bincount(sent_arr, minlength=n)
+        avg_len = max(doc_len.mean(), 1.0)
+
+        in_query = np.zeros(v, dtype=bool)
+        in_query[query_ids] = True
+        mask = in_query[pair_term]
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[pair_sent[mask]] / avg_len)
+        contrib = idf[pair_term[mask]] * tf[mask] * (BM25_K1 + 1) / (tf[mask] + norm)
+        relevance = np.bincount(pair_sent[mask], weights=contrib, minlength=n)
+
+    recency = np.arange(n) / max(n - 1, 1)
+    return (W_RELEVANCE * _normalize(relevance)
+            + W_ENTITY * _normalize(entity_counts)
+            + W_RECENCY * recency)
+
+def select_within_budget(scores: np.ndarray, token_counts: Sequence[int], budget: int) -> List[int]:
+    """按重要度从高到低累加，直到达到 Token 预算；返回按原文顺序排列的句子下标"""
+    if budget <= 0 or len(scores) == 0:
+        return []
+    order = np.argsort(-scores, kind="stable")
+    cumulative = np.cumsum(np.asarray(token_counts)[order])
+    keep = order[cumulative <= budget]
+    return sorted(keep.tolist())
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    peak = values.max() if len(values) else 0
+    return values / peak if peak > 0 else values
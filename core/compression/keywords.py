@@ -0,0 +1,32 @@
+import heapq
+import re
+from typing import Dict, Iterable, List, Optional
+
+from core.segmenter import STOPWORDS, get_segmenter
+
+# 摘要关键词候选：中文片段 (再经词典分词) 与首字母大写的英文单词 (驼峰词整体保留，如 DeepSeek)
+TERM_RE = re.compile(r'[一-龥]+|[A-Z][a-z]{3,}(?:[A-Z][a-z]+)*')
+MIN_TERM_CHARS = 2
+
+def extract_keywords(text: str) -> List[str]:
+    """按出现顺序提取关键词：中文按词典分词，过滤单字与停用词"""
+    segmenter = get_segmenter()
+    keywords: List[str] = []
+    for match in TERM_RE.findall(text):
+        if match[0] < "一":
+            if match not in STOPWORDS:
+                keywords.append(match)
+            continue
+        keywords.extend(w for w in segmenter.cut(match) if len(w) >= MIN_TERM_CHARS and w not in STOPWORDS)
+    return keywords
+
+def count_keywords(keywords: Iterable[str], counts: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """累加词频；字典保持首次出现顺序"""
+    counts = {} if counts is None else counts
+    for kw in keywords:
+        counts[kw] = counts.get(kw, 0) + 1
+    return counts
+
+def top_keywords(counts: Dict[str, int], limit: int) -> List[str]:
+    """按词频降序取前 limit 个，词频相同时先出现的在前"""
+    return [kw for kw, _ in heapq.nsmallest(limit, counts.items(), key=lambda item: -item[1])]
@@ -0,0 +1,74 @@
+from typing import List, Optional, Sequence, Tuple
+
+from core.compression.keywords import extract_keywords, count_keywords, top_keywords
+from core.compression.patterns import MAX_ENTITIES, MAX_KEYWORDS
+
+# 缓存友好布局：中间层按固定行数切段，写满的段冻结为摘要行，之后只追加不修改
+SEGMENT_LINES = 40
+SEGMENT_KEYWORDS = 8
+# 冻结段数超过上限时两两合并 (层级加一)，前缀只在合并时变化一次，随对话长度呈对数次
+MAX_FROZEN_SEGMENTS = 32
+
+LAYOUTS = ("default", "cache")
+
+def merge_keywords(*parts: Sequence[str]) -> List[str]:
+    return list(dict.fromkeys(kw for part in parts for kw in part))[:SEGMENT_KEYWORDS]
+
+def segment_keywords(lines: Sequence[str]) -> List[str]:
+    """一个段内词频最高的关键词"""
+    return top_keywords(count_keywords(extract_keywords(" ".join(lines))), SEGMENT_KEYWORDS)
+
+class FrozenSegments:
+    """
+    只追加的冻结摘要段。每个基础段覆盖 SEGMENT_LINES 行，段数超限时按固定的二叉分组合并，
+    因此同一段对话无论一次性输入还是逐轮增量输入，得到的冻结段都相同。
+    """
+    def __init__(self):
+        self.level = 0
+        self.frozen: List[List[str]] = []
+        # 尚未凑满当前层级的部分合并结果，(层级, 关键词)，层级自底向上严格递减
+        self._stack: List[Tuple[int, List[str]]] = []
+
+    def push(self, keywords: List[str]):
+        self._stack.append((0, keywords))
+        while len(self._stack) >= 2 and self._stack[-1][0] == self._stack[-2][0] < self.level:
+            level, right = self._stack.pop()
+            _, left = self._stack.pop()
+            self._stack.append((level + 1, merge_keywords(left, right)))
+        if self._stack[0][0] == self.level:
+            self.frozen.append(self._stack.pop()[1])
+            if len(self.frozen) > MAX_FROZEN_SEGMENTS:
+                self._promote()
+
+    def pending_keywords(self) -> List[str]:
+        """已写满基础段、但尚未冻结的关键词 (属于易变部分)"""
+        return list(dict.fromkeys(kw for _, part in self._stack for kw in part))
+
+    def _promote(self):
+        merged = [merge_keywords(self.frozen[i], self.frozen[i + 1]) for i in range(0, len(self.frozen) - 1, 2)]
+        if len(self.frozen) % 2:
+            self._stack.insert(0, (self.level, self.frozen[-1]))
+        self.frozen = merged
+        self.level += 1
+
+    def render(self) -> List[str]:
+        return [f"[历史摘要: {', '.join(kw)}]" for kw in self.frozen]
+
+def render_cache_friendly(header: List[str], frozen: List[str], recent_points: List[str],
+                          entities: List[str], mem_info: str, tail: List[str], latest_code: Optional[str],
+                          abstracts: Sequence[str] = ()) -> str:
+    """
+    缓存友好布局 (不含 OPTIMIZED_PREFIX)：头部与冻结段构成逐字节稳定的前缀，
+    分层摘要 (异步就绪)、近期摘要、受保护实体、长效记忆、尾部对话与代码等易变部分全部放在末尾。
+    """
+    parts = list(header) + frozen
+    parts.extend(f"[对话摘要: {text}]" for text in abstracts)
+    volatile = f"[近期上下文摘要: 讨论了 {', '.join(recent_points[-MAX_KEYWORDS:])}]"
+    if entities:
+        volatile += f" | 关键实体: {', '.join(entities[:MAX_ENTITIES])}"
+    parts.append(volatile + mem_info)
+    parts.extend(tail)
+    final_summary = "\n".join(parts)
+    if latest_code:
+        final_summary += f"\n\n[附带最新代码片段引用]\n{latest_code}"
+    return final_summary
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List, Tuple
+
+from core.compression.cache import ShrinkResult
+from core.compression.patterns import KEY_RE, PATH_RE, MAX_ENTITIES
+from core.compression.pipeline import shrink_text
+from core.tokenizer import count_tokens
+
+Message = Dict[str, Any]
+
+# 最近 N 轮 (从倒数第 N 条 user 消息开始) 原样保留
+KEEP_TURNS = 3
+# 较早的工具输出只保留首行 (截断到该长度) 与受保护实体
+TOOL_STUB_CHARS = 200
+ROLE_LABELS = {"system": "System", "user": "User", "assistant": "AI", "tool": "Tool"}
+
+def message_text(message: Message) -> str:
+    """取出消息的文本内容，兼容字符串与 OpenAI 多段 content 格式 (非文本段忽略)"""
+    content = message.get("content")
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
+
+def _flatten(message: Message) -> str:
+    """把一条较早的消息转成摘要器输入的一行 (或多行) 文本，工具输出在此处被强压缩"""
+    role = message.get("role", "user")
+    text = message_text(message)
+    if role == "tool":
+        lines = [line.strip() for line in text.split("\n") if line.strip()]
+        first = lines[0] if lines else ""
+        if len(lines) <= 1 and len(first) <= TOOL_STUB_CHARS:
+            return f"Tool: {first}"
+        stub = f"Tool: {first[:TOOL_STUB_CHARS]} [工具输出已压缩: 共 {len(lines)} 行]"
+        entities = list(dict.fromkeys(KEY_RE.findall(text) + PATH_RE.findall(text)))[:MAX_ENTITIES]
+        if entities:
+            stub += " " + " ".join(entities)
+        return stub
+    if message.get("tool_calls"):
+        names = ", ".join(call.get("function", {}).get("name", "?") for call in message["tool_calls"])
+        text = f"{text}\n[调用工具: {names}]" if text else f"[调用工具: {names}]"
+    return f"{ROLE_LABELS.get(role, role.capitalize())}: {text}"
+
+def _count(messages: List[Message], provider: str) -> Tuple[int, int]:
+    texts = [message_text(m) for m in messages]
+    return sum(count_tokens(t, provider) for t in texts), sum(len(t) for t in texts)
+
+def shrink_messages(messages: List[Message], provider: str = "deepseek", mem_info: str = "",
+                    keep_turns: int = KEEP_TURNS, **options: Any) -> ShrinkResult:
+    """
+    按角色压缩 OpenAI 格式的消息数组，返回可直接转发给厂商的消息数组 (ShrinkResult.messages)：
+    - system 消息固定保留；
+    - 最近 keep_turns 轮 user/assistant (及其间的 tool) 消息原样保留；
+    - 更早的消息合并为一条 system 摘要，其中工具输出只保留首行与受保护实体。
+    options 透传给 shrink_text，作用于较早历史的摘要。
+    """
+    user_positions = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+    if keep_turns <= 0:
+        window_start = len(messages)
+    elif len(user_positions) > keep_turns:
+        window_start = user_positions[-keep_turns]
+    else:
+        return ShrinkResult(text="", messages=list(messages), compressed=False)
+
+    older = messages[:window_start]
+    pinned = [m for m in older if m.get("role") == "system"]
+    history = [m for m in older if m.get("role") != "system"]
+    summary = shrink_text("\n".join(_flatten(m) for m in history), provider, mem_info, **options)
+    if not summary.compressed:
+        return ShrinkResult(text="", messages=list(messages), compressed=False)
+
+    result = pinned + [{"role": "system", "content": summary.text}] + messages[window_start:]
+    original_tokens, original_chars = _count(messages, provider)
+    optimized_tokens, optimized_chars = _count(result, provider)
+    return ShrinkResult(
+        text=summary.text,
+        original_tokens=original_tokens,
+        optimized_tokens=optimized_tokens,
+        original_chars=original_chars,
+        optimized_chars=optimized_chars,
+        messages=result,
+        aliases=summary.aliases
+    )
@@ -0,0 +1,48 @@
+import re
+from typing import List, Optional, Sequence
+
+# 保护性提取规则：API Key / 文件路径 / 代码块
+KEY_RE = re.compile(r'sk-[a-zA-Z0-9]{20,}')
+PATH_RE = re.compile(r'[a-zA-Z]:\\[^ \n]+|/[a-zA-Z0-9/_.-]+')
+CODE_RE = re.compile(r'```[\s\S]*?```')
+
+# 压缩配方参数 (与 OmniEngine.compress_context 保持一致)
+MIN_CHARS = 400
+MIN_LINES = 10
+HEAD_LINES = 2
+TAIL_LINES = 6
+MAX_KEYWORDS = 20
+MAX_ENTITIES = 5
+
+OPTIMIZED_PREFIX = "[Omni Optimized Context]\n"
+# 去重阶段生成的回溯引用行前缀，摘要阶段不从这些行提取内容
+DEDUP_MARKER_PREFIX = "[≈ "
+
+def render_summary(header: List[str], mem_info: str, summary_points: List[str],
+                   entities: List[str], tail: List[str], latest_code: Optional[str],
+                   abstracts: Sequence[str] = ()) -> str:
+    """按统一格式组装压缩结果 (不含 OPTIMIZED_PREFIX)；abstracts 为按时间顺序的分层摘要"""
+    compressed_middle = "".join(f"\n[对话摘要: {text}]" for text in abstracts)
+    compressed_middle += f"\n[历史上下文压缩摘要: 讨论了 {', '.join(summary_points)}]"
+    if entities:
+        compressed_middle += f" | 关键实体: {', '.join(entities[:MAX_ENTITIES])}"
+    return _assemble(header, mem_info, compressed_middle, tail, latest_code)
+
+def render_extractive(header: List[str], mem_info: str, kept: List[str], total: int,
+                      entities: List[str], tail: List[str], latest_code: Optional[str]) -> str:
+    """预算模式：中间层为按原文顺序保留的高价值句子"""
+    compressed_middle = f"\n[历史上下文精选: 保留 {len(kept)}/{total} 句]"
+    if entities:
+        compressed_middle += f" | 关键实体: {', '.join(entities[:MAX_ENTITIES])}"
+    if kept:
+        compressed_middle += "\n" + "\n".join(kept)
+    return _assemble(header, mem_info, compressed_middle, tail, latest_code)
+
+def _assemble(header: List[str], mem_info: str, compressed_middle: str,
+              tail: List[str], latest_code: Optional[str]) -> str:
+    final_summary = "\n".join(header) + mem_info + compressed_middle + "\n" + "\n".join(tail)
+
+    # 如果有代码块，选择性保留最新的一个
+    if latest_code:
+        final_summary += f"\n\n[附带最新代码片段引用]\n{latest_code}"
+    return final_summary
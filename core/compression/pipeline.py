@@ -0,0 +1,144 @@
+import logging
+import math
+from typing import List, Optional
+
+from core.compression.alias import alias_entities, render_legend
+from core.compression.cache import ShrinkResult
+from core.compression.extractive import split_sentences, score_sentences, select_within_budget
+from core.compression.patterns import (
+    KEY_RE, PATH_RE, CODE_RE,
+    MIN_LINES, HEAD_LINES, TAIL_LINES, MAX_KEYWORDS,
+    OPTIMIZED_PREFIX, DEDUP_MARKER_PREFIX, render_summary, render_extractive,
+)
+from core.compression.codediff import render_code_history
+from core.compression.dedup import dedup_text
+from core.compression.structured import compress_structured
+from core.compression.keywords import extract_keywords, count_keywords, top_keywords
+from core.compression.layout import FrozenSegments, SEGMENT_LINES, segment_keywords, render_cache_friendly
+from core.tokenizer import count_tokens, get_counter
+
+logger = logging.getLogger("omni.compression.pipeline")
+
+def shrink_text(context: str, provider: str = "deepseek", mem_info: str = "",
+                target_tokens: Optional[int] = None, target_ratio: Optional[float] = None,
+                dedup: bool = True, code_diff: bool = False, layout: str = "default",
+                alias: bool = False, structured: bool = True) -> ShrinkResult:
+    """
+    执行一次完整的压缩计算。纯函数，不依赖引擎实例，可在进程池中运行。
+    mem_info 为调用方预先生成的长效记忆提示；dedup 控制是否先做近重复消除；
+    code_diff 开启代码演进模式：同一文件的多个版本只保留最新全文，旧版本以 diff 表示。
+    structured 控制是否用专用压缩器处理 JSON、日志与堆栈等工具输出。
+    layout="cache" 输出缓存友好布局，前缀逐轮稳定以命中厂商侧的提示词缓存
+    (该布局下不做近重复消除与结构化压缩，因为它们会改写较早的内容；预算模式下忽略该选项)。
+    alias 开启可逆别名替换：重复出现的长路径/URL/UUID/密钥替换为 §P1 等短句柄，
+    别名表随结果返回 (ShrinkResult.aliases)，用 expand_aliases 还原模型输出。
+    """
+    original_len = len(context)
+    original_tokens = count_tokens(context, provider)
+    budget = None
+    if target_tokens or target_ratio:
+        budget = target_tokens or math.ceil(original_tokens * target_ratio)
+        if original_tokens <= budget:
+            return ShrinkResult(text=context, compressed=False)
+    
+    lines = [line.strip() for line in context.split("\n") if line.strip()]
+    if len(lines) <= MIN_LINES:
+        return ShrinkResult(text=context, compressed=False)
+
+    # 代码块在去重之前提取，保证代码演进模式能看到每一个历史版本
+    code_snippets = CODE_RE.findall(context)
+
+    # 0.1 结构化压缩：JSON 压缩/表格化、日志模板聚类、堆栈折叠
+    if structured and layout != "cache":
+        context, rewritten = compress_structured(context)
+        if rewritten:
+            lines = [line.strip() for line in context.split("\n") if line.strip()]
+
+    # 0.2 近重复消除：重复的工具输出/日志/代码只保留最新一次，先于有损摘要执行
+    if dedup and layout != "cache":
+        context, removed = dedup_text(context)
+        if removed:
+            lines = [line.strip() for line in context.split("\n") if line.strip()]
+
+    # 1. 保护性提取：防止压缩破坏关键信息
+    # 保护 API Keys
+    keys = KEY_RE.findall(context)
+    # 保护 文件路径
+    paths = PATH_RE.findall(context)
+    important_entities = list(dict.fromkeys(keys + paths))
+    
+    # 2. 结构化降噪
+    # 保留最近的对话 (Last 5 lines) 和 系统提示 (First 2 lines)
+    header = lines[:HEAD_LINES]
+    tail = lines[-TAIL_LINES:]
+    
+    # 3. 中间层语义压缩
+    middle_lines = lines[HEAD_LINES:-TAIL_LINES]
+    if code_diff:
+        latest_code = render_code_history(code_snippets)
+    else:
+        latest_code = code_snippets[-1] if code_snippets else None
+
+    if budget is not None:
+        final_summary = _select_middle(
+            header, mem_info, middle_lines, tail, important_entities, latest_code, provider, budget
+        )
+    elif layout == "cache":
+        final_summary = _cache_friendly(header, mem_info, middle_lines, tail, important_entities, latest_code)
+    else:
+        middle_text = " ".join(line for line in middle_lines if not line.startswith(DEDUP_MARKER_PREFIX))
+
+        # 词典分词提取关键词，按词频排序作为摘要
+        summary_points = top_keywords(count_keywords(extract_keywords(middle_text)), MAX_KEYWORDS)
+
+        # 重新组装 (如果有代码块，选择性保留最新的一个)
+        final_summary = render_summary(
+            header, mem_info, summary_points, important_entities, tail, latest_code
+        )
+
+    aliases = None
+    if alias:
+        final_summary, aliases = alias_entities(final_summary)
+        if aliases:
+            # 缓存友好布局把别名表放在末尾，不影响稳定前缀
+            legend = render_legend(aliases)
+            final_summary = f"{final_summary}\n{legend}" if layout == "cache" else f"{legend}\n{final_summary}"
+
+    optimized_tokens = count_tokens(final_summary, provider)
+    logger.info(f"Token Optimized: {original_tokens} -> {optimized_tokens} tokens ({original_len} -> {len(final_summary)} chars)")
+    return ShrinkResult(
+        text=OPTIMIZED_PREFIX + final_summary,
+        original_tokens=original_tokens,
+        optimized_tokens=optimized_tokens,
+        original_chars=original_len,
+        optimized_chars=len(final_summary),
+        aliases=aliases or None
+    )
+
+def _cache_friendly(header: List[str], mem_info: str, middle_lines: List[str], tail: List[str],
+                    entities: List[str], latest_code: Optional[str]) -> str:
+    """缓存友好布局：中间层从头按固定行数切段，写满的段冻结，剩余部分作为近期摘要"""
+    segments = FrozenSegments()
+    frozen_end = len(middle_lines) - len(middle_lines) % SEGMENT_LINES
+    for start in range(0, frozen_end, SEGMENT_LINES):
+        segments.push(segment_keywords(middle_lines[start:start + SEGMENT_LINES]))
+    recent_points = list(dict.fromkeys(segments.pending_keywords() + segment_keywords(middle_lines[frozen_end:])))
+    return render_cache_friendly(header, segments.render(), recent_points, entities, mem_info, tail, latest_code)
+
+def _select_middle(header: List[str], mem_info: str, middle_lines: List[str], tail: List[str],
+                   entities: List[str], latest_code: Optional[str], provider: str, budget: int) -> str:
+    """预算模式：为中间层句子打分，按原文顺序保留最有价值的句子直到用完预算"""
+    sentences = split_sentences(middle_lines)
+    skeleton = OPTIMIZED_PREFIX + render_extractive(
+        header, mem_info, [], len(sentences), entities, tail, latest_code
+    )
+    # 预留 "保留 k/n 句" 计数变化的余量
+    remaining = budget - count_tokens(skeleton, provider) - 2
+
+    counter = get_counter(provider)
+    scores = score_sentences(sentences, " ".join(tail))
+    token_counts = [counter.count(sentence) + 1 for sentence in sentences]  # +1 为换行符
+    keep = select_within_budget(scores, token_counts, remaining)
+    return render_extractive(
+        header, mem_info, [sentences[i] for i in keep], len(sentences), entities, tail, latest_code
+    )
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from core.compression.cache import ShrinkResult
+from core.compression.pipeline import shrink_text
+
+logger = logging.getLogger("omni.compression.pool")
+
+# 单个压缩任务: shrink_text 的关键字参数
+ShrinkJob = Dict[str, Any]
+
+def _run_job(job: ShrinkJob) -> ShrinkResult:
+    return shrink_text(**job)
+
+def _warmup() -> int:
+    return os.getpid()
+
+class ShrinkPool:
+    """
+    批量压缩进程池：首次使用时创建并常驻复用，通过信号量限制同时在途的任务数，
+    避免大批量请求把全部上下文一次性塞进进程间队列。
+    asyncio 信号量只能在创建它的事件循环中使用：每个事件循环各有一个 (同一循环内的并发批量共享上限)。
+    """
+    def __init__(self, max_workers: Optional[int] = None, max_inflight: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_inflight = max_inflight or self.max_workers * 2
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary())
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn 在 Windows / 多线程宿主 (uvicorn 线程) 下都是安全的
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                    logger.info(f"Shrink pool started with {self.max_workers} workers")
+        return self._executor
+
+    def warm(self):
+        """预先拉起全部工作进程并完成模块导入，避免首个批量请求承担启动开销"""
+        futures = [self.executor.submit(_warmup) for _ in range(self.max_workers)]
+        pids = {f.result() for f in futures}
+        logger.info(f"Shrink pool warmed: {len(pids)} workers ready")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    async def imap_unordered(self, jobs: List[ShrinkJob]) -> AsyncIterator[Tuple[int, ShrinkResult]]:
+        """按完成顺序产出 (下标, 结果)"""
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_inflight)
+
+        async def run_one(index: int, job: ShrinkJob) -> Tuple[int, ShrinkResult]:
+            async with semaphore:
+                return index, await loop.run_in_executor(executor, _run_job, job)
+
+        tasks = [asyncio.ensure_future(run_one(i, job)) for i, job in enumerate(jobs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def map(self, jobs: List[ShrinkJob]) -> List[ShrinkResult]:
+        """按输入顺序返回全部结果"""
+        results: List[Optional[ShrinkResult]] = [None] * len(jobs)
+        async for index, result in self.imap_unordered(jobs):
+            results[index] = result
+        return results
@@ -0,0 +1,205 @@
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+
+from core.compression.patterns import (
+    KEY_RE, PATH_RE, CODE_RE,
+    MIN_CHARS, MIN_LINES, HEAD_LINES, TAIL_LINES, MAX_KEYWORDS, MAX_ENTITIES,
+    render_summary,
+)
+from core.compression.keywords import extract_keywords, count_keywords, top_keywords
+from core.compression.layout import FrozenSegments, SEGMENT_LINES, SEGMENT_KEYWORDS, render_cache_friendly
+from core.compression.abstractive import SummaryTree
+
+# 关键词词频表上限：超出时淘汰词频最低 (同频时最早出现) 的关键词，保证单会话内存恒定
+MAX_ROLLING_KEYWORDS = 256
+# 未闭合代码块的最大缓存长度，超过则放弃等待闭合
+MAX_FENCE_CARRY = 64 * 1024
+
+class ShrinkSession:
+    """
+    增量压缩会话：缓存压缩器的中间状态，每次只处理新增的对话轮次。
+    状态包括：头部 (系统提示)、滚动关键词、受保护实体、最新代码块与尾部窗口。
+    summary_chars > 0 时，中间层原文每累计该字符数切出一段，交给调用方做后台摘要 (见 pop_summary_segments)。
+    """
+    def __init__(self, session_id: str, summary_chars: int = 0):
+        self.session_id = session_id
+        self.lock = Lock()
+        self.header: List[str] = []
+        self.tail: deque = deque(maxlen=TAIL_LINES)
+        self.keywords: Dict[str, int] = {}  # 关键词 -> 词频，保持首次出现顺序
+        self.keys: Dict[str, None] = {}
+        self.paths: Dict[str, None] = {}
+        self.latest_code: Optional[str] = None
+        # 缓存友好布局的冻结段与当前未写满段的关键词
+        self.segments = FrozenSegments()
+        self._segment_counts: Dict[str, int] = {}
+        self._segment_lines = 0
+        # 分层摘要：待摘要的原文缓冲与已切出、尚未交给调用方的段
+        self.summary_chars = summary_chars
+        self.summaries = SummaryTree()
+        self._summary_buffer: List[str] = []
+        self._summary_buffer_chars = 0
+        self._summary_segments: List[str] = []
+        self.char_count = 0
+        self.line_count = 0
+        self.token_count = 0  # 由调用方按厂商分词器累加
+        self.last_access = time.monotonic()
+        self._fence_carry = ""
+        # 未达到压缩阈值前保留原文，之后释放
+        self._raw_parts: Optional[List[str]] = []
+
+    @property
+    def compressible(self) -> bool:
+        return self.char_count >= MIN_CHARS and self.line_count > MIN_LINES
+
+    def append(self, delta: str):
+        """吸收新增的对话内容，耗时只与 delta 的长度相关"""
+        if not delta:
+            return
+        if self.char_count:
+            self.char_count += 1  # 与上一段之间的换行
+        self.char_count += len(delta)
+
+        self._scan_entities(delta)
+        self._scan_code(delta)
+
+        for raw in delta.split("\n"):
+            line = raw.strip()
+            if not line:
+                continue
+            self.line_count += 1
+            if len(self.header) < HEAD_LINES:
+                self.header.append(line)
+                continue
+            if len(self.tail) == TAIL_LINES:
+                self._absorb_middle(self.tail[0])
+            self.tail.append(line)
+
+        if self._raw_parts is not None:
+            if self.compressible:
+                self._raw_parts = None
+            else:
+                self._raw_parts.append(delta)
+
+    def raw_text(self) -> str:
+        return "\n".join(self._raw_parts or [])
+
+    def recent_text(self) -> str:
+        """头部与尾部窗口的原文 (用于检索相关的长效记忆)"""
+        return "\n".join(self.header + list(self.tail))
+
+    def pop_summary_segments(self) -> List[str]:
+        """取出已切出的待摘要原文段"""
+        segments, self._summary_segments = self._summary_segments, []
+        return segments
+
+    def render(self, mem_info: str = "", layout: str = "default", abstracts: Sequence[str] = ()) -> str:
+        """abstracts 为已就绪的分层摘要 (按时间顺序)，放在关键词摘要之前"""
+        entities = (list(self.keys) + list(self.paths))[:MAX_ENTITIES]
+        if layout == "cache":
+            recent_points = list(dict.fromkeys(
+                self.segments.pending_keywords() + top_keywords(self._segment_counts, SEGMENT_KEYWORDS)
+            ))
+            return render_cache_friendly(self.header, self.segments.render(), recent_points, entities,
+                                         mem_info, list(self.tail), self.latest_code, abstracts)
+        summary_points = top_keywords(self.keywords, MAX_KEYWORDS)
+        return render_summary(self.header, mem_info, summary_points, entities, list(self.tail), self.latest_code,
+                              abstracts)
+
+    def _absorb_middle(self, line: str):
+        """行离开尾部窗口后进入中间层，只在此时做关键词提取"""
+        found = extract_keywords(line)
+        count_keywords(found, self._segment_counts)
+        self._segment_lines += 1
+        if self._segment_lines == SEGMENT_LINES:
+            self.segments.push(top_keywords(self._segment_counts, SEGMENT_KEYWORDS))
+            self._segment_counts = {}
+            self._segment_lines = 0
+        if self.summary_chars:
+            self._summary_buffer.append(line)
+            self._summary_buffer_chars += len(line) + 1
+            if self._summary_buffer_chars >= self.summary_chars:
+                self._summary_segments.append("\n".join(self._summary_buffer))
+                self._summary_buffer = []
+                self._summary_buffer_chars = 0
+        for kw in found:
+            if kw not in self.keywords and len(self.keywords) >= MAX_ROLLING_KEYWORDS:
+                # 淘汰词频最低的关键词 (min 返回第一个最小值，即同频中最早出现的)
+                del self.keywords[min(self.keywords, key=self.keywords.get)]
+            self.keywords[kw] = self.keywords.get(kw, 0) + 1
+
+    def _scan_entities(self, delta: str):
+        for key in KEY_RE.findall(delta):
+            if len(self.keys) >= MAX_ENTITIES:
+                break
+            self.keys.setdefault(key, None)
+        for path in PATH_RE.findall(delta):
+            if len(self.paths) >= MAX_ENTITIES:
+                break
+            self.paths.setdefault(path, None)
+
+    def _scan_code(self, delta: str):
+        text = f"{self._fence_carry}\n{delta}" if self._fence_carry else delta
+        last_end = 0
+        for m in CODE_RE.finditer(text):
+            self.latest_code = m.group(0)
+            last_end = m.end()
+        rest = text[last_end:]
+        idx = rest.find("```")
+        self._fence_carry = rest[idx:] if idx != -1 else ""
+        if len(self._fence_carry) > MAX_FENCE_CARRY:
+            self._fence_carry = ""
+
+class ShrinkSessionStore:
+    """
+    有界会话存储：按最近访问排序，超过容量或空闲超时的会话会被淘汰。
+    """
+    def __init__(self, max_sessions: int = 1024, idle_ttl: float = 1800.0, summary_chars: int = 0):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.summary_chars = summary_chars
+        self.lock = Lock()
+        self._sessions: "OrderedDict[str, ShrinkSession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def get(self, session_id: str) -> ShrinkSession:
+        """获取 (或创建) 会话，并顺带执行淘汰"""
+        now = time.monotonic()
+        with self.lock:
+            self._evict_idle(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ShrinkSession(session_id, self.summary_chars)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_access = now
+            return session
+
+    def drop(self, session_id: str) -> bool:
+        with self.lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def evict_idle(self) -> int:
+        with self.lock:
+            return self._evict_idle(time.monotonic())
+
+    def _evict_idle(self, now: float) -> int:
+        # 有序字典的头部即最久未访问的会话
+        evicted = 0
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_access < self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            evicted += 1
+        return evicted
@@ -0,0 +1,179 @@
+import codecs
+import mmap
+import os
+import zlib
+from typing import Callable, Iterator, Optional
+
+from core.compression.cache import ShrinkResult
+from core.compression.patterns import OPTIMIZED_PREFIX
+from core.compression.session import ShrinkSession
+from core.tokenizer import count_tokens
+
+# 文件按该大小分块映射读取
+CHUNK_BYTES = 1 << 20
+# 超长的单行在缓冲超过该长度后强制切开，保证内存有界
+MAX_LINE_CARRY = 4 << 20
+# zstd 解压对象不支持限制输出长度，按该大小切分输入喂入；
+# 单个 RLE 块 4 字节即可展开为 128KB，每次调用的输出因此不超过约 8MB
+ZSTD_INPUT_SLICE = 256
+
+_SUFFIX_ENCODINGS = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+class InflateLimitExceeded(ValueError):
+    """解压后的数据超过上限 (解压炸弹)"""
+
+class _Inflater:
+    """解压器基类：max_bytes 为解压输出总量上限，None 表示不限制 (流式压缩本身内存有界)"""
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.total = 0
+
+    def _count(self, chunk: bytes) -> bytes:
+        self.total += len(chunk)
+        if self.max_bytes is not None and self.total > self.max_bytes:
+            raise InflateLimitExceeded(f"解压后的数据超过 {self.max_bytes} 字节")
+        return chunk
+
+class _Identity(_Inflater):
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        yield self._count(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+class _Gzip(_Inflater):
+    def __init__(self, max_bytes: Optional[int] = None):
+        super().__init__(max_bytes)
+        self._obj = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        # 限制单次解压输出，高压缩比的输入也不会一次性展开到内存
+        while data:
+            yield self._count(self._obj.decompress(data, CHUNK_BYTES))
+            data = self._obj.unconsumed_tail
+
+    def flush(self) -> bytes:
+        tail = self._obj.flush()
+        if not self._obj.eof:
+            raise ValueError("gzip 数据不完整")
+        return self._count(tail)
+
+class _Zstd(_Inflater):
+    def __init__(self, max_bytes: Optional[int] = None):
+        super().__init__(max_bytes)
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd 解压需要安装 zstandard")
+        self._obj = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        view = memoryview(data)
+        for offset in range(0, len(view), ZSTD_INPUT_SLICE):
+            chunk = self._obj.decompress(view[offset:offset + ZSTD_INPUT_SLICE])
+            if chunk:
+                yield self._count(chunk)
+
+    def flush(self) -> bytes:
+        return b""
+
+def decompressor(encoding: Optional[str], max_bytes: Optional[int] = None):
+    """
+    按 Content-Encoding 创建增量解压器，不支持的编码抛出 ValueError。
+    max_bytes 限制解压输出总量，超出时抛出 InflateLimitExceeded。
+    """
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return _Identity(max_bytes)
+    if encoding in ("gzip", "x-gzip"):
+        return _Gzip(max_bytes)
+    if encoding == "zstd":
+        return _Zstd(max_bytes)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+def encoding_for_path(path: str) -> str:
+    return _SUFFIX_ENCODINGS.get(os.path.splitext(path)[1].lower(), "identity")
+
+def resolve_file(root: str, path: str) -> str:
+    """
+    把客户端提供的路径解析到允许的根目录内 (相对路径相对于根目录)。
+    未配置根目录或解析结果 (含符号链接) 落在根目录外时抛出 PermissionError，文件不存在时抛出 FileNotFoundError。
+    """
+    if not root:
+        raise PermissionError("文件模式未启用 (未配置 SHRINK_FILE_ROOT)")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise PermissionError("文件不在允许的目录内")
+    if not os.path.isfile(resolved):
+        raise FileNotFoundError(f"File {path} not found")
+    return resolved
+
+def iter_file_chunks(path: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    以内存映射方式分块读取文件：每次只映射当前窗口并在读完后解除映射，
+    已读过的文件页不会计入进程常驻内存。chunk_bytes 需为 mmap.ALLOCATIONGRANULARITY 的整数倍。
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        for offset in range(0, size, chunk_bytes):
+            length = min(chunk_bytes, size - offset)
+            with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=offset) as mm:
+                yield mm[:]
+
+class StreamShrinker:
+    """
+    有界内存的流式压缩：按块输入 (可为 gzip/zstd 压缩数据)，增量解码后按整行交给 ShrinkSession。
+    头部、尾部窗口、关键词与受保护实体都在会话中有界维护，峰值内存与输入大小无关。
+    流式模式与增量会话相同，不做近重复消除、结构化压缩与预算模式 (这些需要完整原文)。
+    """
+    def __init__(self, provider: str = "deepseek", layout: str = "default", encoding: Optional[str] = None,
+                 memory_hint: Optional[Callable[[str], str]] = None):
+        self.provider = provider
+        self.layout = layout
+        # 输入结束后按最近的对话内容生成长效记忆提示
+        self.memory_hint = memory_hint
+        self.session = ShrinkSession("stream")
+        self._decompressor = decompressor(encoding)
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._carry = ""
+
+    def feed(self, data: bytes):
+        for piece in self._decompressor.decompress(data):
+            self._push(self._decoder.decode(piece))
+
+    def finish(self) -> ShrinkResult:
+        self._push(self._decoder.decode(self._decompressor.flush(), final=True))
+        if self._carry:
+            self._append(self._carry)
+            self._carry = ""
+        session = self.session
+        if not session.compressible:
+            text = session.raw_text()
+            return ShrinkResult(text=text, compressed=False)
+        mem_info = self.memory_hint(session.recent_text()) if self.memory_hint else ""
+        summary = session.render(mem_info, self.layout)
+        return ShrinkResult(
+            text=OPTIMIZED_PREFIX + summary,
+            original_tokens=session.token_count,
+            optimized_tokens=count_tokens(summary, self.provider),
+            original_chars=session.char_count,
+            optimized_chars=len(summary)
+        )
+
+    def _push(self, text: str):
+        if not text:
+            return
+        text = self._carry + text
+        cut = text.rfind("\n")
+        if cut == -1 and len(text) < MAX_LINE_CARRY:
+            self._carry = text
+            return
+        if cut == -1:
+            cut = len(text)
+        self._append(text[:cut])
+        self._carry = text[cut + 1:]
+
+    def _append(self, text: str):
+        self.session.append(text)
+        self.session.token_count += count_tokens(text, self.provider)
@@ -0,0 +1,212 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.compression.patterns import HEAD_LINES, TAIL_LINES
+
+# 工具输出前的角色前缀，如 "Tool: "、"AI: "
+ROLE_PREFIX_RE = re.compile(r'^\s*[A-Za-z]{2,16}:\s+')
+
+# --- JSON：压缩空白、对象数组提取公共表头、长数组采样 ---
+MAX_ARRAY_ITEMS = 8
+SAMPLE_HEAD = 5
+SAMPLE_TAIL = 2
+# 多行 JSON 最多向后扫描的行数
+MAX_JSON_LINES = 5000
+# 对象数组的字段填充率不低于该值时才转成 _cols/_rows 表格
+TABLE_DENSITY = 0.75
+
+# --- 日志：Drain 风格的模板聚类 ---
+LOG_LINE_RE = re.compile(
+    r'^\s*\[?(?:\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}|\d{2}:\d{2}:\d{2}'
+    r'|(?:TRACE|DEBUG|INFO|WARN|WARNING|ERROR|FATAL|CRITICAL)\b)'
+)
+MIN_LOG_LINES = 3
+LOG_SIMILARITY = 0.5
+WILDCARD = "<*>"
+VARIABLE_TOKEN_RE = re.compile(r'\d')
+
+# --- 堆栈：保留首帧与最近的若干帧，中间折叠 ---
+TRACE_START_RE = re.compile(r'Traceback \(most recent call last\):\s*$|^\s*Exception in thread ')
+FRAME_RE = re.compile(r'^\s+(?:File "|at \S)')
+EXCEPTION_LINE_RE = re.compile(r'^[\w.$]+(?:Error|Exception|Exit|Interrupt|Warning)\b')
+TRACE_KEEP_HEAD = 1
+TRACE_KEEP_TAIL = 2
+
+def compact_json(value: Any) -> Any:
+    """递归压缩 JSON 值：长数组只保留首尾样本，字段一致的对象数组转成表格"""
+    if isinstance(value, dict):
+        return {k: compact_json(v) for k, v in value.items()}
+    if not isinstance(value, list):
+        return value
+
+    omitted = 0
+    items = value
+    if len(items) > MAX_ARRAY_ITEMS:
+        omitted = len(items) - SAMPLE_HEAD - SAMPLE_TAIL
+        items = items[:SAMPLE_HEAD] + items[-SAMPLE_TAIL:]
+    items = [compact_json(v) for v in items]
+
+    if len(items) >= 2 and all(isinstance(v, dict) for v in items):
+        keys = list(dict.fromkeys(k for v in items for k in v))
+        if keys and sum(len(v) for v in items) >= TABLE_DENSITY * len(items) * len(keys):
+            table: Dict[str, Any] = {"_cols": keys, "_rows": [[v.get(k) for k in keys] for v in items]}
+            if omitted:
+                table["_omitted"] = omitted
+            return table
+    if omitted:
+        items.insert(SAMPLE_HEAD, f"…省略 {omitted} 项…")
+    return items
+
+def compress_json(raw: str) -> Optional[str]:
+    """压缩一段 JSON 文本；不是对象或数组时返回 None"""
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(value, (dict, list)):
+        return None
+    return json.dumps(compact_json(value), ensure_ascii=False, separators=(",", ":"))
+
+def template_logs(lines: List[str]) -> List[str]:
+    """
+    Drain 风格的日志聚类：含数字的 token 视为变量，按 (token 数, 首个常量 token) 分桶，
+    桶内相似度达到阈值即合并，差异位置替换为 <*>。重复模式折叠为 "模板 ×N"，按首次出现排序。
+    """
+    clusters: List[List[Any]] = []  # [模板 token 列表, 次数, 首条原文]
+    buckets: Dict[Tuple[int, str], List[List[Any]]] = {}
+    for line in lines:
+        tokens = [WILDCARD if VARIABLE_TOKEN_RE.search(t) else t for t in line.split()]
+        key = (len(tokens), next((t for t in tokens if t != WILDCARD), ""))
+        best, best_sim = None, LOG_SIMILARITY
+        for cluster in buckets.get(key, []):
+            same = sum(1 for a, b in zip(cluster[0], tokens) if a == b or a == WILDCARD)
+            sim = same / len(tokens) if tokens else 1.0
+            if sim >= best_sim:
+                best, best_sim = cluster, sim
+        if best is None:
+            cluster = [tokens, 1, line]
+            clusters.append(cluster)
+            buckets.setdefault(key, []).append(cluster)
+        else:
+            best[0] = [a if a == b else WILDCARD for a, b in zip(best[0], tokens)]
+            best[1] += 1
+    return [c[2] if c[1] == 1 else f"{' '.join(c[0])} ×{c[1]}" for c in clusters]
+
+def fold_trace(lines: List[str]) -> List[str]:
+    """折叠堆栈：每段连续调用帧只保留最外层 1 帧与最内层 2 帧，异常信息原样保留"""
+    out: List[str] = []
+    frames: List[List[str]] = []
+
+    def flush():
+        if len(frames) > TRACE_KEEP_HEAD + TRACE_KEEP_TAIL + 1:
+            indent = frames[0][0][:len(frames[0][0]) - len(frames[0][0].lstrip())]
+            hidden = len(frames) - TRACE_KEEP_HEAD - TRACE_KEEP_TAIL
+            kept = frames[:TRACE_KEEP_HEAD] + [[f"{indent}... 省略 {hidden} 层调用 ..."]] + frames[-TRACE_KEEP_TAIL:]
+        else:
+            kept = frames
+        for frame in kept:
+            out.extend(frame)
+        frames.clear()
+
+    for line in lines:
+        if FRAME_RE.match(line):
+            frames.append([line])
+        elif frames and line.startswith((" ", "\t")) and not line.strip().startswith("..."):
+            frames[-1].append(line)  # 帧内的源码行
+        else:
+            flush()
+            out.append(line)
+    flush()
+    return out
+
+def _trace_end(lines: List[str], start: int) -> int:
+    i = start + 1
+    while i < len(lines) and (lines[i].startswith((" ", "\t")) or lines[i].startswith("Caused by:")):
+        i += 1
+    if i < len(lines) and EXCEPTION_LINE_RE.match(lines[i]):
+        i += 1
+    return i
+
+def _json_span(lines: List[str], start: int, prefix: str) -> Tuple[int, Optional[str]]:
+    """从 start 行开始寻找一段完整的 JSON，返回 (结束行, 压缩结果)；找不到时结果为 None"""
+    body = lines[start][len(prefix):]
+    opener = body.strip()
+    if opener not in ("{", "["):
+        # 单行 JSON 必须首尾括号成对，"[12:01] ..." 之类的行前缀不触发解析
+        if opener[-1:] != {"{": "}", "[": "]"}[opener[0]]:
+            return start + 1, None
+        return start + 1, compress_json(body)
+    # 多行 JSON 只从单独成行的 "{" / "[" 开始，内容行缩进更深，顶层闭合括号与起始行缩进对齐；
+    # 遇到空行或缩进回退的其他行即放弃，扫描长度与 JSON 本身成正比
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    parts = [body]
+    for i in range(start + 1, min(len(lines), start + MAX_JSON_LINES)):
+        line = lines[i]
+        stripped = line.lstrip()
+        if not stripped:
+            break
+        parts.append(line)
+        if len(line) - len(stripped) <= indent:
+            if stripped[:1] not in ("}", "]"):
+                break
+            compressed = compress_json("\n".join(parts))
+            return (i + 1, compressed) if compressed is not None else (start + 1, None)
+    return start + 1, None
+
+def compress_structured(text: str) -> Tuple[str, int]:
+    """
+    识别工具输出中的 JSON、日志与堆栈，分别交给专用压缩器处理；
+    代码块、头部 (系统提示) 与最近的 TAIL_LINES 行对话不处理。
+    只有压缩结果更短时才替换。返回 (压缩后的文本, 被改写的块数)。
+    """
+    all_lines = text.split("\n")
+    # 最近的若干非空行保持原样，与 shrink_text 的尾部保留一致
+    limit, kept = len(all_lines), 0
+    while limit > 0 and kept < TAIL_LINES:
+        limit -= 1
+        if all_lines[limit].strip():
+            kept += 1
+    lines, tail = all_lines[:limit], all_lines[limit:]
+    out: List[str] = []
+    rewritten = 0
+    seen_head = 0
+    in_fence = False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            in_fence = not in_fence
+        if in_fence or stripped.startswith("```") or seen_head < HEAD_LINES:
+            if stripped and not in_fence:
+                seen_head += 1
+            out.append(line)
+            i += 1
+            continue
+
+        replacement, end = None, i + 1
+        if TRACE_START_RE.search(line):
+            end = _trace_end(lines, i)
+            replacement = fold_trace(lines[i:end])
+        elif LOG_LINE_RE.match(line):
+            while end < len(lines) and LOG_LINE_RE.match(lines[end]):
+                end += 1
+            if end - i >= MIN_LOG_LINES:
+                replacement = template_logs(lines[i:end])
+        else:
+            match = ROLE_PREFIX_RE.match(line)
+            prefix = match.group(0) if match else ""
+            if line[len(prefix):].lstrip()[:1] in ("{", "["):
+                end, compressed = _json_span(lines, i, prefix)
+                if compressed is not None:
+                    replacement = [prefix + compressed]
+
+        original = lines[i:end]
+        if replacement is not None and sum(map(len, replacement)) < sum(map(len, original)):
+            out.extend(replacement)
+            rewritten += 1
+        else:
+            out.extend(original)
+        i = end
+    return "\n".join(out + tail), rewritten
@@ -55,6 +55,60 @@ class Settings(BaseSettings):
     
     # Storage Config
     EXPORT_DIR: str = "exports"
+
+    # Token Shrinking Config
+    SHRINK_MAX_SESSIONS: int = 1024      # 增量压缩会话上限
+    SHRINK_SESSION_TTL: float = 1800.0   # 会话空闲淘汰时间 (秒)
+    TOKENIZER_DIR: str = "data/tokenizers"  # BPE 词表目录 (<family>.tiktoken)
+    SEGMENT_DICT: str = "data/segment_dict.txt"  # jieba 格式中文词典，不存在时使用内置词表
+    SHRINK_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 压缩结果内存缓存上限
+    SHRINK_CACHE_DIR: str = ""           # 磁盘缓存目录，留空则只使用内存缓存
+    SHRINK_CACHE_DISK_MAX_BYTES: int = 512 * 1024 * 1024  # 磁盘缓存上限，超出后按 LRU 删除
+    SHRINK_POOL_WORKERS: int = 0         # 批量压缩进程数，0 表示使用 CPU 核数
+    SHRINK_POOL_MAX_INFLIGHT: int = 0    # 同时在途的批量任务上限，0 表示进程数的 2 倍
+    SHRINK_KEEP_TURNS: int = 3           # 消息数组模式下原样保留的最近轮数
+    SHRINK_FILE_ROOT: str = "data/shrink"  # 文件模式允许读取的根目录，留空则禁用文件模式
+    SHRINK_MAX_INFLATED_BYTES: int = 64 * 1024 * 1024  # 压缩请求体 (JSON) 解压后的上限
+    SHRINK_LLM_SUMMARY: bool = False     # 长会话的后台分层摘要 (需配置至少一个接入真实 API 的 LLM 厂商)
+    SUMMARY_SEGMENT_CHARS: int = 8000    # 会话中间层每累计该字符数切出一段做摘要
+    SUMMARY_PROVIDERS: str = "deepseek,qwen,zhipu,hunyuan,groq,wenxin,gemini,openai,claude"  # 摘要厂商，按价格由低到高；仅已接入真实 API 的厂商生效
+    SUMMARY_MAX_PENDING: int = 64        # 后台摘要在途任务上限
+
+    # Token Stats Config
+    TOKEN_STATS_PATH: str = "token_stats.db"  # Token 统计: .db/.sqlite 为 SQLite (多进程共享)，.json 为快照 (单进程)
+    TOKEN_STATS_BUSY_TIMEOUT: float = 5.0    # SQLite 等待其他进程写锁的超时 (秒)
+    TOKEN_STATS_FLUSH_INTERVAL: float = 2.0  # Token 统计后台写盘间隔 (秒)
+    TOKEN_STATS_FLUSH_EVENTS: int = 200      # 累计该数量的变更后立即写盘
+    TOKEN_ROLLUP_SAVE_INTERVAL: float = 60.0  # 分钟/小时/天汇总快照的写盘间隔 (秒)，之后的事件重启时从归档重放
+    TOKEN_ARCHIVE_DAYS: int = 90             # 原始用量事件列式归档的保留天数
+    TOKEN_ARCHIVE_MAX_NAMES: int = 1000      # 归档中厂商/场景名各自的上限，超出后计入 other (最多 65536)
+    PRICE_CATALOG_PATH: Optional[str] = None  # 价格表 JSON (格式同 core/usage/prices.json)，按模型覆盖内置价格
+    COST_MAX_USERS: int = 10000              # 按用户统计费用的用户数上限，超出后计入 other
+
+    # Metrics Config
+    METRICS_MAX_SERIES: int = 1000       # 每个指标的标签组合上限，超出后计入 other
+    LLM_USAGE_MAX_USERS: int = 10000     # LLMGateway 按用户统计保留的最近活跃用户数
+
+    # Memory Config
+    MEMORY_PATH: str = "data/memory.db"  # 记忆存储: .db/.sqlite 为 SQLite (多进程共享)，.json 为快照 + 日志 (单进程)
+    MEMORY_MAX_OPEN: int = 64            # 同时打开的命名空间 (用户/会话) 记忆数
+    MEMORY_BUSY_TIMEOUT: float = 5.0     # SQLite 等待其他进程写锁的超时 (秒)
+    MEMORY_FSYNC: str = "interval"       # 记忆日志落盘策略: always / interval / never
+    MEMORY_FSYNC_INTERVAL: float = 1.0   # interval 策略的 fsync 间隔 (秒)
+    MEMORY_FLUSH_DELAY: float = 0.05     # 写入去抖延迟 (秒)，期间的变更合并为一次写入
+    MEMORY_COMPACT_RECORDS: int = 1000   # 日志超过该条数时后台压实为快照
+    MEMORY_MAX_FACTS: int = 2000         # 每个命名空间的事实上限，超出后价值最低的移入冷归档 (0 为不限)
+    MEMORY_HALF_LIFE_DAYS: float = 30.0  # 事实价值中新近度的半衰期 (天)
+    MEMORY_HIT_WEIGHT: float = 0.5       # 事实价值中检索命中次数 (取对数) 的权重
+    MEMORY_MERGE_SIMILARITY: float = 0.7  # 近重复合并的词集合 Jaccard 相似度阈值
+    MEMORY_CONSOLIDATE_EVERY: int = 20   # 每新增该数量事实后台合并一次近重复 (0 为关闭)
+    MEMORY_HINT_FACTS: int = 3           # 压缩结果中注入的相关记忆条数
+    MEMORY_RECALL: str = "hybrid"        # 记忆检索方式: bm25 / vector / hybrid
+    MEMORY_EMBEDDER: str = "hashing"     # 向量化器: hashing (离线) 或厂商名，如 openai、qwen:text-embedding-v3
+    MEMORY_EMBED_DIM: int = 256          # hashing 向量维度
+    MEMORY_VECTOR_MIN_SCORE: float = 0.35  # 向量检索的最低余弦相似度
+    MEMORY_IVF_MIN_ROWS: int = 50000     # 事实数达到该值后向量检索使用 IVF 分区
+    MEMORY_IVF_NPROBE: int = 8           # IVF 查询扫描的分区数
     
     model_config = SettingsConfigDict(
         env_file=".env",
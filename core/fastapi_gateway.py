@@ -1,9 +1,15 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Literal, Optional
+from core.config import settings
+from core.compression.stream import InflateLimitExceeded, decompressor, resolve_file
 from core.omni_engine import omni_engine
 from core.api_engine import api_engine
-from core.token_tracker import token_tracker
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry
+from core.token_tracker import token_tracker, prompt_cache_usage
 import uvicorn
 import os
 import psutil
@@ -15,11 +21,50 @@ app = FastAPI(title="OmniGate Pro REST API", description="Clawdbot 增强插件
 # --- 数据模型 ---
 class TaskRequest(BaseModel):
     task: str
+    aliases: Optional[Dict[str, str]] = None  # 压缩时返回的别名表，任务中的句柄据此还原
+    namespace: Optional[str] = None  # 记忆命名空间 (用户/会话 ID)，未指定时使用默认命名空间
 
 class ContextRequest(BaseModel):
-    context: str
+    context: Optional[str] = None
+    path: Optional[str] = None  # SHRINK_FILE_ROOT 内的文件路径 (相对路径相对于该目录)：以内存映射方式流式压缩 (.gz/.zst 自动解压)
+    messages: Optional[List[Dict[str, Any]]] = None  # OpenAI 格式消息数组，设置后按角色压缩并返回消息数组
+    keep_turns: Optional[int] = None  # 消息数组模式下原样保留的最近轮数
     provider: str = "deepseek"
     scene: str = "general"
+    session_id: Optional[str] = None  # 设置后进入增量模式，context 只需包含新增轮次
+    reset: bool = False
+    target_tokens: Optional[int] = Field(None, gt=0)  # 预算模式：输出目标 Token 数
+    target_ratio: Optional[float] = Field(None, gt=0, le=1)  # 预算模式：输出占原文 Token 的比例
+    dedup: bool = True  # 先消除近重复的行与代码块
+    structured: bool = True  # JSON/日志/堆栈使用专用压缩器
+    code_diff: bool = False  # 代码演进模式：旧版本代码以 diff 表示
+    layout: Literal["default", "cache"] = "default"  # cache: 前缀逐轮稳定，便于命中提示词缓存
+    alias: bool = False  # 长实体替换为 §P1 等短句柄，响应中附带别名表
+    namespace: Optional[str] = None  # 注入哪个用户/会话的长效记忆
+
+class BatchContextRequest(BaseModel):
+    contexts: List[str]
+    provider: str = "deepseek"
+    scene: str = "general"
+    target_tokens: Optional[int] = Field(None, gt=0)
+    target_ratio: Optional[float] = Field(None, gt=0, le=1)
+    dedup: bool = True
+    structured: bool = True
+    code_diff: bool = False
+    layout: Literal["default", "cache"] = "default"
+    alias: bool = False
+    namespace: Optional[str] = None
+    stream: bool = False  # True 时以 NDJSON 按完成顺序逐条返回
+
+class UsageReport(BaseModel):
+    provider: str = "deepseek"
+    model: Optional[str] = None  # 用于按价格表折算缓存节省的费用
+    usage: Dict[str, Any]  # 厂商原样返回的 usage 字段
+    scene: Optional[str] = None  # 该次调用压缩时的场景，缓存节省从其花费中扣除
+    user: Optional[str] = None  # 该次调用压缩时的用户/命名空间
+
+# 以原始文本流式压缩的请求体类型 (参数通过查询字符串传递)
+STREAM_CONTENT_TYPES = ("text/plain", "application/octet-stream")
 
 # --- 辅助函数 ---
 def get_openclaw_config():
@@ -68,8 +113,31 @@ async def get_status():
     }
 
 @app.get("/api/token/stats")
-async def get_token_stats():
-    return JSONResponse(content=token_tracker.get_summary())
+async def get_token_stats(window: Optional[str] = None, group_by: Optional[str] = None):
+    """window (如 15m/1h/24h/7d) 与 group_by (provider/scene/provider,scene) 给出时附带时间窗口汇总"""
+    stats = token_tracker.get_summary()
+    stats["shrink_cache"] = omni_engine.cache.stats()
+    if window:
+        try:
+            stats["rollup"] = token_tracker.query(window, group_by)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif group_by:
+        raise HTTPException(status_code=400, detail="group_by 需要同时提供 window")
+    return JSONResponse(content=stats)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 抓取端点 (OpenMetrics 文本格式)"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.post("/api/token/usage")
+async def report_token_usage(req: UsageReport):
+    """上报一次厂商调用的 usage，记录其中的提示词缓存命中 Token 数，并从压缩时按全价记账的花费中扣除缓存节省"""
+    cache_usage = prompt_cache_usage(req.usage)
+    if cache_usage:
+        token_tracker.record_prompt_cache(req.provider, *cache_usage, model=req.model, scene=req.scene, user=req.user)
+    return {"status": "success", "recorded": cache_usage is not None}
 
 @app.get("/api/skills")
 async def get_skills():
@@ -79,17 +147,123 @@ async def get_skills():
 async def offload(req: TaskRequest):
     """任务卸载接口"""
     try:
-        result = await omni_engine.execute_task(req.task)
+        result = await omni_engine.execute_task(req.task, req.aliases, req.namespace)
         return {"status": "success", "data": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/shrink")
-async def shrink(req: ContextRequest):
-    """Token 压缩接口"""
-    summary = omni_engine.compress_context(req.context, provider=req.provider, scene=req.scene)
+async def shrink(request: Request, provider: str = "deepseek", scene: str = "general",
+                 layout: Literal["default", "cache"] = "default", namespace: Optional[str] = None):
+    """
+    Token 压缩接口，请求体支持 Content-Encoding: gzip/zstd：
+    - JSON 请求体 (ContextRequest)；其中 path 指定本地文件时以内存映射方式流式压缩；
+    - text/plain 或 application/octet-stream 请求体视为原始上下文，边接收边压缩，内存有界，
+      参数 (provider/scene/layout/namespace) 通过查询字符串传递。
+    两种请求体都接受这四个查询参数；JSON 请求体中已给出的同名字段优先。
+    """
+    encoding = request.headers.get("content-encoding")
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in STREAM_CONTENT_TYPES:
+        try:
+            shrinker = omni_engine.open_stream(provider, layout, encoding, namespace)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        try:
+            async for chunk in request.stream():
+                await run_in_threadpool(shrinker.feed, chunk)
+            summary = await run_in_threadpool(omni_engine.finish_stream, shrinker, scene, namespace)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"请求体解码失败: {e}")
+        return {"status": "success", "summary": summary}
+
+    body = await request.body()
+    if encoding:
+        try:
+            inflater = decompressor(encoding, settings.SHRINK_MAX_INFLATED_BYTES)
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        try:
+            body = b"".join(inflater.decompress(body)) + inflater.flush()
+        except InflateLimitExceeded as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"请求体解码失败: {e}")
+    try:
+        req = ContextRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    query = {"provider": provider, "scene": scene, "layout": layout, "namespace": namespace}
+    defaults = {k: v for k, v in query.items() if k in request.query_params and k not in req.model_fields_set}
+    if defaults:
+        req = req.model_copy(update=defaults)
+    return await _shrink_request(req)
+
+async def _shrink_request(req: ContextRequest) -> Dict[str, Any]:
+    if req.messages is not None:
+        if req.session_id:
+            raise HTTPException(status_code=400, detail="messages 模式不支持 session_id")
+        result = omni_engine.compress_messages_result(
+            req.messages, provider=req.provider, scene=req.scene, keep_turns=req.keep_turns,
+            target_tokens=req.target_tokens, target_ratio=req.target_ratio,
+            dedup=req.dedup, structured=req.structured, code_diff=req.code_diff,
+            layout=req.layout, alias=req.alias, namespace=req.namespace
+        )
+        if req.alias:
+            return {"status": "success", "messages": result.messages, "aliases": dict(result.aliases or {})}
+        return {"status": "success", "messages": result.messages}
+    if req.path is not None:
+        try:
+            path = resolve_file(settings.SHRINK_FILE_ROOT, req.path)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        summary = await run_in_threadpool(omni_engine.compress_file, path, req.provider, req.scene,
+                                       req.layout, req.namespace)
+        return {"status": "success", "summary": summary}
+    if req.context is None:
+        raise HTTPException(status_code=400, detail="context、messages 与 path 至少提供一个")
+    if req.session_id:
+        summary = omni_engine.compress_incremental(
+            req.session_id, req.context, provider=req.provider, scene=req.scene, reset=req.reset,
+            layout=req.layout, namespace=req.namespace
+        )
+    else:
+        result = omni_engine.compress_context_result(
+            req.context, provider=req.provider, scene=req.scene,
+            target_tokens=req.target_tokens, target_ratio=req.target_ratio,
+            dedup=req.dedup, structured=req.structured, code_diff=req.code_diff,
+            layout=req.layout, alias=req.alias, namespace=req.namespace
+        )
+        summary = result.text
+        if req.alias:
+            return {"status": "success", "summary": summary, "aliases": dict(result.aliases or {})}
     return {"status": "success", "summary": summary}
 
+@app.post("/shrink/batch")
+async def shrink_batch(req: BatchContextRequest):
+    """批量 Token 压缩接口：在常驻进程池中并行执行"""
+    options = dict(provider=req.provider, scene=req.scene,
+                   target_tokens=req.target_tokens, target_ratio=req.target_ratio,
+                   dedup=req.dedup, structured=req.structured, code_diff=req.code_diff,
+                   layout=req.layout, alias=req.alias, namespace=req.namespace)
+    if req.stream:
+        async def ndjson():
+            async for index, summary in omni_engine.iter_compress_batch(req.contexts, **options):
+                yield json.dumps({"index": index, "summary": summary}, ensure_ascii=False) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    summaries = await omni_engine.compress_batch(req.contexts, **options)
+    return {"status": "success", "summaries": summaries}
+
+@app.delete("/shrink/session/{session_id}")
+async def end_shrink_session(session_id: str):
+    """结束增量压缩会话并释放其状态"""
+    if not omni_engine.sessions.drop(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"status": "success"}
+
 @app.get("/health")
 async def health():
     return {"status": "online", "mode": "lightweight"}
@@ -104,7 +278,9 @@ def run_api(port: int = 18789):
                     if len(parts) == 2:
                         k, v = parts[0].strip(), parts[1].strip()
                         os.environ[k] = v
-                    
+
+    # 预热批量压缩进程池，避免首个 /shrink/batch 请求承担进程启动开销
+    omni_engine.pool.warm()
     uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
 
 if __name__ == "__main__":
@@ -1,13 +1,29 @@
 import logging
 import time
 import asyncio
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
 from core.config import settings
+from core.metrics import registry
 from core.network import NetworkClient
-from core.token_tracker import token_tracker
+from core.token_tracker import token_tracker, prompt_cache_usage
+from core.tokenizer import count_tokens
 
 logger = logging.getLogger("omni.core.llm_gateway")
 
+LLM_DURATION = registry.histogram("omni_llm_request_duration_seconds", "LLM 调用耗时", ("provider", "status"))
+LLM_TOKENS = registry.counter("omni_llm_tokens", "LLM 调用的输入/输出 Token 数", ("provider", "direction"))
+
+# 提供 OpenAI 兼容 /embeddings 接口的厂商及其默认向量模型
+EMBEDDING_MODELS = {
+    "openai": "text-embedding-3-small",
+    "qwen": "text-embedding-v3",
+    "zhipu": "embedding-3",
+}
+
+# 已接入真实 API 的厂商；其余厂商的 chat 返回模拟回复 (结果带 mock 标记)
+REAL_PROVIDERS = frozenset({"deepseek"})
+
 class LLMGateway:
     """
     统一 AI 网关：支持多模型切换、负载均衡、限流及统计。
@@ -15,7 +31,8 @@ class LLMGateway:
     """
     def __init__(self):
         self.network = NetworkClient()
-        self.usage_stats = {} # 简单统计，实际应存入数据库
+        # 按用户的简单统计，只保留最近活跃的 LLM_USAGE_MAX_USERS 个用户；全局统计见 /metrics
+        self.usage_stats: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self._refresh_providers()
 
     def _refresh_providers(self):
@@ -33,9 +50,17 @@ class LLMGateway:
             "wenxin": {"key": os.getenv("WENXIN_API_KEY"), "base_url": "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop"},
         }
 
-    async def chat(self, provider: str, prompt: str, user_id: str, model: Optional[str] = None) -> Dict[str, Any]:
+    def cheapest_provider(self, order: List[str]) -> Optional[str]:
+        """按给定的价格顺序 (由低到高) 返回第一个已配置密钥的提供商"""
+        for provider in order:
+            if self.providers.get(provider, {}).get("key"):
+                return provider
+        return None
+
+    async def chat(self, provider: str, prompt: str, user_id: str, model: Optional[str] = None,
+                   scene: str = "llm_call") -> Dict[str, Any]:
         """
-        统一聊天接口。
+        统一聊天接口。scene 为用量在 TokenTracker 中的记账场景。
         """
         if provider not in self.providers or not self.providers[provider]["key"]:
             # 自动寻找第一个可用的 provider
@@ -45,14 +70,15 @@ class LLMGateway:
             provider = available[0]
             logger.info(f"Auto-switched to available provider: {provider}")
 
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
+        status = "error"
         
         try:
-            # 记录输入 Token (以字符数估算)
-            input_tokens = len(prompt)
+            # 记录输入 Token (按厂商分词器离线计算)
+            input_tokens = count_tokens(prompt, provider)
             
             # 优先调用真实的 DeepSeek API
-            if provider == "deepseek":
+            if provider in REAL_PROVIDERS:
                 res = await self._call_deepseek_api(prompt, model)
             else:
                 # 兜底：模拟各厂商请求逻辑
@@ -60,23 +86,69 @@ class LLMGateway:
                 res = {
                     "provider": provider,
                     "text": response_text,
-                    "status": "success"
+                    "status": "success",
+                    "mock": True
                 }
             
             if res.get("status") == "success":
-                output_tokens = len(res["text"])
-                # 记录到追踪器 (场景设为 llm_call)
+                output_tokens = count_tokens(res["text"], provider)
+                # 厂商返回了真实用量时以其为准
+                usage = res.get("usage") or {}
+                input_tokens = usage.get("prompt_tokens", input_tokens)
+                output_tokens = usage.get("completion_tokens", output_tokens)
+                total_tokens = input_tokens + output_tokens
+                total_chars = len(prompt) + len(res["text"])
+                # 厂商侧提示词缓存命中 (按缓存价计费的输入 Token)
+                cache_usage = prompt_cache_usage(usage)
+                # 记录到追踪器 (场景默认为 llm_call)
                 # 注意：由于这是直接 API 调用，没有经过 OmniEngine 的压缩，所以 original = optimized
-                token_tracker.record(provider, "llm_call", input_tokens + output_tokens, input_tokens + output_tokens)
+                token_tracker.record(provider, scene, total_tokens, total_tokens, total_chars, total_chars,
+                                     model=model, user=user_id, output_tokens=output_tokens,
+                                     cached_tokens=cache_usage[1] if cache_usage else 0)
+                if cache_usage:
+                    token_tracker.record_prompt_cache(provider, *cache_usage, model=model, deduct=False)
                 
-                duration_ms = (time.time() - start_time) * 1000
+                LLM_TOKENS.labels(provider, "input").inc(input_tokens)
+                LLM_TOKENS.labels(provider, "output").inc(output_tokens)
+                duration_ms = (time.perf_counter_ns() - start_ns) / 1e6
                 res["latency_ms"] = duration_ms
+                res["input_tokens"] = input_tokens
+                res["output_tokens"] = output_tokens
                 self._record_usage(user_id, provider, duration_ms)
-                
+            status = res.get("status", "fail")
             return res
         except Exception as e:
             logger.error(f"LLM Call failed for {provider}: {e}")
             return {"error": str(e), "status": "fail"}
+        finally:
+            LLM_DURATION.labels(provider, status).observe_ns(time.perf_counter_ns() - start_ns)
+
+    async def embed(self, provider: str, texts: List[str], model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        文本向量化 (OpenAI 兼容 /embeddings 接口)，成功时返回 {"status": "success", "vectors": [[...], ...]}。
+        向量化的输入 Token 记入 embedding 场景。
+        """
+        if provider not in EMBEDDING_MODELS:
+            return {"error": f"Provider {provider} does not support embeddings.", "status": "fail"}
+        info = self.providers.get(provider, {})
+        if not info.get("key"):
+            return {"error": f"Provider {provider} is not configured.", "status": "fail"}
+
+        headers = {"Authorization": f"Bearer {info['key']}", "Content-Type": "application/json"}
+        payload = {"model": model or EMBEDDING_MODELS[provider], "input": texts}
+        try:
+            async with self.network.client as client:
+                response = await client.post(f"{info['base_url']}/embeddings", json=payload, headers=headers)
+                data = response.json()
+            if response.status_code != 200:
+                return {"error": f"Embedding API Error: {data.get('error', {}).get('message', 'Unknown error')}", "status": "fail"}
+            vectors = [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
+            tokens = (data.get("usage") or {}).get("prompt_tokens") or sum(count_tokens(t, provider) for t in texts)
+            token_tracker.record(provider, "embedding", tokens, tokens, sum(map(len, texts)), sum(map(len, texts)),
+                                 model=payload["model"])
+            return {"status": "success", "vectors": vectors}
+        except Exception as e:
+            return {"error": f"Network Error: {str(e)}", "status": "fail"}
 
     async def _call_deepseek_api(self, prompt: str, model: Optional[str] = None) -> Dict[str, Any]:
         """真实调用 DeepSeek API"""
@@ -105,6 +177,7 @@ class LLMGateway:
                     return {
                         "provider": "deepseek",
                         "text": text,
+                        "usage": data.get("usage", {}),
                         "status": "success"
                     }
                 else:
@@ -158,10 +231,14 @@ class LLMGateway:
             return {"status": "fail", "message": str(e)}
 
     def _record_usage(self, user_id: str, provider: str, duration: float):
-        if user_id not in self.usage_stats:
-            self.usage_stats[user_id] = {"total_calls": 0, "providers": {}, "total_latency": 0}
+        stats = self.usage_stats.get(user_id)
+        if stats is None:
+            stats = self.usage_stats[user_id] = {"total_calls": 0, "providers": {}, "total_latency": 0}
+            if len(self.usage_stats) > settings.LLM_USAGE_MAX_USERS:
+                self.usage_stats.popitem(last=False)
+        else:
+            self.usage_stats.move_to_end(user_id)
         
-        stats = self.usage_stats[user_id]
         stats["total_calls"] += 1
         stats["total_latency"] += duration
         stats["providers"][provider] = stats["providers"].get(provider, 0) + 1
@@ -1,9 +1,11 @@
 from mcp.server.fastmcp import FastMCP
 from core.omni_engine import omni_engine
 from core.skill_manager import SkillManager
+import json
 import logging
 import os
 import sys
+from typing import Any, Dict, List, Optional
 
 # 初始化 MCP 服务器 - 命名为 omni-plugin
 mcp = FastMCP("OmniGate-Plugin")
@@ -17,21 +19,35 @@ skill_manager.load_skills()
 # --- 核心工具 (始终保留) ---
 
 @mcp.tool()
-async def offload_task(task: str) -> str:
+async def offload_task(task: str, namespace: Optional[str] = None,
+                       aliases: Optional[Dict[str, str]] = None) -> str:
     """
     将复杂的本地任务卸载给 OmniGate 执行。
-    支持: 运行 shell 命令 (RUN: xxx), 读取/写入文件。
+    支持: 运行 shell 命令 (RUN: xxx), 读取/写入文件。namespace 为记忆所属的用户/会话；
+    aliases 为压缩时返回的别名表，任务中的句柄 (如 §P1) 据此还原。
     """
     logger.info(f"MCP Offloading task: {task}")
-    return await omni_engine.execute_task(task)
+    return await omni_engine.execute_task(task, aliases, namespace)
 
 @mcp.tool()
-async def shrink_context(context: str) -> str:
+async def shrink_context(context: str = "", session_id: Optional[str] = None,
+                         target_tokens: Optional[int] = None,
+                         messages: Optional[List[Dict[str, Any]]] = None,
+                         namespace: Optional[str] = None) -> str:
     """
     Token 优化器：使用 Omni 语义压缩算法优化超长对话上下文，节省 40-70% Token。
+    传入 session_id 时为增量模式，context 只需包含新增的对话轮次；
+    传入 target_tokens 时按重要度保留原句，使输出贴合目标 Token 数；
+    传入 messages (OpenAI 格式消息数组) 时按角色压缩，返回压缩后消息数组的 JSON；
+    namespace 指定注入哪个用户/会话的长效记忆。
     """
     logger.info("MCP Shrinking context")
-    return omni_engine.compress_context(context)
+    if messages is not None:
+        return json.dumps(omni_engine.compress_messages(messages, target_tokens=target_tokens,
+                                                      namespace=namespace), ensure_ascii=False)
+    if session_id:
+        return omni_engine.compress_incremental(session_id, context, namespace=namespace)
+    return omni_engine.compress_context(context, target_tokens=target_tokens, namespace=namespace)
 
 # --- 动态工具发现与注册 ---
 
@@ -46,8 +62,13 @@ def register_dynamic_tools():
         
         # 定义一个闭包来处理调用
         def create_tool_func(s_name, t_name):
-            async def dynamic_tool_func(**kwargs):
+            async def dynamic_tool_func(aliases: Optional[Dict[str, str]] = None, **kwargs):
                 logger.info(f"Dynamic Tool Call: {s_name}.{t_name}")
+                # 参数中的别名句柄 (如 §P1) 按调用方传入的别名表 (压缩结果的 aliases) 还原为完整值后再交给技能；
+                # aliases 是显式参数，会出现在工具的参数 schema 中
+                if aliases:
+                    kwargs = {k: omni_engine.expand_aliases(v, aliases) if isinstance(v, str) else v
+                              for k, v in kwargs.items()}
                 return skill_manager.execute(s_name, t_name, **kwargs)
             return dynamic_tool_func
 
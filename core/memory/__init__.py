@@ -0,0 +1,4 @@
+from .journal import Journal
+from .store import DEFAULT_NAMESPACE, MemoryBank, MemoryStore, SQLiteMemoryStore, open_memory_store
+
+__all__ = ["Journal", "MemoryStore", "SQLiteMemoryStore", "MemoryBank", "open_memory_store", "DEFAULT_NAMESPACE"]
@@ -0,0 +1,86 @@
+import heapq
+import math
+import re
+from itertools import islice
+from typing import Dict, Iterable, List, Tuple
+
+# 英文/数字按单词切分，中文按字二元组 (bigram) 切分，不依赖词典，对未登录词也有召回
+WORD_RE = re.compile(r'[A-Za-z0-9_]{2,}|[一-龥]+')
+# BM25 参数
+K1 = 1.2
+B = 0.75
+# 查询词上限：长查询只保留 IDF 最高的若干词，保证查询耗时有界
+MAX_QUERY_TERMS = 32
+# 倒排表长于该值的高频词不做全表遍历：已有候选时只给候选加分，否则只取最新的这么多篇文档
+MAX_POSTINGS_SCAN = 512
+
+def tokenize(text: str) -> List[str]:
+    terms: List[str] = []
+    for word in WORD_RE.findall(text):
+        if word[0] < "一":
+            terms.append(word.lower())
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+class BM25Index:
+    """
+    增量维护的倒排索引 + BM25 打分。倒排表为 词 -> {文档号: 词频}，新增文档只更新其包含的词，
+    查询只遍历查询词的倒排表。
+    """
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, doc_id: int, text: str):
+        terms = tokenize(text)
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_len[doc_id] = len(terms)
+        self.total_len += len(terms)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """返回得分最高的 k 个 (文档号, 得分)，按得分降序；没有任何词命中时返回空列表"""
+        n = len(self.doc_len)
+        if not n or k <= 0:
+            return []
+        weighted = []
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings:
+                df = len(postings)
+                weighted.append((math.log(1 + (n - df + 0.5) / (df + 0.5)), postings))
+        if not weighted:
+            return []
+        # 按 IDF 降序处理：稀有词先确定候选集，高频词只对候选加分
+        weighted = heapq.nlargest(MAX_QUERY_TERMS, weighted, key=lambda item: item[0])
+
+        avgdl = self.total_len / n
+        doc_len = self.doc_len
+        norm = K1 * (1 - B)
+        scale = K1 * B / avgdl if avgdl else 0.0
+        scores: Dict[int, float] = {}
+        for idf, postings in weighted:
+            gain = idf * (K1 + 1)
+            if len(postings) <= MAX_POSTINGS_SCAN:
+                items = postings.items()
+            elif scores:
+                items = [(doc_id, postings[doc_id]) for doc_id in scores if doc_id in postings]
+            else:
+                items = islice(reversed(postings.items()), MAX_POSTINGS_SCAN)
+            for doc_id, tf in items:
+                scores[doc_id] = scores.get(doc_id, 0.0) + gain * tf / (tf + norm + scale * doc_len[doc_id])
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def add_many(self, docs: Iterable[Tuple[int, str]]):
+        for doc_id, text in docs:
+            self.add(doc_id, text)
@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("omni.core.memory.journal")
+
+# fsync 策略：always 每批写入后落盘，interval 按时间间隔落盘，never 交给操作系统
+FSYNC_POLICIES = ("always", "interval", "never")
+
+Record = Dict[str, Any]
+# 快照中记录其已覆盖的最大日志序号的键
+SEQ_KEY = "journal_seq"
+
+class Journal:
+    """
+    快照 + 追加写日志：每次变更在日志末尾追加一行 JSON，由后台线程合并写入 (调用方从不阻塞在磁盘 I/O 上)；
+    日志条数超过阈值时在后台把当前状态原子地写成新快照并清空日志。
+    每条记录带递增的序号 seq，快照记下它已包含的最大序号：快照之后才写入日志的记录、
+    或快照替换后清空日志之前崩溃留下的旧记录，回放时都按序号跳过，不会重复计入。
+    崩溃最多损坏日志的最后一行，回放时跳过；快照通过临时文件 + rename 替换，不会写坏。
+    snapshot_fn 返回 (状态, 序号)：状态须恰好包含序号不大于该值的全部记录 (调用方在自己的锁内同时读取两者)。
+    """
+    def __init__(self, snapshot_path: str, snapshot_fn: Callable[[], Tuple[Dict[str, Any], int]],
+                 fsync: str = "interval", fsync_interval: float = 1.0,
+                 flush_delay: float = 0.05, compact_records: int = 1000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + ".journal"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.flush_delay = flush_delay
+        self.compact_records = compact_records
+        self._snapshot_fn = snapshot_fn
+        self._cond = threading.Condition()
+        self._pending: List[Record] = []
+        self._writing = False
+        self._compact_requested = False
+        self._closed = False
+        self._releasing = False
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._records = 0
+        self._seq = 0           # 最近登记的记录序号
+        self._snapshot_seq = 0  # 已加载快照包含的最大序号
+        self._last_fsync = 0.0
+        self._dirty = False  # 已写入但尚未 fsync
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def seq(self) -> int:
+        """最近登记的记录序号"""
+        return self._seq
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """读取快照；文件不存在或损坏时返回 None"""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load snapshot {self.snapshot_path}: {e}")
+            return None
+        self._snapshot_seq = self._seq = state.pop(SEQ_KEY, 0)
+        return state
+
+    def replay(self) -> Iterator[Record]:
+        """按顺序产出快照之后的日志记录，跳过写了一半的行与快照已包含的记录"""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping torn journal record in {self.journal_path}")
+                    continue
+                self._records += 1
+                seq = record.pop("seq", None)
+                if seq is not None:
+                    if seq <= self._snapshot_seq:
+                        continue
+                    self._seq = max(self._seq, seq)
+                yield record
+
+    def append(self, record: Record):
+        """登记一条变更，立即返回；由后台线程去抖后批量写入"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._seq += 1
+            self._pending.append(dict(record, seq=self._seq))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def compact(self):
+        """请求在后台把当前状态写成快照并清空日志"""
+        with self._cond:
+            self._compact_requested = True
+            self._ensure_thread()
+            self._cond.notify()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已登记的变更全部写入日志"""
+        with self._cond:
+            self._cond.notify()
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._writing and not self._compact_requested, timeout
+            )
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._close_file()
+
+    def release(self):
+        """
+        写完已登记的记录后结束后台线程并关闭日志文件，但不关闭日志：之后再登记记录时重新启动。
+        空闲的日志因此不再占用线程与文件句柄，持有它的对象也可以被回收。
+        """
+        with self._cond:
+            thread = self._thread
+            if self._closed or thread is None:
+                return
+            self._releasing = True
+            self._cond.notify()
+        thread.join()
+        with self._cond:
+            if self._thread is not thread:
+                return
+            self._releasing = False
+            self._thread = None
+            self._close_file()
+            if self._pending or self._compact_requested:
+                # 等待线程退出期间又登记了记录
+                self._ensure_thread()
+
+    def _close_file(self):
+        if self._file is not None:
+            if self._dirty and self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._dirty = False
+
+    def write_snapshot(self):
+        """
+        写快照并清空日志 (由后台线程在写完一批记录后调用)。快照之后登记的记录仍在待写队列中，
+        清空后写入新日志；快照已包含但尚未写入的记录照常写入，回放时按序号跳过。
+        """
+        state, seq = self._snapshot_fn()
+        state[SEQ_KEY] = seq
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self._snapshot_seq = seq
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+        self._records = 0
+        self._dirty = False
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="omni-memory-journal", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # interval 策略下，写入后若没有新的变更，到期时补一次 fsync
+                timeout = self.fsync_interval if self._dirty and self.fsync == "interval" else None
+                ready = self._cond.wait_for(
+                    lambda: self._pending or self._compact_requested or self._closed or self._releasing, timeout)
+                if not ready:
+                    self._sync()
+                    continue
+                if (self._closed or self._releasing) and not self._pending and not self._compact_requested:
+                    return
+            # 去抖：短时间内的连续变更合并为一次写入
+            if self.flush_delay and not self._closed:
+                time.sleep(self.flush_delay)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                compact = self._compact_requested
+                self._writing = True
+            try:
+                self._write(batch)
+                if compact or self._records >= self.compact_records:
+                    self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Failed to write memory journal: {e}")
+            finally:
+                with self._cond:
+                    self._writing = False
+                    if compact:
+                        self._compact_requested = False
+                    self._cond.notify_all()
+
+    def _write(self, batch: List[Record]):
+        if not batch:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+            self._file = open(self.journal_path, "a", encoding="utf-8")
+            if self._file.tell() and not self._ends_with_newline():
+                self._file.write("\n")  # 上次崩溃留下的半行单独成行，回放时跳过
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch))
+        self._file.flush()
+        self._records += len(batch)
+        self._dirty = True
+        if self.fsync == "always" or (self.fsync == "interval"
+                                      and time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._sync()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _sync(self):
+        if self._file is not None and self._dirty:
+            os.fsync(self._file.fileno())
+        self._dirty = False
+        self._last_fsync = time.monotonic()
@@ -0,0 +1,55 @@
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from core.memory.index import BM25Index, tokenize
+
+# 每条新事实只与 BM25 最相近的若干条较早事实比较，合并的代价与新增事实数成正比
+MERGE_CANDIDATES = 5
+
+def importance(meta: Dict[str, Any], now: Optional[float] = None, half_life_days: float = 30.0,
+               hit_weight: float = 0.5) -> float:
+    """
+    事实的保留价值：置顶为无穷大；否则为新近度 (按半衰期指数衰减，刚写入为 1)
+    加上被检索命中次数的对数加权。容量超限时价值最低的事实先被归档。
+    """
+    if meta.get("pinned"):
+        return math.inf
+    age_days = max(0.0, ((now or time.time()) - meta.get("created", 0)) / 86400)
+    return 0.5 ** (age_days / half_life_days) + hit_weight * math.log1p(meta.get("hits", 0))
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    """两条事实词集合 (同 BM25 分词) 的 Jaccard 相似度"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def near_duplicates(facts: List[str], index: BM25Index, start: int, threshold: float) -> Dict[str, List[str]]:
+    """
+    找出下标不小于 start 的新事实与较早事实中的近重复：从最新的事实开始，
+    相似度达到 threshold 的较早事实并入较新的一条 (新的陈述取代旧的)。返回 保留事实 -> 被并入的事实。
+    """
+    merges: Dict[str, List[str]] = {}
+    removed: Set[str] = set()
+    for pos in range(len(facts) - 1, start - 1, -1):
+        fact = facts[pos]
+        if fact in removed:
+            continue
+        terms = set(tokenize(fact))
+        for doc_id, _ in index.search(fact, MERGE_CANDIDATES + 1):
+            other = facts[doc_id]
+            if doc_id >= pos or other in removed:
+                continue
+            if similarity(terms, set(tokenize(other))) >= threshold:
+                merges.setdefault(fact, []).append(other)
+                removed.add(other)
+    return merges
+
+def merged_meta(metas: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并后的元数据：命中次数相加、任一条置顶即置顶、创建时间取最新"""
+    metas = list(metas)
+    return {
+        "created": max((m.get("created", 0) for m in metas), default=0),
+        "hits": sum(m.get("hits", 0) for m in metas),
+        "pinned": any(m.get("pinned") for m in metas)
+    }
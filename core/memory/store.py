@@ -0,0 +1,780 @@
+import atexit
+import copy
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core.config import settings
+from core.memory.index import BM25Index
+from core.memory.journal import Journal, Record
+from core.memory.policy import importance, merged_meta, near_duplicates
+from core.memory.vectors import VectorIndex, make_embedder
+
+logger = logging.getLogger("omni.core.memory")
+
+DEFAULT_NAMESPACE = "default"
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+_SAFE_NAMESPACE_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+# 删除事实的操作：evict 按价值归档，merge 合并近重复
+REMOVAL_OPS = ("evict", "merge")
+# 检索命中计数累计到该次数后批量写入
+HIT_FLUSH_EVERY = 32
+# 尚未向量化的事实不超过该数量时在检索中直接补齐，否则交给后台线程，补齐前只用 BM25 召回
+VECTOR_INLINE_FACTS = 64
+# 后台补齐时每批向量化的事实数 (向量化在锁外进行，批间释放锁)
+VECTOR_BUILD_BATCH = 1024
+
+# 进程退出时需要关闭的存储：弱引用，不阻止被 MemoryBank 淘汰的存储回收
+_open_stores: "weakref.WeakSet[MemoryStore]" = weakref.WeakSet()
+
+@atexit.register
+def _close_open_stores():
+    for store in list(_open_stores):
+        store.close()
+
+def namespace_slug(namespace: str) -> str:
+    """把命名空间转为可用于文件名的形式；含特殊字符或过长时附加哈希，避免不同命名空间冲突"""
+    if _SAFE_NAMESPACE_RE.match(namespace) and not namespace.startswith("."):
+        return namespace
+    digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:12]
+    return f"{re.sub(r'[^A-Za-z0-9_-]', '_', namespace)[:40]}-{digest}"
+
+def _new_meta(created: float = 0, pinned: bool = False) -> Dict[str, Any]:
+    return {"created": created, "hits": 0, "pinned": pinned}
+
+class MemoryStore:
+    """
+    本地持久化记忆存储：快照 (memory.json) + 追加写日志 (memory.json.journal)。
+    变更先作用于内存并登记一条日志记录，由后台线程批量写盘，单次写入的代价为 O(1)；
+    启动时读取快照并回放日志。日志记录均为幂等操作，快照与日志重叠时重复回放也不影响结果。
+    检索结合 BM25 关键词索引与向量索引 (memory.json.vectors，首次语义检索时为新增事实补齐向量)。
+    每个命名空间 (用户/会话) 使用独立的文件 memory.<namespace>.json；日志只适合单进程写入，
+    多进程共享记忆时使用 SQLiteMemoryStore。
+
+    每条事实带有创建时间、检索命中次数与置顶标记。事实数超过 MEMORY_MAX_FACTS 时，
+    按价值 (新近度 + 命中次数，置顶不淘汰) 最低的先移入冷归档 (memory.json.archive.jsonl)；
+    每新增 MEMORY_CONSOLIDATE_EVERY 条事实，后台把近重复的较早事实合并进较新的一条。
+    """
+    def __init__(self, storage_path: str = "data/memory.json", namespace: str = DEFAULT_NAMESPACE,
+                 fsync: Optional[str] = None):
+        self.namespace = namespace
+        self.storage_path = storage_path
+        os.makedirs(os.path.dirname(self.storage_path) or ".", exist_ok=True)
+        self.lock = Lock()
+        # 去重用的哈希集合与 BM25 倒排索引 (文档号即事实在 long_term_facts 中的下标，首次检索时建立)
+        self._fact_set: Set[str] = set()
+        self._index: Optional[BM25Index] = None
+        self._vectors: Optional[VectorIndex] = None
+        self._pending_hits: Dict[str, int] = {}
+        # 近重复合并的进度：下标不小于该值的事实尚未与较早事实比较
+        self._consolidated = 0
+        self._added_since_consolidate = 0
+        self._consolidating = False
+        self._vector_thread: Optional[threading.Thread] = None
+        self.memory = self._open(fsync)
+        self._fact_set.update(self.memory["long_term_facts"])
+        _open_stores.add(self)
+
+    def _open(self, fsync: Optional[str]) -> Dict[str, Any]:
+        if self.namespace != DEFAULT_NAMESPACE:
+            root, ext = os.path.splitext(self.storage_path)
+            self.storage_path = f"{root}.{namespace_slug(self.namespace)}{ext or '.json'}"
+        self.archive_path = self.storage_path + ".archive.jsonl"
+        self.journal = Journal(
+            self.storage_path, self._snapshot,
+            fsync=fsync or settings.MEMORY_FSYNC,
+            fsync_interval=settings.MEMORY_FSYNC_INTERVAL,
+            flush_delay=settings.MEMORY_FLUSH_DELAY,
+            compact_records=settings.MEMORY_COMPACT_RECORDS
+        )
+        return self._load()
+
+    def _empty(self) -> Dict[str, Any]:
+        return {"user_profile": {}, "long_term_facts": [], "task_history": [], "facts_version": 0,
+                "fact_meta": {}, "generation": 0}
+
+    def _load(self) -> Dict[str, Any]:
+        memory = self.journal.load() or self._empty()
+        for key, value in self._empty().items():
+            memory.setdefault(key, value)
+        # 旧版快照没有元数据：视为最早写入、未命中、未置顶
+        for fact in memory["long_term_facts"]:
+            memory["fact_meta"].setdefault(fact, _new_meta())
+        replayed = 0
+        for record in self.journal.replay():
+            self._apply(memory, record)
+            replayed += 1
+        if replayed:
+            logger.info(f"Replayed {replayed} memory journal records")
+        return memory
+
+    @property
+    def facts_version(self) -> int:
+        """长效记忆版本号：每次新增、归档或合并事实时递增，用于使压缩缓存失效"""
+        with self.lock:
+            self._refresh_locked()
+            return self.memory.get("facts_version", 0)
+
+    def save(self):
+        """立即把当前状态压实为快照并等待写盘完成"""
+        with self.lock:
+            self._flush_hits_locked()
+        self.journal.compact()
+        self.journal.flush()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已登记的变更写入日志"""
+        with self.lock:
+            self._flush_hits_locked()
+        return self.journal.flush(timeout)
+
+    def close(self):
+        with self.lock:
+            if not self.journal.closed:
+                self._flush_hits_locked()
+        self.journal.close()
+        _open_stores.discard(self)
+
+    def release(self):
+        """写完待写的变更并释放后台线程与文件句柄；存储仍可继续使用，下次写入时重新打开"""
+        with self.lock:
+            if not self.journal.closed:
+                self._flush_hits_locked()
+        self.journal.release()
+
+    def update_profile(self, key: str, value: Any):
+        self._commit({"op": "profile", "key": key, "value": value})
+
+    def add_fact(self, fact: str, pinned: bool = False):
+        """新增一条事实；pinned 为置顶 (永不归档)。超出容量时归档价值最低的事实"""
+        with self.lock:
+            self._refresh_locked()
+            if fact in self._fact_set:
+                if pinned:
+                    self._commit_locked({"op": "pin", "fact": fact, "pinned": True})
+                return
+            record = {"op": "fact", "fact": fact, "created": round(time.time(), 3)}
+            if pinned:
+                record["pinned"] = True
+            self._commit_locked(record)
+            self._enforce_cap_locked()
+            every = settings.MEMORY_CONSOLIDATE_EVERY
+            self._added_since_consolidate += 1
+            start = every > 0 and self._added_since_consolidate >= every and not self._consolidating
+            if start:
+                self._added_since_consolidate = 0
+                self._consolidating = True
+        if start:
+            threading.Thread(target=self._consolidate_background, name="omni-memory-consolidate",
+                             daemon=True).start()
+
+    def pin(self, fact: str, pinned: bool = True) -> bool:
+        """设置或取消置顶，事实不存在时返回 False"""
+        with self.lock:
+            self._refresh_locked()
+            if fact not in self._fact_set:
+                return False
+            self._commit_locked({"op": "pin", "fact": fact, "pinned": pinned})
+            return True
+
+    def consolidate(self) -> int:
+        """合并近重复事实 (只比较上次合并之后新增的事实)，返回被并入的事实数"""
+        with self.lock:
+            self._refresh_locked()
+            facts = self.memory["long_term_facts"]
+            merges = near_duplicates(facts, self._bm25_locked(), min(self._consolidated, len(facts)),
+                                     settings.MEMORY_MERGE_SIMILARITY)
+            if merges:
+                self._remove_locked({"op": "merge", "merges": merges})
+            self._consolidated = len(self.memory["long_term_facts"])
+            return sum(len(dupes) for dupes in merges.values())
+
+    def _consolidate_background(self):
+        try:
+            merged = self.consolidate()
+            if merged:
+                logger.info(f"Merged {merged} near-duplicate memory facts ({self.namespace})")
+        except Exception as e:
+            logger.error(f"Memory consolidation failed: {e}")
+        finally:
+            self._consolidating = False
+
+    def _enforce_cap_locked(self):
+        """事实数超过上限时，把价值最低的非置顶事实归档，降到上限的 90% (批量归档，摊还代价)"""
+        cap = settings.MEMORY_MAX_FACTS
+        facts = self.memory["long_term_facts"]
+        if cap <= 0 or len(facts) <= cap:
+            return
+        self._flush_hits_locked()
+        metas = self._fact_metas_locked()
+        now = time.time()
+        scored = [(importance(metas.get(fact, {}), now, settings.MEMORY_HALF_LIFE_DAYS,
+                              settings.MEMORY_HIT_WEIGHT), fact) for fact in facts]
+        lowest = heapq.nsmallest(len(facts) - (cap - cap // 10), scored, key=lambda item: item[0])
+        victims = [fact for score, fact in lowest if score != math.inf]
+        if victims:
+            self._remove_locked({"op": "evict", "facts": victims})
+            logger.info(f"Archived {len(victims)} low-value memory facts ({self.namespace})")
+
+    def _fact_metas_locked(self) -> Dict[str, Dict[str, Any]]:
+        return self.memory["fact_meta"]
+
+    def _remove_locked(self, record: Record):
+        """执行归档或合并，并按删除后的事实列表重建去重集合、BM25 索引与向量行号"""
+        self._flush_hits_locked()
+        old_facts = list(self.memory["long_term_facts"])
+        vectors = self._vectors
+        if vectors is None and os.path.exists(self._vectors_path()):
+            vectors = self._open_vectors_locked()
+        self._commit_locked(record)
+        facts = self.memory["long_term_facts"]
+        self._fact_set = set(facts)
+        self._index = None
+        self._consolidated = max(0, self._consolidated - (len(old_facts) - len(facts)))
+        if vectors is not None:
+            # 向量文件的行号即事实下标：按删除后的顺序压实，尚未向量化的事实之后按需补齐
+            rows = {fact: row for row, fact in enumerate(old_facts[:len(vectors)])}
+            keep: List[int] = []
+            for fact in facts:
+                if fact not in rows:
+                    break
+                keep.append(rows[fact])
+            vectors.compact(keep, self.memory["generation"])
+        self._vectors = vectors
+
+    def _index_fact(self, fact: str):
+        """新事实进入去重集合与已建立的 BM25 索引 (需持有 self.lock，事实已追加到 long_term_facts)"""
+        self._fact_set.add(fact)
+        if self._index is not None:
+            self._index.add(len(self.memory["long_term_facts"]) - 1, fact)
+
+    def _refresh_locked(self):
+        """读取其他进程写入的变更；日志后端只有本进程写入，无需刷新"""
+
+    def search(self, query: str, k: int = 5, mode: Optional[str] = None) -> List[str]:
+        """
+        返回与 query 最相关的 k 条事实。mode (默认 MEMORY_RECALL)：
+        bm25 为关键词检索；vector 为向量检索 (相似度低于 MEMORY_VECTOR_MIN_SCORE 的不返回)；
+        hybrid 先取 BM25 结果，不足 k 条时用向量检索补足。返回的事实计一次命中。
+        大量事实尚未向量化 (或 IVF 分区需要训练) 时在后台补齐，补齐之前跳过向量检索。
+        """
+        mode = mode or settings.MEMORY_RECALL
+        start = False
+        with self.lock:
+            self._refresh_locked()
+            facts = self.memory["long_term_facts"]
+            ids: List[int] = []
+            if mode in ("bm25", "hybrid"):
+                ids = [doc_id for doc_id, _ in self._bm25_locked().search(query, k)]
+            if mode in ("vector", "hybrid") and len(ids) < k:
+                vectors = self._vector_index()
+                if vectors is None:
+                    start = self._vector_thread is None
+                    if start:
+                        self._vector_thread = threading.Thread(
+                            target=self._build_vectors_background, name="omni-memory-vectors", daemon=True)
+                else:
+                    seen = set(ids)
+                    for doc_id, score in vectors.search(query, k):
+                        if (score >= settings.MEMORY_VECTOR_MIN_SCORE and doc_id not in seen
+                                and doc_id < len(facts) and len(ids) < k):
+                            ids.append(doc_id)
+            found = [facts[doc_id] for doc_id in ids]
+            self._note_hits_locked(found)
+            thread = self._vector_thread
+        if start:
+            thread.start()
+        return found
+
+    def _bm25_locked(self) -> BM25Index:
+        if self._index is None:
+            self._index = BM25Index()
+            self._index.add_many(enumerate(self.memory["long_term_facts"]))
+        return self._index
+
+    def _note_hits_locked(self, facts: List[str]):
+        for fact in facts:
+            self._pending_hits[fact] = self._pending_hits.get(fact, 0) + 1
+        if sum(self._pending_hits.values()) >= HIT_FLUSH_EVERY:
+            self._flush_hits_locked()
+
+    def _flush_hits_locked(self):
+        if self._pending_hits:
+            hits, self._pending_hits = self._pending_hits, {}
+            self._commit_locked({"op": "hits", "hits": hits})
+
+    def _open_vectors_locked(self) -> VectorIndex:
+        return VectorIndex(
+            self._vectors_path(),
+            make_embedder(settings.MEMORY_EMBEDDER, settings.MEMORY_EMBED_DIM),
+            ivf_min_rows=settings.MEMORY_IVF_MIN_ROWS,
+            nprobe=settings.MEMORY_IVF_NPROBE,
+            generation=self.memory.get("generation", 0)
+        )
+
+    def _vector_index(self) -> Optional[VectorIndex]:
+        """
+        向量索引 (需持有 self.lock)：少量尚未向量化的事实直接补齐；
+        缺口较大、IVF 分区需要训练或后台正在补齐时返回 None，由调用方启动后台补齐
+        """
+        if self._vector_thread is not None:
+            return None
+        facts = self.memory["long_term_facts"]
+        if self._vectors is None:
+            self._vectors = self._open_vectors_locked()
+            if len(self._vectors) > len(facts):
+                self._vectors.reset()
+        vectors = self._vectors
+        if len(facts) - len(vectors) > VECTOR_INLINE_FACTS or vectors.needs_training:
+            return None
+        if len(vectors) < len(facts):
+            try:
+                vectors.append(facts[len(vectors):])
+            except Exception as e:
+                logger.error(f"Failed to embed memory facts: {e}")
+            if vectors.needs_training:
+                return None
+        return vectors
+
+    def _build_vectors_background(self):
+        """后台补齐向量并训练 IVF 分区：向量化与训练在锁外进行，期间事实被删除或合并 (代数变化) 则放弃"""
+        try:
+            while True:
+                with self.lock:
+                    vectors, generation = self._vectors, self.memory.get("generation", 0)
+                    if vectors is None:
+                        return
+                    done = len(vectors)
+                    batch = self.memory["long_term_facts"][done:done + VECTOR_BUILD_BATCH]
+                    if not batch:
+                        matrix = vectors.matrix() if vectors.needs_training else None
+                        break
+                embedded = vectors.embedder.embed(batch)
+                with self.lock:
+                    if (self._vectors is not vectors or len(vectors) != done
+                            or self.memory.get("generation", 0) != generation):
+                        return
+                    vectors.append(batch, embedded)
+            if matrix is not None:
+                ivf = vectors.train(matrix)
+                with self.lock:
+                    if self._vectors is vectors and self.memory.get("generation", 0) == generation:
+                        vectors.install(ivf)
+        except Exception as e:
+            logger.error(f"Failed to build memory vectors ({self.namespace}): {e}")
+        finally:
+            with self.lock:
+                self._vector_thread = None
+
+    def _vectors_path(self) -> str:
+        return self.storage_path + ".vectors"
+
+    def recent_facts(self, k: int = 10) -> List[str]:
+        with self.lock:
+            self._refresh_locked()
+            return self.memory["long_term_facts"][-k:] if k > 0 else []
+
+    def _commit(self, record: Record):
+        with self.lock:
+            self._commit_locked(record)
+
+    def _commit_locked(self, record: Record):
+        if record.get("op") in REMOVAL_OPS:
+            self._archive_locked(record)
+        self._apply(self.memory, record)
+        self.journal.append(record)
+        if record.get("op") == "fact":
+            self._index_fact(record["fact"])
+
+    def _archive_locked(self, record: Record):
+        """被归档或合并的事实连同元数据追加到冷归档文件"""
+        metas = self.memory["fact_meta"]
+        now = round(time.time(), 3)
+        if record["op"] == "merge":
+            entries = [(fact, {"reason": "merge", "into": into})
+                       for into, dupes in record["merges"].items() for fact in dupes]
+        else:
+            entries = [(fact, {"reason": "evict"}) for fact in record["facts"]]
+        with open(self.archive_path, "a", encoding="utf-8") as f:
+            for fact, extra in entries:
+                if fact in metas:
+                    line = dict(fact=fact, archived=now, **metas[fact], **extra)
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    def _apply(self, memory: Dict[str, Any], record: Record):
+        """把一条日志记录作用到记忆状态上 (幂等)"""
+        op = record.get("op")
+        metas = memory["fact_meta"]
+        if op == "profile":
+            memory["user_profile"][record["key"]] = record["value"]
+        elif op == "fact":
+            if record["fact"] not in metas:
+                memory["long_term_facts"].append(record["fact"])
+                metas[record["fact"]] = _new_meta(record.get("created", 0), record.get("pinned", False))
+                memory["facts_version"] = memory.get("facts_version", 0) + 1
+        elif op == "hits":
+            for fact, hits in record["hits"].items():
+                if fact in metas:
+                    metas[fact]["hits"] += hits
+        elif op == "pin":
+            if record["fact"] in metas:
+                metas[record["fact"]]["pinned"] = record["pinned"]
+        elif op in REMOVAL_OPS:
+            self._apply_removal(memory, record)
+        else:
+            logger.warning(f"Unknown memory journal op: {op}")
+
+    def _apply_removal(self, memory: Dict[str, Any], record: Record):
+        metas = memory["fact_meta"]
+        if record["op"] == "merge":
+            removed: Set[str] = set()
+            for into, dupes in record["merges"].items():
+                if into in metas:
+                    metas[into] = merged_meta([metas[into]] + [metas[d] for d in dupes if d in metas])
+                removed.update(dupes)
+            removed.difference_update(record["merges"])
+        else:
+            removed = set(record["facts"])
+        if not removed & metas.keys():
+            return
+        memory["long_term_facts"] = [fact for fact in memory["long_term_facts"] if fact not in removed]
+        for fact in removed:
+            metas.pop(fact, None)
+        memory["facts_version"] = memory.get("facts_version", 0) + 1
+        memory["generation"] = memory.get("generation", 0) + 1
+
+    def _snapshot(self) -> Tuple[Dict[str, Any], int]:
+        # 记录在锁内应用并登记到日志：同一把锁内读取的状态恰好包含序号不大于 journal.seq 的记录
+        with self.lock:
+            return copy.deepcopy(self.memory), self.journal.seq
+
+class SQLiteMemoryStore(MemoryStore):
+    """
+    SQLite 记忆存储 (WAL 模式)：所有命名空间共用一个数据库文件，事实与画像按 (命名空间, ...) 建索引，
+    只加载当前命名空间的行。多个进程 (sidecar、机器人、MCP) 可同时读写：
+    写入在 BEGIN IMMEDIATE 事务中完成，由 SQLite 的文件锁串行化；
+    读取前检查 PRAGMA data_version，其他连接提交过变更时只增量拉取新增的行，
+    其他连接归档或合并过事实 (代数变化) 时重新加载本命名空间。冷归档为 archive 表。
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS facts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ns TEXT NOT NULL,
+        fact TEXT NOT NULL,
+        created REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        pinned INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (ns, fact)
+    );
+    CREATE INDEX IF NOT EXISTS facts_ns_id ON facts (ns, id);
+    CREATE TABLE IF NOT EXISTS profile (
+        ns TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (ns, key)
+    );
+    CREATE TABLE IF NOT EXISTS namespaces (
+        ns TEXT PRIMARY KEY,
+        facts_version INTEGER NOT NULL DEFAULT 0,
+        generation INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS archive (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ns TEXT NOT NULL,
+        fact TEXT NOT NULL,
+        created REAL NOT NULL,
+        hits INTEGER NOT NULL,
+        pinned INTEGER NOT NULL,
+        archived REAL NOT NULL,
+        reason TEXT NOT NULL,
+        merged_into TEXT
+    );
+    CREATE INDEX IF NOT EXISTS archive_ns_id ON archive (ns, id);
+    """
+    # 旧版数据库缺少的列
+    MIGRATIONS = (
+        ("facts", "hits", "INTEGER NOT NULL DEFAULT 0"),
+        ("facts", "pinned", "INTEGER NOT NULL DEFAULT 0"),
+        ("namespaces", "generation", "INTEGER NOT NULL DEFAULT 0"),
+    )
+
+    def __init__(self, storage_path: str = "data/memory.db", namespace: str = DEFAULT_NAMESPACE):
+        super().__init__(storage_path, namespace)
+
+    def _open(self, fsync: Optional[str]) -> Dict[str, Any]:
+        self._conn: Optional[sqlite3.Connection] = None
+        self._connect()
+        self._last_id = 0
+        memory = self._empty()
+        self.memory = memory
+        if self.namespace == DEFAULT_NAMESPACE:
+            self._import_legacy_json()
+        self._pull_locked()
+        return memory
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开连接 (关闭后再次使用时重新连接)；连接只在持有 self.lock 时使用"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.storage_path, timeout=settings.MEMORY_BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=" + ("FULL" if settings.MEMORY_FSYNC == "always" else "NORMAL"))
+            conn.executescript(self.SCHEMA)
+            for table, column, decl in self.MIGRATIONS:
+                if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            self._conn = conn
+            self._data_version = None
+        return self._conn
+
+    def _import_legacy_json(self):
+        """首次使用时导入同名的旧版 JSON 记忆 (如 data/memory.db 对应 data/memory.json) 到默认命名空间"""
+        legacy_path = os.path.splitext(self.storage_path)[0] + ".json"
+        if not os.path.exists(legacy_path) and not os.path.exists(legacy_path + ".journal"):
+            return
+        if self._conn.execute("SELECT 1 FROM namespaces WHERE ns = ?", (self.namespace,)).fetchone():
+            return
+        legacy = MemoryStore(legacy_path)
+        legacy.close()
+        metas = legacy.memory["fact_meta"]
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO facts (ns, fact, created, hits, pinned) VALUES (?, ?, ?, ?, ?)",
+                [(self.namespace, fact, metas[fact]["created"], metas[fact]["hits"], int(metas[fact]["pinned"]))
+                 for fact in legacy.memory["long_term_facts"]]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO profile (ns, key, value) VALUES (?, ?, ?)",
+                [(self.namespace, key, json.dumps(value, ensure_ascii=False))
+                 for key, value in legacy.memory["user_profile"].items()]
+            )
+            conn.execute("INSERT OR IGNORE INTO namespaces (ns, facts_version) VALUES (?, ?)",
+                         (self.namespace, len(legacy.memory["long_term_facts"])))
+        logger.info(f"Imported legacy memory {legacy_path} into {self.storage_path}")
+
+    def _transaction(self):
+        return _Transaction(self._connect())
+
+    def _refresh_locked(self):
+        version = self._connect().execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._pull_locked()
+
+    def _pull_locked(self):
+        """拉取本命名空间中 id 大于已加载最大值的事实，并重新读取画像与版本号；代数变化时全部重新加载"""
+        conn, ns = self._connect(), self.namespace
+        row = conn.execute("SELECT facts_version, generation FROM namespaces WHERE ns = ?", (ns,)).fetchone()
+        facts_version, generation = row or (0, 0)
+        if generation != self.memory["generation"]:
+            self.memory.update(long_term_facts=[], fact_meta={}, generation=generation)
+            self._fact_set = set()
+            self._index = None
+            self._vectors = None
+            self._last_id = 0
+            self._consolidated = 0
+        for row_id, fact, created, hits, pinned in conn.execute(
+            "SELECT id, fact, created, hits, pinned FROM facts WHERE ns = ? AND id > ? ORDER BY id",
+            (ns, self._last_id)
+        ):
+            self._last_id = row_id
+            if fact not in self._fact_set:
+                self.memory["long_term_facts"].append(fact)
+                self.memory["fact_meta"][fact] = {"created": created, "hits": hits, "pinned": bool(pinned)}
+                self._index_fact(fact)
+        self.memory["user_profile"] = {
+            key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM profile WHERE ns = ?", (ns,))
+        }
+        self.memory["facts_version"] = facts_version
+
+    def _fact_metas_locked(self) -> Dict[str, Dict[str, Any]]:
+        """从数据库读取最新的元数据 (包含其他进程累计的命中次数)"""
+        metas = {
+            fact: {"created": created, "hits": hits, "pinned": bool(pinned)}
+            for fact, created, hits, pinned in self._connect().execute(
+                "SELECT fact, created, hits, pinned FROM facts WHERE ns = ?", (self.namespace,)
+            )
+        }
+        self.memory["fact_meta"].update(metas)
+        return metas
+
+    def _commit_locked(self, record: Record):
+        op, ns = record.get("op"), self.namespace
+        with self._transaction() as conn:
+            if op == "fact":
+                cursor = conn.execute("INSERT OR IGNORE INTO facts (ns, fact, created, pinned) VALUES (?, ?, ?, ?)",
+                                      (ns, record["fact"], record.get("created", time.time()),
+                                       int(record.get("pinned", False))))
+                if cursor.rowcount:
+                    self._bump_locked(conn, removal=False)
+            elif op == "profile":
+                conn.execute("INSERT OR REPLACE INTO profile (ns, key, value) VALUES (?, ?, ?)",
+                             (ns, record["key"], json.dumps(record["value"], ensure_ascii=False)))
+            elif op == "hits":
+                conn.executemany("UPDATE facts SET hits = hits + ? WHERE ns = ? AND fact = ?",
+                                 [(hits, ns, fact) for fact, hits in record["hits"].items()])
+            elif op == "pin":
+                conn.execute("UPDATE facts SET pinned = ? WHERE ns = ? AND fact = ?",
+                             (int(record["pinned"]), ns, record["fact"]))
+            elif op in REMOVAL_OPS:
+                self._remove_rows_locked(conn, record)
+            else:
+                logger.warning(f"Unknown memory op: {op}")
+        if op in ("hits", "pin") or op in REMOVAL_OPS:
+            self._apply(self.memory, record)
+        # 连同其他进程在此之前提交的行一起按 id 顺序拉取，保证各进程中事实的顺序一致
+        self._pull_locked()
+
+    def _remove_rows_locked(self, conn: sqlite3.Connection, record: Record):
+        """在事务内把事实移入 archive 表并删除；合并时命中次数与置顶并入保留的事实"""
+        ns, now = self.namespace, time.time()
+        if record["op"] == "merge":
+            groups = list(record["merges"].items())
+        else:
+            groups = [(None, record["facts"])]
+        for into, dupes in groups:
+            marks = ",".join("?" * len(dupes))
+            if into is not None:
+                conn.execute(
+                    f"UPDATE facts SET hits = hits + (SELECT COALESCE(SUM(hits), 0) FROM facts "
+                    f"WHERE ns = ? AND fact IN ({marks})), pinned = MAX(pinned, (SELECT COALESCE(MAX(pinned), 0) "
+                    f"FROM facts WHERE ns = ? AND fact IN ({marks}))) WHERE ns = ? AND fact = ?",
+                    (ns, *dupes, ns, *dupes, ns, into)
+                )
+            conn.execute(
+                f"INSERT INTO archive (ns, fact, created, hits, pinned, archived, reason, merged_into) "
+                f"SELECT ns, fact, created, hits, pinned, ?, ?, ? FROM facts WHERE ns = ? AND fact IN ({marks})",
+                (now, record["op"], into, ns, *dupes)
+            )
+            conn.execute(f"DELETE FROM facts WHERE ns = ? AND fact IN ({marks})", (ns, *dupes))
+        self._bump_locked(conn, removal=True)
+
+    def _bump_locked(self, conn: sqlite3.Connection, removal: bool):
+        """递增命名空间的事实版本号；删除事实时同时递增代数，通知其他进程重新加载"""
+        generation = 1 if removal else 0
+        conn.execute(
+            "INSERT INTO namespaces (ns, facts_version, generation) VALUES (?, 1, ?) "
+            "ON CONFLICT (ns) DO UPDATE SET facts_version = facts_version + 1, generation = generation + ?",
+            (self.namespace, generation, generation)
+        )
+
+    def _vectors_path(self) -> str:
+        return f"{self.storage_path}.{namespace_slug(self.namespace)}.vectors"
+
+    def save(self):
+        """事务提交即已写入 WAL；这里写入累计的命中次数并把 WAL 合并回主数据库文件"""
+        with self.lock:
+            self._flush_hits_locked()
+            self._connect().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self.lock:
+            self._flush_hits_locked()
+        return True
+
+    def close(self):
+        self.release()
+        _open_stores.discard(self)
+
+    def release(self):
+        """写入累计的命中次数并关闭连接；再次使用时重新连接"""
+        with self.lock:
+            if self._conn is not None:
+                self._flush_hits_locked()
+                self._conn.close()
+                self._conn = None
+
+class _Transaction:
+    """BEGIN IMMEDIATE 事务：开始时即取得写锁，避免读事务升级为写事务时的 SQLITE_BUSY 死锁"""
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+def open_memory_store(storage_path: str, namespace: str = DEFAULT_NAMESPACE) -> MemoryStore:
+    """按文件后缀选择存储后端：.db/.sqlite 为 SQLite，其余为 JSON 快照 + 日志"""
+    if storage_path.lower().endswith(SQLITE_SUFFIXES):
+        return SQLiteMemoryStore(storage_path, namespace)
+    return MemoryStore(storage_path, namespace)
+
+class MemoryBank:
+    """
+    按命名空间 (用户/会话) 管理记忆存储：首次访问时打开，只保留最近使用的 max_open 个。
+    淘汰的存储不会被关闭，只释放后台线程与文件句柄 (JSON 后端会先写完日志)，仍持有它的调用方可以继续使用；
+    淘汰后仍被持有的存储在再次访问时直接取回，不会为同一命名空间打开第二个实例，不再被持有的随之回收。
+    pinned 中的命名空间 (默认命名空间) 常驻内存、不参与淘汰。
+    """
+    def __init__(self, storage_path: str = "data/memory.db", max_open: int = 64,
+                 pinned: Tuple[str, ...] = (DEFAULT_NAMESPACE,)):
+        self.storage_path = storage_path
+        self.max_open = max_open
+        self.lock = Lock()
+        self._stores: "OrderedDict[str, MemoryStore]" = OrderedDict()
+        self._pinned_names = set(pinned)
+        self._pinned: Dict[str, MemoryStore] = {}
+        # 已淘汰但仍被调用方持有的存储
+        self._evicted: "weakref.WeakValueDictionary[str, MemoryStore]" = weakref.WeakValueDictionary()
+
+    def get(self, namespace: Optional[str] = None) -> MemoryStore:
+        namespace = namespace or DEFAULT_NAMESPACE
+        evicted: List[MemoryStore] = []
+        with self.lock:
+            store = self._pinned.get(namespace)
+            if store is not None:
+                return store
+            if namespace in self._pinned_names:
+                store = self._evicted.pop(namespace, None) or open_memory_store(self.storage_path, namespace)
+                self._pinned[namespace] = store
+                return store
+            store = self._stores.get(namespace)
+            if store is not None:
+                self._stores.move_to_end(namespace)
+                return store
+            store = self._evicted.pop(namespace, None) or open_memory_store(self.storage_path, namespace)
+            self._stores[namespace] = store
+            while len(self._stores) > self.max_open:
+                name, victim = self._stores.popitem(last=False)
+                self._evicted[name] = victim
+                evicted.append(victim)
+        # 在锁外写完日志，不阻塞其他命名空间的访问
+        for victim in evicted:
+            victim.release()
+        return store
+
+    def pin(self, namespace: str, store: Optional[MemoryStore] = None) -> MemoryStore:
+        """把命名空间固定为常驻；指定 store 时用它替换当前的存储 (被替换的存储会被关闭)"""
+        with self.lock:
+            self._pinned_names.add(namespace)
+            current = (self._stores.pop(namespace, None) or self._pinned.get(namespace)
+                       or self._evicted.pop(namespace, None))
+            if store is None:
+                store = current or open_memory_store(self.storage_path, namespace)
+            elif current is not None and current is not store:
+                current.close()
+            self._pinned[namespace] = store
+            return store
+
+    def close(self):
+        with self.lock:
+            for store in list(self._stores.values()) + list(self._pinned.values()) + list(self._evicted.values()):
+                store.close()
+            self._stores.clear()
+            self._pinned.clear()
+            self._evicted.clear()
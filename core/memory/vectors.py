@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：不做跨进程加锁
+    fcntl = None
+
+import numpy as np
+
+from core.memory.index import tokenize
+
+logger = logging.getLogger("omni.core.memory.vectors")
+
+ASCII_WORD_RE = re.compile(r'[a-z0-9_]{4,}')
+# 行数达到该值后建立 IVF 倒排分区，查询只扫描最近的若干个分区
+IVF_MIN_ROWS = 50000
+IVF_NPROBE = 8
+IVF_TRAIN_SAMPLE = 20000
+IVF_ITERATIONS = 8
+# 分区建立后行数增长到训练时的该倍数即重新训练
+IVF_RETRAIN_FACTOR = 4
+# 分块处理矩阵，避免一次性把整个 memmap 读入内存
+BLOCK_ROWS = 65536
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+class HashingEmbedder:
+    """
+    离线向量化：词与中文二元组 (同 BM25 分词) 加上英文单词的字符三元组，
+    经 crc32 哈希到固定维度并带符号累加 (hashing trick)，再做 L2 归一化。
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        features = tokenize(text)
+        for word in ASCII_WORD_RE.findall(text.lower()):
+            features.extend(f"#{word[i:i + 3]}" for i in range(len(word) - 2))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(out)
+
+class ProviderEmbedder:
+    """
+    通过 LLMGateway 调用厂商向量接口。接口是同步的：请求在独立线程的事件循环中执行，
+    因此在事件循环内部调用也不会冲突。维度由首次返回的向量确定。
+    """
+    BATCH = 64
+
+    def __init__(self, provider: str, gateway: Any = None, model: Optional[str] = None, timeout: float = 30.0):
+        self.provider = provider
+        self.model = model
+        self.timeout = timeout
+        self.name = f"{provider}:{model or 'default'}"
+        self.dim: Optional[int] = None
+        self._gateway = gateway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="omni-embed")
+
+    @property
+    def gateway(self):
+        if self._gateway is None:
+            from core.llm_gateway import LLMGateway
+            self._gateway = LLMGateway()
+        return self._gateway
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.BATCH):
+            batch = texts[start:start + self.BATCH]
+            future = self._executor.submit(asyncio.run, self.gateway.embed(self.provider, batch, self.model))
+            res = future.result(self.timeout)
+            if res.get("status") != "success":
+                raise RuntimeError(res.get("error", "embedding failed"))
+            rows.extend(res["vectors"])
+        vectors = _normalize(np.asarray(rows, dtype=np.float32).reshape(len(texts), -1))
+        self.dim = vectors.shape[1]
+        return vectors
+
+def make_embedder(name: str, dim: int = 256):
+    """按配置创建向量化器：hashing 为离线默认值，其余视为厂商名 (可写作 provider:model)"""
+    if not name or name == HashingEmbedder.name:
+        return HashingEmbedder(dim)
+    provider, _, model = name.partition(":")
+    return ProviderEmbedder(provider, model=model or None)
+
+class _IVF:
+    """IVF 分区：k-means 质心 + 每个分区的行号列表 (新增行按最近质心追加)"""
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = centroids
+        self.lists = [array("i") for _ in range(len(centroids))]
+        self.trained_rows = 0
+
+    @classmethod
+    def train(cls, matrix: np.ndarray) -> "_IVF":
+        rows = len(matrix)
+        nlist = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, min(rows, IVF_TRAIN_SAMPLE), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        ivf = cls(centroids)
+        ivf.add(matrix, 0)
+        ivf.trained_rows = rows
+        return ivf
+
+    def add(self, vectors: np.ndarray, first_row: int):
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + BLOCK_ROWS])
+            for offset, c in enumerate(np.argmax(block @ self.centroids.T, axis=1)):
+                self.lists[c].append(first_row + start + offset)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        ids = np.concatenate([np.frombuffer(self.lists[c], dtype=np.int32) for c in probes])
+        ids.sort()
+        return ids
+
+class VectorIndex:
+    """
+    磁盘上的 float32 向量矩阵 (行号即事实下标)：新增向量直接追加到文件末尾，
+    查询时以 np.memmap 映射，启动时不把矩阵读入内存。
+    行数较少时一次矩阵乘法暴力求 top-k；达到 ivf_min_rows 后使用 IVF 分区只扫描部分行。
+    generation 为事实列表的代数 (删除或合并事实后递增)，与文件记录的代数不一致时旧向量作废；
+    多个进程共用同一文件时，追加与压实在文件锁内进行。
+    """
+    def __init__(self, path: str, embedder: Any, ivf_min_rows: int = IVF_MIN_ROWS, nprobe: int = IVF_NPROBE,
+                 generation: int = 0):
+        self.path = path
+        self.meta_path = path + ".json"
+        self.embedder = embedder
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self.generation = generation
+        self.dim: Optional[int] = getattr(embedder, "dim", None)
+        self.rows = 0
+        self._matrix: Optional[np.memmap] = None
+        self._ivf: Optional[_IVF] = None
+        self._open()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _open(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load vector index meta {self.meta_path}: {e}")
+        if (meta.get("embedder") != self.embedder.name or (self.dim and meta.get("dim") != self.dim)
+                or meta.get("generation", 0) != self.generation):
+            # 向量化器、维度或事实代数变化：旧向量不可比或行号已错位，丢弃后按需重建
+            self.reset()
+            return
+        self.dim = meta["dim"]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        row_bytes = self.dim * 4
+        self.rows = size // row_bytes
+        if size % row_bytes:
+            # 崩溃留下的半行截掉
+            with open(self.path, "r+b") as f:
+                f.truncate(self.rows * row_bytes)
+
+    def reset(self):
+        for path in (self.path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.rows = 0
+        self._matrix = None
+        self._ivf = None
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _write_meta(self):
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder.name, "dim": self.dim, "generation": self.generation}, f)
+
+    def append(self, texts: List[str], vectors: Optional[np.ndarray] = None):
+        """
+        向量化并追加到文件末尾，不重写已有数据；其他进程已追加的行直接复用。
+        vectors 为已算好的向量 (与 texts 一一对应) 时不再调用向量化器。
+        """
+        with self._file_lock():
+            if self.dim and os.path.exists(self.path):
+                written = os.path.getsize(self.path) // (self.dim * 4)
+                if written > self.rows:
+                    skip = written - self.rows
+                    texts = texts[skip:]
+                    if vectors is not None:
+                        vectors = vectors[skip:]
+                    self.rows = written
+                    self._matrix = None
+                    self._ivf = None
+            if not texts:
+                return
+            if vectors is None:
+                vectors = self.embedder.embed(texts)
+            if self.dim is None or not os.path.exists(self.meta_path):
+                self.dim = vectors.shape[1]
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._write_meta()
+            with open(self.path, "ab") as f:
+                f.write(vectors.tobytes())
+        first_row = self.rows
+        self.rows += len(vectors)
+        self._matrix = None
+        if self._ivf is not None:
+            self._ivf.add(vectors, first_row)
+
+    def compact(self, rows: Sequence[int], generation: int):
+        """只保留给定的行 (按给定顺序) 并记录新的代数：分块写入临时文件后原子替换"""
+        with self._file_lock():
+            matrix = self.matrix()
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                for start in range(0, len(rows), BLOCK_ROWS):
+                    f.write(np.asarray(matrix[list(rows[start:start + BLOCK_ROWS])]).tobytes())
+            del matrix
+            self._matrix = None
+            os.replace(tmp, self.path)
+            self.rows = len(rows)
+            self.generation = generation
+            self._ivf = None
+            if self.dim:
+                self._write_meta()
+
+    def matrix(self) -> Optional[np.memmap]:
+        if self._matrix is None and self.rows:
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    @property
+    def needs_training(self) -> bool:
+        """行数已达到 IVF 阈值但分区尚未建立或需要重新训练"""
+        return self.rows >= self.ivf_min_rows and (
+            self._ivf is None or self.rows >= self._ivf.trained_rows * IVF_RETRAIN_FACTOR)
+
+    def train(self, matrix: np.ndarray) -> _IVF:
+        """按 matrix() 取得的矩阵训练 IVF 分区并返回，不替换正在使用的分区 (可在调用方的锁外执行)"""
+        return _IVF.train(matrix)
+
+    def install(self, ivf: _IVF) -> bool:
+        """启用 train() 得到的分区；训练期间行数有变化时放弃，返回是否启用"""
+        if ivf.trained_rows != self.rows:
+            return False
+        self._ivf = ivf
+        return True
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """返回余弦相似度最高的 k 个 (行号, 相似度)，按相似度降序"""
+        matrix = self.matrix()
+        if matrix is None or k <= 0:
+            return []
+        q = self.embedder.embed([query])[0]
+        ids = None
+        if self.rows >= self.ivf_min_rows:
+            if self.needs_training:
+                self._ivf = _IVF.train(matrix)
+            ids = self._ivf.candidates(q, self.nprobe)
+            scores = matrix[ids] @ q
+        else:
+            scores = np.asarray(matrix @ q)
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = ids[top] if ids is not None else top
+        return [(int(row), float(scores[i])) for row, i in zip(rows, top)]
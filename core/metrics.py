@@ -0,0 +1,208 @@
+import logging
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger("omni.core.metrics")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# 延迟直方图的默认桶上界 (秒)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 标签组合数超过上限后，新组合统一计入该值，防止外部输入的标签撑爆内存与时序库
+OVERFLOW_LABEL = "other"
+
+class Sample(NamedTuple):
+    suffix: str  # 追加在指标名后的后缀，如 _total、_bucket
+    labels: Dict[str, str]
+    value: float
+
+class MetricFamily(NamedTuple):
+    name: str
+    type: str  # counter / gauge / histogram
+    help: str
+    samples: List[Sample]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 非累计计数，最后一格为 +Inf
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def observe_ns(self, elapsed_ns: int):
+        """记录 perf_counter_ns 差值 (换算为秒)"""
+        self.observe(elapsed_ns / 1e9)
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 max_series: Optional[int] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = settings.METRICS_MAX_SERIES if max_series is None else max_series
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """按标签值取子序列 (首次出现时创建)；热路径上只有一次字典查找"""
+        child = self._children.get(values)
+        if child is not None:
+            return child
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                if len(self._children) >= self.max_series:
+                    values = (OVERFLOW_LABEL,) * len(self.labelnames)
+                    child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+            return child
+
+    def _series(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, values)), child) for values, child in items]
+
+class Counter(_Metric):
+    """单调递增计数器：导出为 <name>_total"""
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def collect(self) -> MetricFamily:
+        samples = [Sample("_total", labels, child.value) for labels, child in self._series()]
+        return MetricFamily(self.name, self.type, self.documentation, samples)
+
+class Histogram(_Metric):
+    """分桶直方图：记录时只做一次二分查找与两次加法，导出时再累加为 le 累计桶"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, max_series: Optional[int] = None):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def observe_ns(self, elapsed_ns: int):
+        self.labels().observe_ns(elapsed_ns)
+
+    def collect(self) -> MetricFamily:
+        samples = []
+        for labels, child in self._series():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                samples.append(Sample("_bucket", dict(labels, le=le), cumulative))
+            samples.append(Sample("_count", labels, cumulative))
+            samples.append(Sample("_sum", labels, total))
+        return MetricFamily(self.name, self.type, self.documentation, samples)
+
+class MetricsRegistry:
+    """
+    进程内指标注册表：计数器与直方图在调用处实时累加，
+    collector 在抓取时才读取各模块已有的统计 (如 TokenTracker 的累计值)，记录路径零开销。
+    render 输出 OpenMetrics 文本格式，供 Prometheus 抓取 /metrics。
+    """
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._lock = Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            metrics, collectors = list(self._metrics.values()), list(self._collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        return families
+
+    def render(self) -> str:
+        lines = []
+        for family in self.collect():
+            lines.append(f"# TYPE {family.name} {family.type}")
+            lines.append(f"# HELP {family.name} {_escape(family.help)}")
+            for suffix, labels, value in family.samples:
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                    lines.append(f"{family.name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{family.name}{suffix} {_format_value(value)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+# 全局单例
+registry = MetricsRegistry()
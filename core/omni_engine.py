@@ -1,46 +1,53 @@
 import asyncio
+import inspect
 import logging
-import re
-import os
 import json
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from core.agent import OmniAgent
+from core.config import settings
+from core.memory import DEFAULT_NAMESPACE, MemoryBank, MemoryStore
+from core.compression import ShrinkSessionStore, ShrinkCache, ShrinkResult, ShrinkPool, StreamShrinker, shrink_messages
+from core.compression.alias import expand_aliases
+from core.compression.messages import message_text
+from core.compression.patterns import MIN_CHARS, OPTIMIZED_PREFIX, TAIL_LINES
+from core.compression.pipeline import shrink_text
+from core.compression.stream import encoding_for_path, iter_file_chunks
+from core.metrics import registry
 from core.skills.local_skills import SystemSkill, FileSkill
+from core.summarizer import SummaryWorker
 from core.token_tracker import token_tracker
+from core.tokenizer import count_tokens
 
 logger = logging.getLogger("omni.engine")
 
-class MemoryStore:
-    """本地持久化记忆存储"""
-    def __init__(self, storage_path: str = "data/memory.json"):
-        self.storage_path = storage_path
-        os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
-        self.memory = self._load()
-
-    def _load(self) -> Dict[str, Any]:
-        if os.path.exists(self.storage_path):
-            try:
-                with open(self.storage_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Failed to load memory: {e}")
-        return {"user_profile": {}, "long_term_facts": [], "task_history": []}
-
-    def save(self):
-        try:
-            with open(self.storage_path, "w", encoding="utf-8") as f:
-                json.dump(self.memory, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Failed to save memory: {e}")
-
-    def update_profile(self, key: str, value: Any):
-        self.memory["user_profile"][key] = value
-        self.save()
-
-    def add_fact(self, fact: str):
-        if fact not in self.memory["long_term_facts"]:
-            self.memory["long_term_facts"].append(fact)
-            self.save()
+COMPRESS_DURATION = registry.histogram("omni_compress_duration_seconds", "compress_context 耗时",
+                                       ("provider", "cache"))
+
+# 压缩参数 (shrink_text 的可选参数) 及其默认值
+SHRINK_OPTION_DEFAULTS = {name: param.default for name, param in inspect.signature(shrink_text).parameters.items()
+                          if name not in ("context", "provider", "mem_info")}
+
+def _cache_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """缓存键使用的压缩参数：补齐默认值并统一数值类型，省略参数与显式传入默认值得到同一个键"""
+    normalized = dict(SHRINK_OPTION_DEFAULTS, **options)
+    if normalized["target_tokens"] is not None:
+        normalized["target_tokens"] = int(normalized["target_tokens"])
+    if normalized["target_ratio"] is not None:
+        normalized["target_ratio"] = float(normalized["target_ratio"])
+    return normalized
+
+def _tail_query(text: str, lines: int = TAIL_LINES) -> str:
+    """取文本末尾的若干非空行作为记忆检索的查询，只扫描文本尾部"""
+    out: List[str] = []
+    end = len(text)
+    while end > 0 and len(out) < lines:
+        start = text.rfind("\n", 0, end) + 1
+        line = text[start:end].strip()
+        if line:
+            out.append(line)
+        end = start - 1
+    return "\n".join(reversed(out))
 
 class OmniEngine:
     """
@@ -49,88 +56,259 @@ class OmniEngine:
     """
     def __init__(self):
         self.agent = OmniAgent("Omni", "Clawdbot Helper")
-        self.memory = MemoryStore()
+        # 按用户/会话划分命名空间的长效记忆；默认命名空间常驻 (self.memory)，其余按 LRU 淘汰
+        self.memories = MemoryBank(settings.MEMORY_PATH, settings.MEMORY_MAX_OPEN)
         self.skills = {
             "system": SystemSkill(),
             "file": FileSkill()
         }
+        self.sessions = ShrinkSessionStore(
+            max_sessions=settings.SHRINK_MAX_SESSIONS,
+            idle_ttl=settings.SHRINK_SESSION_TTL,
+            summary_chars=settings.SUMMARY_SEGMENT_CHARS if settings.SHRINK_LLM_SUMMARY else 0
+        )
+        self.cache = ShrinkCache(
+            max_bytes=settings.SHRINK_CACHE_MAX_BYTES,
+            disk_dir=settings.SHRINK_CACHE_DIR or None,
+            disk_max_bytes=settings.SHRINK_CACHE_DISK_MAX_BYTES
+        )
+        self.pool = ShrinkPool(
+            max_workers=settings.SHRINK_POOL_WORKERS or None,
+            max_inflight=settings.SHRINK_POOL_MAX_INFLIGHT or None
+        )
+        # 长会话的后台分层摘要
+        self.summarizer = SummaryWorker(max_pending=settings.SUMMARY_MAX_PENDING)
 
-    async def execute_task(self, task_desc: str) -> str:
-        """执行本地任务并返回结果"""
+    async def execute_task(self, task_desc: str, aliases: Optional[Dict[str, str]] = None,
+                           namespace: Optional[str] = None) -> str:
+        """
+        执行本地任务并返回结果；namespace 为记忆所属的用户/会话。
+        aliases 为该请求压缩时返回的别名表，任务中的句柄先据此还原为完整值。
+        """
+        task_desc = self.expand_aliases(task_desc, aliases)
         # 1. 拦截直接命令
         if task_desc.startswith("RUN:"):
             cmd = task_desc.replace("RUN:", "").strip()
             res = await self.skills["system"].execute("run_command", command=cmd)
             return str(res.get("data", res.get("error")))
         
-        # 2. 记忆注入：如果是自我介绍或偏好设置，存入记忆
+        # 2. 记忆注入：如果是自我介绍或偏好设置，存入记忆 (明确要求"记住"的置顶，不会被归档)
         if any(k in task_desc.lower() for k in ["我是", "我喜欢", "记住", "我的名字"]):
-            self.memory.add_fact(task_desc)
+            self.memory_for(namespace).add_fact(task_desc, pinned="记住" in task_desc)
             return f"Omni 已将此信息存入长效记忆：'{task_desc}'"
 
         # 3. 交给智能体思考 (轻量级本地处理)
         thought = await self.agent.think(task_desc)
         return thought.get("text", "Task failed")
 
-    def compress_context(self, context: str, provider: str = "deepseek", scene: str = "general") -> str:
+    def compress_context(self, context: str, provider: str = "deepseek", scene: str = "general",
+                         namespace: Optional[str] = None, **options: Any) -> str:
+        """压缩上下文并返回文本，参数见 compress_context_result"""
+        return self.compress_context_result(context, provider, scene, namespace, **options).text
+
+    def compress_context_result(self, context: str, provider: str = "deepseek", scene: str = "general",
+                                namespace: Optional[str] = None, **options: Any) -> ShrinkResult:
         """
         核心插件功能：语义级 Token 压缩算法 (Smart Shrinking)。
         针对 DeepSeek 进行优化，自动识别关键路径、API Key 和代码块。
+        相同内容的重复请求直接命中结果缓存，跳过全部计算。
+
+        options 透传给 shrink_text：
+        - target_tokens / target_ratio: 预算模式，中间层按重要度保留原句，直到输出达到目标 Token 数，
+          以匹配各厂商的上下文窗口与计费档位。
+        - dedup: 是否先消除近重复的行与代码块 (默认开启)。
+        - structured: 是否用专用压缩器处理 JSON、日志与堆栈 (默认开启)。
+        - code_diff: 代码演进模式，同一文件的多个版本保留最新全文，旧版本以紧凑 diff 表示。
+        - layout: "cache" 时输出前缀逐轮稳定的缓存友好布局，便于命中厂商侧的提示词缓存。
+        - alias: 重复的长路径/URL/UUID/密钥替换为 §P1 等短句柄并附别名表，
+          句柄表随结果返回 (ShrinkResult.aliases)，调用方用它调用 expand_aliases 还原。
+        namespace 指定注入哪个用户/会话的长效记忆 (默认命名空间为 self.memory)。
         """
-        if not context or len(context) < 400: 
-            return context
+        if not context or len(context) < MIN_CHARS: 
+            return ShrinkResult(text=context, compressed=False)
 
-        original_len = len(context)
-        
-        # 1. 保护性提取：防止压缩破坏关键信息
-        # 保护 API Keys
-        keys = re.findall(r'sk-[a-zA-Z0-9]{20,}', context)
-        # 保护 文件路径
-        paths = re.findall(r'[a-zA-Z]:\\[^ \n]+|/[a-zA-Z0-9/_.-]+', context)
-        # 保护 代码块 (极简提取)
-        code_snippets = re.findall(r'```[\s\S]*?```', context)
-        
-        important_entities = list(dict.fromkeys(keys + paths))
-        
-        # 2. 结构化降噪
-        lines = [line.strip() for line in context.split("\n") if line.strip()]
-        if len(lines) <= 10:
-            return context
-            
-        # 保留最近的对话 (Last 5 lines) 和 系统提示 (First 2 lines)
-        header = lines[:2]
-        tail = lines[-6:]
-        
-        # 3. 中间层语义压缩
-        middle_lines = lines[2:-6]
-        middle_text = " ".join(middle_lines)
-        
-        # 提取动词和名词作为摘要
-        keywords = re.findall(r'[\u4e00-\u9fa5]{2,}|[A-Z][a-z]{3,}', middle_text)
-        summary_points = list(dict.fromkeys(keywords))[:20]
-        
-        # 注入长效记忆提示 (如果存在)
-        mem_info = ""
-        if self.memory.memory["long_term_facts"]:
-            relevant_mems = self.memory.memory["long_term_facts"][-3:]
-            mem_info = f"\n[长效记忆提示: {'; '.join(relevant_mems)}]"
-
-        compressed_middle = f"\n[历史上下文压缩摘要: 讨论了 {', '.join(summary_points)}]"
-        if important_entities:
-            compressed_middle += f" | 关键实体: {', '.join(important_entities[:5])}"
-        
-        # 重新组装
-        final_summary = "\n".join(header) + mem_info + compressed_middle + "\n" + "\n".join(tail)
-        
-        # 如果有代码块，选择性保留最新的一个
-        if code_snippets:
-            final_summary += f"\n\n[附带最新代码片段引用]\n{code_snippets[-1]}"
+        start_ns = time.perf_counter_ns()
+        key = self.cache.make_key(context, provider, scene, self.memory_for(namespace).facts_version,
+                                  namespace, **_cache_options(options))
+        result = self.cache.get(key)
+        hit = result is not None
+        token_tracker.record_cache_lookup(hit)
+        if result is None:
+            result = self._shrink(context, provider, namespace, **options)
+            self.cache.put(key, result)
 
-        # 记录节省数据
-        token_tracker.record(provider, scene, original_len, len(final_summary))
-        
-        logger.info(f"Token Optimized: {original_len} -> {len(final_summary)} bytes")
-        return "[Omni Optimized Context]\n" + final_summary
+        self._record_result(provider, scene, result, namespace)
+        COMPRESS_DURATION.labels(provider, "hit" if hit else "miss").observe_ns(time.perf_counter_ns() - start_ns)
+        return result
+
+    def compress_messages(self, messages: List[Dict[str, Any]], provider: str = "deepseek", scene: str = "general",
+                          keep_turns: Optional[int] = None, namespace: Optional[str] = None,
+                          **options: Any) -> List[Dict[str, Any]]:
+        """压缩消息数组并返回新的消息数组，参数见 compress_messages_result"""
+        return self.compress_messages_result(messages, provider, scene, keep_turns, namespace, **options).messages
+
+    def compress_messages_result(self, messages: List[Dict[str, Any]], provider: str = "deepseek",
+                                 scene: str = "general", keep_turns: Optional[int] = None,
+                                 namespace: Optional[str] = None, **options: Any) -> ShrinkResult:
+        """
+        按角色压缩 OpenAI 格式的消息数组：system 固定保留，最近 keep_turns 轮原样保留，
+        更早的历史 (工具输出强压缩) 合并为一条 system 摘要。返回的消息数组可直接转发给厂商。
+        options 同 compress_context，作用于较早历史的摘要。
+        """
+        keep_turns = settings.SHRINK_KEEP_TURNS if keep_turns is None else keep_turns
+        content = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        key = self.cache.make_key(content, provider, scene, self.memory_for(namespace).facts_version, namespace,
+                                  messages=True, keep_turns=keep_turns, **_cache_options(options))
+        result = self.cache.get(key)
+        token_tracker.record_cache_lookup(result is not None)
+        if result is None:
+            query = "\n".join(message_text(m) for m in messages[-TAIL_LINES:])
+            result = shrink_messages(messages, provider, self._memory_hint(query, namespace), keep_turns, **options)
+            self.cache.put(key, result)
+
+        self._record_result(provider, scene, result, namespace)
+        return result
+
+    async def iter_compress_batch(self, contexts: List[str], provider: str = "deepseek", scene: str = "general",
+                                  namespace: Optional[str] = None, **options: Any) -> AsyncIterator[Tuple[int, str]]:
+        """
+        批量压缩：缓存命中与过短的上下文立即返回，其余分发到常驻进程池，
+        按完成顺序产出 (下标, 压缩结果)。options 同 compress_context。
+        """
+        facts_version = self.memory_for(namespace).facts_version
+        jobs = []
+        job_slots: List[Tuple[int, str]] = []  # 任务 -> (输入下标, 缓存键)
+        for index, context in enumerate(contexts):
+            if not context or len(context) < MIN_CHARS:
+                yield index, context
+                continue
+            key = self.cache.make_key(context, provider, scene, facts_version, namespace, **_cache_options(options))
+            result = self.cache.get(key)
+            token_tracker.record_cache_lookup(result is not None)
+            if result is not None:
+                self._record_result(provider, scene, result, namespace)
+                yield index, result.text
+                continue
+            jobs.append(dict(options, context=context, provider=provider,
+                             mem_info=self._memory_hint(context, namespace)))
+            job_slots.append((index, key))
+
+        if not jobs:
+            return
+        async for job_index, result in self.pool.imap_unordered(jobs):
+            index, key = job_slots[job_index]
+            self.cache.put(key, result)
+            self._record_result(provider, scene, result, namespace)
+            yield index, result.text
+
+    async def compress_batch(self, contexts: List[str], provider: str = "deepseek", scene: str = "general",
+                             namespace: Optional[str] = None, **options: Any) -> List[str]:
+        """批量压缩并按输入顺序返回结果"""
+        summaries: List[Optional[str]] = [None] * len(contexts)
+        async for index, summary in self.iter_compress_batch(contexts, provider, scene, namespace, **options):
+            summaries[index] = summary
+        return summaries
+
+    def _record_result(self, provider: str, scene: str, result: ShrinkResult, namespace: Optional[str] = None):
+        if result.compressed:
+            # 记录节省数据 (Token 数按厂商分词器计算，同时保留字符数)；费用按命名空间 (用户/会话) 汇总
+            token_tracker.record(provider, scene, result.original_tokens, result.optimized_tokens,
+                                 result.original_chars, result.optimized_chars, user=namespace)
+
+    def _shrink(self, context: str, provider: str, namespace: Optional[str] = None, **options: Any) -> ShrinkResult:
+        """执行一次完整的压缩计算"""
+        return shrink_text(context, provider, self._memory_hint(context, namespace), **options)
+
+    def compress_incremental(self, session_id: str, new_context: str, provider: str = "deepseek",
+                             scene: str = "general", reset: bool = False, layout: str = "default",
+                             namespace: Optional[str] = None) -> str:
+        """
+        会话级增量压缩：调用方只发送新增的对话轮次，引擎复用该会话已有的压缩状态，
+        耗时与新增内容成正比，而不是与整段对话长度成正比。增量模式不做近重复消除与结构化压缩。
+        layout 同 compress_context，两种布局的状态都随会话维护，可逐次切换。
+
+        会话中间层每累计 SUMMARY_SEGMENT_CHARS 字符即交给后台生成 LLM 摘要并逐层合并，
+        本次调用只使用已就绪的摘要，从不等待 LLM。
+        """
+        if reset:
+            self.sessions.drop(session_id)
+        session = self.sessions.get(session_id)
+
+        with session.lock:
+            session.append(new_context)
+            session.token_count += count_tokens(new_context, provider)
+            # 在会话锁内登记摘要段，保证段号与原文顺序一致 (并发调用不会交错)
+            jobs = []
+            if self.summarizer.provider():
+                jobs = [session.summaries.add_segment(segment, count_tokens(segment, provider))
+                        for segment in session.pop_summary_segments()]
+            else:
+                session.pop_summary_segments()
+            if not session.compressible:
+                return session.raw_text()
+            original_len = session.char_count
+            original_tokens = session.token_count
+            cover = session.summaries.cover()
+            final_summary = session.render(self._memory_hint(session.recent_text(), namespace), layout,
+                                           [text for text, _ in cover])
+
+        for job in jobs:
+            self.summarizer.submit(session.summaries, job)
+        if cover:
+            emitted = sum(count_tokens(text, provider) for text, _ in cover)
+            token_tracker.record_summary_use(sum(tokens for _, tokens in cover), emitted)
+
+        optimized_tokens = count_tokens(final_summary, provider)
+        token_tracker.record(provider, scene, original_tokens, optimized_tokens, original_len, len(final_summary),
+                             user=namespace)
+
+        logger.info(f"Token Optimized (session {session_id}): {original_tokens} -> {optimized_tokens} tokens")
+        return OPTIMIZED_PREFIX + final_summary
+
+    def open_stream(self, provider: str = "deepseek", layout: str = "default",
+                    encoding: Optional[str] = None, namespace: Optional[str] = None) -> StreamShrinker:
+        """
+        创建流式压缩器，用于超大输入 (数十到数百 MB)：调用方逐块 feed 原始字节
+        (encoding 为 gzip/zstd 时先增量解压)，再调用 finish_stream 取得结果。峰值内存与输入大小无关。
+        """
+        return StreamShrinker(provider, layout, encoding, lambda text: self._memory_hint(text, namespace))
+
+    def finish_stream(self, shrinker: StreamShrinker, scene: str = "general", namespace: Optional[str] = None) -> str:
+        result = shrinker.finish()
+        self._record_result(shrinker.provider, scene, result, namespace)
+        return result.text
+
+    def compress_file(self, path: str, provider: str = "deepseek", scene: str = "general",
+                      layout: str = "default", namespace: Optional[str] = None) -> str:
+        """以内存映射方式流式压缩本地文件，.gz/.zst 后缀的文件先增量解压"""
+        shrinker = self.open_stream(provider, layout, encoding_for_path(path), namespace)
+        for chunk in iter_file_chunks(path):
+            shrinker.feed(chunk)
+        return self.finish_stream(shrinker, scene, namespace)
+
+    def expand_aliases(self, text: str, aliases: Optional[Dict[str, str]]) -> str:
+        """按调用方自己的别名表 (压缩结果的 ShrinkResult.aliases) 把句柄还原为完整值；没有别名表时原样返回"""
+        return expand_aliases(text, aliases)
+
+    @property
+    def memory(self) -> MemoryStore:
+        """默认命名空间的记忆存储 (在 MemoryBank 中常驻，不会被淘汰关闭)"""
+        return self.memories.get(DEFAULT_NAMESPACE)
+
+    @memory.setter
+    def memory(self, store: MemoryStore):
+        self.memories.pin(DEFAULT_NAMESPACE, store)
+
+    def memory_for(self, namespace: Optional[str] = None) -> MemoryStore:
+        """命名空间 (用户/会话) 对应的记忆存储，未指定时为默认命名空间"""
+        return self.memories.get(namespace)
+
+    def _memory_hint(self, context: str, namespace: Optional[str] = None) -> str:
+        """注入与当前对话 (末尾若干行) 相关的长效记忆提示，没有相关记忆时为空"""
+        facts = self.memory_for(namespace).search(_tail_query(context), settings.MEMORY_HINT_FACTS)
+        if not facts:
+            return ""
+        return f"\n[长效记忆提示: {'; '.join(facts)}]"
 
 # 全局实例
 omni_engine = OmniEngine()
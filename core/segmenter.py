@@ -0,0 +1,168 @@
+import logging
+import math
+import os
+import re
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from core.config import settings
+
+logger = logging.getLogger("omni.core.segmenter")
+
+CJK_RE = re.compile(r'[一-龥]+')
+
+# 内置基础词表 (无外部词典时使用)：虚词/常用词给较高词频，使其优先被切分出来
+_BUILTIN_FUNCTION_WORDS = """
+的 了 是 在 和 与 及 或 也 就 都 而 着 过 把 被 让 给 向 从 对 为 以 于 之 其 这 那 你 我 他 她 它 们 吗 呢 吧 啊 请 帮
+一个 一下 一些 这个 那个 这些 那些 这里 那里 这样 那样 怎么 什么 为什么 如何 是否 没有 还是 但是 因为 所以 如果 然后
+已经 正在 可以 可能 需要 应该 能够 不能 不要 不会 还有 以及 或者 并且 而且 我们 你们 他们 它们 自己 大家 现在 之后 之前
+目前 暂时 继续 开始 结束 进行 出现 发现 通过 使用 关于 对于 其中 所有 每个 各个 时候 问题 东西 情况 方面 部分 一直
+无法 建议 希望 觉得 帮我 一样 比较 非常 这是 那是
+"""
+_BUILTIN_TERMS = """
+配置 配置文件 文件 目录 路径 数据 数据库 连接 缓存 策略 部署 脚本 日志 系统 权限 模块 消息 队列 前端 后端 页面 定时 定时任务
+任务 监控 面板 检查 更新 异常 错误 报错 重构 优化 访问 迁移 依赖 生产 生产环境 环境 测试 测试服务器 服务器 服务 本地 版本
+备份 节点 备份节点 容器 镜像 容器镜像 接口 第三方 第三方服务 状态 结果 正常 代码 修改 用户 助手 模型 网关 插件 技能 工具
+压缩 上下文 对话 历史 摘要 记忆 长效 长效记忆 令牌 密钥 安全 网络 请求 响应 超时 延迟 性能 内存 进程 线程 并发 调度 队列
+命令 执行 运行 启动 重启 停止 安装 卸载 编译 构建 发布 回滚 提交 分支 合并 仓库 函数 变量 参数 返回 调用 字段 类型 格式
+文档 说明 设置 选项 开关 默认 自动 手动 新的 旧的 新版本 旧接口 集群 实例 负载 均衡 限流 认证 授权 账号 密码 邮件 通知
+机器人 频道 群组 图片 视频 音频 文本 翻译 搜索 索引 向量 检索 排序 统计 报表 分析 计划 流程 工作流 事件 回调 钩子 中间件
+"""
+FUNCTION_WORD_FREQ = 50000
+TERM_FREQ = 3000
+
+# 关键词停用词：虚词与泛化词不作为摘要关键词
+STOPWORDS = frozenset(_BUILTIN_FUNCTION_WORDS.split()) | frozenset(
+    "This That There These Those They Then Than When What Where Which While With From Into Your Have Will "
+    "Would Could Should About After Before Please Thanks Also Just Here Some Only "
+    # 对话记录中的角色标签
+    "User System Assistant Tool".split()
+)
+# 连续的词典外单字在该长度范围内视为一个新词，否则丢弃
+MIN_NEW_WORD = 2
+MAX_NEW_WORD = 4
+
+class Segmenter:
+    """
+    基于词典的最大概率中文分词：前缀词典 (哈希 Trie) 生成切分有向无环图，
+    动态规划选择对数概率之和最大的路径。同一字符串的切分结果会被缓存。
+    """
+    CACHE_SIZE = 65536
+
+    def __init__(self, freqs: Dict[str, int]):
+        self.freq: Dict[str, int] = {}
+        for word, freq in freqs.items():
+            self.freq[word] = freq
+            # 前缀以 0 词频登记，使 DAG 构建时可以提前结束
+            for i in range(1, len(word)):
+                self.freq.setdefault(word[:i], 0)
+        total = sum(freqs.values()) or 1
+        self.log_total = math.log(total)
+        self.max_len = max((len(w) for w in freqs), default=1)
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+
+    @classmethod
+    def from_file(cls, path: str, base: Optional[Dict[str, int]] = None) -> "Segmenter":
+        """读取 jieba 格式词典 (每行: 词 词频 [词性])，与基础词表合并"""
+        freqs = dict(base or {})
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    freqs[parts[0]] = int(parts[1])
+        return cls(freqs)
+
+    def cut(self, text: str) -> Tuple[str, ...]:
+        """切分一段纯中文文本，词典外的连续单字按长度合并为新词或丢弃"""
+        cached = self._cache.get(text)
+        if cached is not None:
+            return cached
+        words = self._merge_unknown(self._best_path(text))
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[text] = words
+        return words
+
+    def _best_path(self, text: str) -> List[str]:
+        n = len(text)
+        freq = self.freq
+        log_total = self.log_total
+        route: List[Tuple[float, int]] = [(0.0, 0)] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            best = (math.log(freq.get(text[i]) or 1) - log_total + route[i + 1][0], i + 1)
+            for j in range(i + 2, min(n, i + self.max_len) + 1):
+                f = freq.get(text[i:j])
+                if f is None:
+                    break
+                if f:
+                    score = math.log(f) - log_total + route[j][0]
+                    if score > best[0]:
+                        best = (score, j)
+            route[i] = best
+        words = []
+        i = 0
+        while i < n:
+            j = route[i][1]
+            words.append(text[i:j])
+            i = j
+        return words
+
+    def _merge_unknown(self, words: List[str]) -> Tuple[str, ...]:
+        out: List[str] = []
+        run: List[str] = []
+        for word in words + [""]:
+            if len(word) == 1 and not self.freq.get(word):
+                run.append(word)
+                continue
+            if MIN_NEW_WORD <= len(run) <= MAX_NEW_WORD:
+                out.append("".join(run))
+            elif len(run) == 1:
+                out.append(run[0])
+            run = []
+            if word:
+                out.append(word)
+        return tuple(out)
+
+def builtin_freqs() -> Dict[str, int]:
+    freqs = {w: TERM_FREQ for w in _BUILTIN_TERMS.split()}
+    freqs.update({w: FUNCTION_WORD_FREQ for w in _BUILTIN_FUNCTION_WORDS.split()})
+    return freqs
+
+_segmenter: Optional[Segmenter] = None
+_segmenter_lock = Lock()
+
+def set_segmenter(segmenter: Segmenter):
+    """替换全局分词器，便于接入自定义词典"""
+    global _segmenter
+    with _segmenter_lock:
+        _segmenter = segmenter
+
+def get_segmenter() -> Segmenter:
+    """
+    获取进程内共享的分词器：首次使用时加载 SEGMENT_DICT 指向的 jieba 格式词典 (与内置词表合并)，
+    不存在时只使用内置词表。
+    """
+    global _segmenter
+    if _segmenter is not None:
+        return _segmenter
+    with _segmenter_lock:
+        if _segmenter is None:
+            _segmenter = _load_segmenter()
+        return _segmenter
+
+def _load_segmenter() -> Segmenter:
+    path = settings.SEGMENT_DICT
+    if path and os.path.exists(path):
+        try:
+            segmenter = Segmenter.from_file(path, builtin_freqs())
+            logger.info(f"Loaded segment dictionary {path}: {len(segmenter.freq)} entries")
+            return segmenter
+        except Exception as e:
+            logger.error(f"Failed to load segment dictionary {path}: {e}")
+    return Segmenter(builtin_freqs())
+
+def cut(text: str) -> Iterable[str]:
+    """切分任意文本中的中文部分"""
+    segmenter = get_segmenter()
+    for run in CJK_RE.findall(text):
+        yield from segmenter.cut(run)
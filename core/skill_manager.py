@@ -2,11 +2,15 @@ import importlib
 import inspect
 import os
 import logging
+import time
 from typing import Dict, List, Type
+from core.metrics import registry
 from core.skill import BaseSkill
 
 logger = logging.getLogger("artfish.skills")
 
+SKILL_DURATION = registry.histogram("omni_skill_duration_seconds", "技能工具执行耗时", ("skill", "tool", "status"))
+
 class SkillManager:
     """
     技能管理器：负责技能的发现、加载和生命周期管理。
@@ -70,4 +74,11 @@ class SkillManager:
         skill = self.get_skill(skill_name)
         if not skill:
             raise ValueError(f"Skill '{skill_name}' not found")
-        return skill.execute_tool(tool_name, **kwargs)
+        start_ns = time.perf_counter_ns()
+        status = "error"
+        try:
+            result = skill.execute_tool(tool_name, **kwargs)
+            status = "success"
+            return result
+        finally:
+            SKILL_DURATION.labels(skill_name, tool_name, status).observe_ns(time.perf_counter_ns() - start_ns)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Optional
+
+from core.config import settings
+from core.compression.abstractive import SummaryJob, SummaryTree, summary_prompt, SUMMARY_MAX_CHARS
+from core.token_tracker import token_tracker
+
+logger = logging.getLogger("omni.core.summarizer")
+
+class SummaryWorker:
+    """
+    后台分层摘要：在独立线程的事件循环中调用 LLMGateway (按价格顺序选择最便宜的已配置厂商)。
+    只使用已接入真实 API 的厂商；模拟回复一律丢弃，该段由关键词摘要兜底。
+    请求路径只投递任务、从不等待 LLM；在途任务数超过上限时直接丢弃新任务，该段由关键词摘要兜底。
+    """
+    def __init__(self, gateway: Any = None, max_concurrency: int = 2, max_pending: int = 64):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._gateway = gateway
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def gateway(self):
+        if self._gateway is None:
+            from core.llm_gateway import LLMGateway
+            self._gateway = LLMGateway()
+        return self._gateway
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def provider(self) -> Optional[str]:
+        """当前用于摘要的厂商；没有已配置且接入真实 API 的厂商时返回 None (摘要功能不生效)"""
+        from core.llm_gateway import REAL_PROVIDERS
+        order = [p.strip() for p in settings.SUMMARY_PROVIDERS.split(",") if p.strip() in REAL_PROVIDERS]
+        return self.gateway.cheapest_provider(order)
+
+    def submit(self, tree: SummaryTree, job: SummaryJob) -> bool:
+        """投递一个摘要任务，立即返回是否被接受"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                logger.warning("Summary queue full, dropping segment")
+                return False
+            self._pending += 1
+            loop = self._ensure_loop()
+        asyncio.run_coroutine_threadsafe(self._run(tree, job), loop)
+        return True
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待在途任务全部完成 (用于测试与退出前收尾)"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="omni-summarizer", daemon=True).start()
+            self._loop = loop
+        return self._loop
+
+    async def _run(self, tree: SummaryTree, job: SummaryJob):
+        level, index, text, raw_tokens = job
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            async with self._semaphore:
+                summary = await self._summarize(level, text)
+            if summary:
+                parent = tree.complete(level, index, summary, raw_tokens)
+                tree.release_children(level, index)
+                if parent is not None:
+                    self.submit(tree, parent)
+        except Exception as e:
+            logger.error(f"Background summary failed (level {level}): {e}")
+        finally:
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    async def _summarize(self, level: int, text: str) -> Optional[str]:
+        provider = self.provider()
+        if provider is None:
+            return None
+        res = await self.gateway.chat(provider, summary_prompt(level, text), "omni-summarizer", scene="summary")
+        if res.get("status") != "success":
+            logger.warning(f"Summary request failed: {res.get('error')}")
+            return None
+        if res.get("mock"):
+            logger.warning(f"Provider {res.get('provider', provider)} returned a mock reply, summary discarded")
+            return None
+        token_tracker.record_summary_call(res.get("provider", provider), res.get("input_tokens", 0),
+                                          res.get("output_tokens", 0))
+        # 模型偶尔超出字数要求，截断以保证摘要长度有界
+        return " ".join(res["text"].split())[:SUMMARY_MAX_CHARS * 2]
@@ -1,88 +1,838 @@
+import atexit
+import copy
 import json
+import logging
 import os
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Any
+import weakref
+from typing import Dict, Iterator, List, Any, Optional, Sequence, Tuple
 from threading import Lock
 
+from core.config import settings
+from core.metrics import MetricFamily, Sample, registry
+from core.usage import EventArchive, PriceCatalog, Rollups, parse_window
+from core.usage.prices import COST_UNIT
+
+logger = logging.getLogger("omni.core.token_tracker")
+
+# v2: total_*/providers/scenes 以真实 Token 计，字符数另存于 *_chars 字段
+STATS_VERSION = 2
+# 保留的最近记录条数
+HISTORY_SIZE = 50
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+# 共享事件日志至少保留的时长 (秒)：其他进程据此增量同步汇总
+EVENT_LOG_SECONDS = 86400
+# 按用户的费用统计超过上限后，新用户计入该键
+OTHER_USERS = "other"
+
+# 进程退出时需要写盘的追踪器：弱引用，不阻止不再使用的追踪器被回收
+_open_trackers: "weakref.WeakSet[TokenTracker]" = weakref.WeakSet()
+
+@atexit.register
+def _close_open_trackers():
+    for tracker in list(_open_trackers):
+        tracker.close()
+
+FLUSH_DURATION = registry.histogram("omni_token_stats_flush_duration_seconds", "Token 统计写盘耗时")
+
+# 全局价格表 (内置价格表，可由 PRICE_CATALOG_PATH 覆盖)
+price_catalog = PriceCatalog.load(settings.PRICE_CATALOG_PATH)
+
+class HistoryRing:
+    """定长环形缓冲：槽位预先分配，写入 O(1)，写满后覆盖最旧的记录"""
+    __slots__ = ("_slots", "_next", "_count")
+
+    def __init__(self, capacity: int = HISTORY_SIZE, entries: Optional[List[Dict[str, Any]]] = None):
+        self._slots: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._next = 0
+        self._count = 0
+        for entry in (entries or [])[-capacity:]:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, entry: Dict[str, Any]):
+        self._slots[self._next] = entry
+        self._next = (self._next + 1) % len(self._slots)
+        if self._count < len(self._slots):
+            self._count += 1
+
+    def latest(self, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按时间顺序返回最近 n 条 (默认全部)"""
+        n = self._count if n is None else min(n, self._count)
+        capacity = len(self._slots)
+        return [self._slots[(self._next - n + i) % capacity] for i in range(n)]
+
 class TokenTracker:
     """
     Token 消耗与节省追踪器：负责记录各 API 的使用数据并计算节省率。
+    记录只更新内存中的增量计数与定长环形缓冲 (微秒级)，由后台线程每隔 flush_interval 秒
+    或累计 flush_events 次变更后在锁内换出增量，锁外并入总量并写入临时文件再原子替换，调用方从不等待磁盘。
+    每次请求同时计入分钟/小时/天汇总 (rollups) 并追加到列式事件归档 (archive)：
+    汇总快照定期写盘，重启时从归档重放快照之后的事件。
+    JSON 文件只适合单进程使用；多个进程共用统计时使用 SQLiteTokenTracker。
+    费用按价格表 (prices) 计算：实际花费与压缩避免的花费以整数 COST_UNIT 累计到厂商、场景与用户。
     """
-    def __init__(self, storage_path: str = "token_stats.json"):
+    # 记录时直接计入汇总；SQLite 后端改为从共享事件日志同步
+    LIVE_ROLLUPS = True
+
+    def __init__(self, storage_path: str = "token_stats.json", flush_interval: Optional[float] = None,
+                 flush_events: Optional[int] = None, prices: Optional[PriceCatalog] = None):
         self.storage_path = storage_path
+        self.prices = price_catalog if prices is None else prices
+        self.flush_interval = settings.TOKEN_STATS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.flush_events = settings.TOKEN_STATS_FLUSH_EVENTS if flush_events is None else flush_events
         self.lock = Lock()
-        self.stats = self._load_stats()
+        self._write_lock = Lock()  # 串行化写盘，保证较新的快照不会被较旧的覆盖
+        loaded = self._load_stats()
+        self.history = HistoryRing(HISTORY_SIZE, loaded.pop("history", []))
+        # 已落盘的总量 (只在持有 self._write_lock 时读写) 与尚未落盘的增量 (持有 self.lock)
+        self._totals = loaded
+        self.stats = self._empty_stats()
+        # 已出现的费用用户 (总量与增量)，用于 COST_MAX_USERS 上限
+        self._cost_users = set(loaded.get("cost", {}).get("users", {}))
+        self.rollups_path = storage_path + ".rollups"
+        self.archive = EventArchive(os.path.splitext(storage_path)[0] + ".events", settings.TOKEN_ARCHIVE_DAYS,
+                                    settings.TOKEN_ARCHIVE_MAX_NAMES)
+        self.rollups, self._rollups_saved = self._load_rollups()
+        self._events: List[Tuple[float, str, str, int, int, int, int]] = []  # 尚未归档的事件
+        self._wake = threading.Event()
+        self._pending = 0  # 尚未落盘的变更数
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        _open_trackers.add(self)
 
-    def _load_stats(self) -> Dict[str, Any]:
-        if os.path.exists(self.storage_path):
-            try:
-                with open(self.storage_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                pass
+    def _empty_stats(self) -> Dict[str, Any]:
         return {
+            "version": STATS_VERSION,
             "total_original": 0,
             "total_optimized": 0,
             "total_saved": 0,
-            "providers": {}, # e.g., {"deepseek": {"original": 0, "optimized": 0}}
+            "total_original_chars": 0,
+            "total_optimized_chars": 0,
+            "total_saved_chars": 0,
+            "providers": {}, # e.g., {"deepseek": {"original": 0, "optimized": 0, "original_chars": 0, ...}}
             "scenes": {},    # e.g., {"telegram": 0, "agent": 0}
+            "scenes_chars": {},
+            "cache_hits": 0,   # 压缩结果缓存命中/未命中次数
+            "cache_misses": 0,
+            "prompt_tokens_reported": 0,  # 厂商回报的输入 Token 数及其中命中提示词缓存的部分
+            "prompt_cache_hit_tokens": 0,
+            "summary": self._empty_summary_stats(),  # 后台分层摘要的 LLM 成本与收益
+            "cost": self._empty_cost_stats(),  # 费用 (单位 COST_UNIT)
             "history": []    # 最近 50 条记录
         }
 
-    def _save_stats(self):
-        with open(self.storage_path, "w", encoding="utf-8") as f:
-            json.dump(self.stats, f, indent=2, ensure_ascii=False)
+    def _empty_summary_stats(self) -> Dict[str, int]:
+        return {
+            "calls": 0,
+            "input_tokens": 0,     # 生成摘要消耗的 LLM Token
+            "output_tokens": 0,
+            "covered_tokens": 0,   # 压缩结果中被摘要替代的原文 Token
+            "emitted_tokens": 0,   # 压缩结果中摘要本身的 Token
+        }
+
+    def _empty_cost_stats(self) -> Dict[str, Any]:
+        return {
+            "spent": 0,                # 按价格表计算的实际花费
+            "avoided": 0,              # 压缩减少的输入 Token 按输入价折算的花费
+            "prompt_cache_saved": 0,   # 提示词缓存命中按缓存价计费节省的花费
+            "deducted": 0,             # 其中从已按全价记账的花费中扣除的部分 (事后上报的 usage)
+            "summary_spent": 0,        # 其中后台摘要的花费
+            "providers": {},  # e.g., {"deepseek": {"spent": 0, "avoided": 0, "deducted": 0}}
+            "scenes": {},
+            "users": {},
+        }
+
+    def _load_stats(self) -> Dict[str, Any]:
+        return self._read_stats_file(self.storage_path)
+
+    def _read_stats_file(self, path: str) -> Dict[str, Any]:
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    stats = json.load(f)
+                if stats.get("version") != STATS_VERSION:
+                    stats = self._migrate_legacy(stats)
+                stats.setdefault("cache_hits", 0)
+                stats.setdefault("cache_misses", 0)
+                stats.setdefault("prompt_tokens_reported", 0)
+                stats.setdefault("prompt_cache_hit_tokens", 0)
+                stats.setdefault("summary", self._empty_summary_stats())
+                stats.setdefault("cost", self._empty_cost_stats())
+                return stats
+            except:
+                pass
+        return self._empty_stats()
+
+    def _load_rollups(self) -> Tuple[Rollups, float]:
+        """读取汇总快照，并从归档重放快照之后的事件"""
+        rollups, as_of = Rollups(), 0.0
+        if os.path.exists(self.rollups_path):
+            try:
+                with open(self.rollups_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                rollups, as_of = Rollups.from_dict(data["series"]), data["as_of"]
+            except Exception as e:
+                logger.error(f"Failed to load token rollups {self.rollups_path}: {e}")
+        start = max(as_of, time.time() - settings.TOKEN_ARCHIVE_DAYS * 86400)
+        try:
+            for event in self.archive.events(start, time.time() + 1):
+                if event[0] > as_of:
+                    rollups.add(*event)
+        except Exception as e:
+            logger.error(f"Failed to replay token usage archive: {e}")
+        return rollups, time.time()
+
+    def _migrate_legacy(self, legacy: Dict[str, Any]) -> Dict[str, Any]:
+        """旧版本以字符数记账：迁移到 *_chars 字段，Token 计数从零开始"""
+        stats = self._empty_stats()
+        for field in ("original", "optimized", "saved"):
+            stats[f"total_{field}_chars"] = legacy.get(f"total_{field}", 0)
+        for provider, data in legacy.get("providers", {}).items():
+            stats["providers"][provider] = {
+                "original": 0, "optimized": 0, "saved": 0,
+                "original_chars": data.get("original", 0),
+                "optimized_chars": data.get("optimized", 0),
+                "saved_chars": data.get("saved", 0),
+            }
+        stats["scenes_chars"] = dict(legacy.get("scenes", {}))
+        for entry in legacy.get("history", []):
+            stats["history"].append({
+                "timestamp": entry.get("timestamp"),
+                "provider": entry.get("provider"),
+                "scene": entry.get("scene"),
+                "original": None,
+                "optimized": None,
+                "saved": None,
+                "original_chars": entry.get("original", 0),
+                "optimized_chars": entry.get("optimized", 0),
+            })
+        return stats
+
+    def _changed(self):
+        """登记一次变更 (需持有 self.lock)：累计到 flush_events 次时唤醒后台线程立即写盘"""
+        self._pending += 1
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, args=(weakref.ref(self),),
+                                            name="omni-token-flusher", daemon=True)
+            self._thread.start()
+        if self._pending >= self.flush_events:
+            self._wake.set()
+
+    @staticmethod
+    def _run(ref: "weakref.ref[TokenTracker]"):
+        # 线程只持有弱引用，追踪器被回收后随之退出
+        while True:
+            tracker = ref()
+            if tracker is None or tracker._closed:
+                return
+            wake, interval = tracker._wake, tracker.flush_interval
+            del tracker
+            wake.wait(interval)
+            wake.clear()
+            tracker = ref()
+            if tracker is None:
+                return
+            tracker.flush()
+            del tracker
+
+    def flush(self) -> bool:
+        """
+        把尚未落盘的变更写入文件 (临时文件 + 原子替换)；没有变更时直接返回。
+        锁内只换出增量字典与事件列表，并入总量与序列化都在锁外进行。
+        """
+        with self._write_lock:
+            with self.lock:
+                if not self._pending:
+                    return True
+                pending, self._pending = self._pending, 0
+                delta, self.stats = self.stats, self._empty_stats()
+                history = self.history.latest()
+                events, self._events = self._events, []
+                rollups = None
+                now = time.time()
+                if events and now - self._rollups_saved >= settings.TOKEN_ROLLUP_SAVE_INTERVAL:
+                    # 快照包含截至最后一条已取出事件的全部汇总，之后的事件重启时从归档重放
+                    rollups = {"as_of": events[-1][0], "series": self.rollups.to_dict()}
+                    self._rollups_saved = now
+            for path, value in _flatten_counts(delta):
+                _add_counts(self._totals, path, value)
+            snapshot = dict(self._totals, history=history)
+            start_ns = time.perf_counter_ns()
+            try:
+                # 先归档事件再写汇总快照，崩溃时快照之后的事件一定能从归档重放
+                self.archive.append(events)
+                events = []
+                if rollups is not None:
+                    self._save_json(self.rollups_path, rollups, indent=None)
+                self._save_json(self.storage_path, snapshot)
+                FLUSH_DURATION.observe_ns(time.perf_counter_ns() - start_ns)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to save token stats: {e}")
+                with self.lock:
+                    self._pending += pending
+                    self._events[:0] = events
+                return False
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        _open_trackers.discard(self)
+
+    def _save_json(self, path: str, data: Dict[str, Any], indent: Optional[int] = 2):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+        os.replace(tmp, path)
 
-    def record(self, provider: str, scene: str, original: int, optimized: int):
-        """记录一次 Token 消耗"""
+    def record(self, provider: str, scene: str, original: int, optimized: int,
+               original_chars: Optional[int] = None, optimized_chars: Optional[int] = None,
+               model: Optional[str] = None, user: Optional[str] = None, output_tokens: int = 0,
+               cached_tokens: int = 0):
+        """
+        记录一次 Token 消耗 (original/optimized 为 Token 数，*_chars 为对应字符数)。
+        optimized 中有 output_tokens 个为输出 Token (按输出价计费)，cached_tokens 个为命中厂商提示词缓存的
+        输入 Token (按缓存价计费)，其余按输入价；model 用于查价格表，user 为按用户统计费用的键 (如命名空间)。
+        """
+        original_chars = original if original_chars is None else original_chars
+        optimized_chars = optimized if optimized_chars is None else optimized_chars
+        rates = self.prices.rates(provider, model)
+        spent = round((optimized - output_tokens - cached_tokens) * rates.input
+                      + cached_tokens * rates.cached_input + output_tokens * rates.output)
+        avoided = round((original - optimized) * rates.input)
         with self.lock:
+            now = time.time()  # 在锁内取时间，保证事件按时间顺序进入汇总与归档
             saved = original - optimized
-            
+            saved_chars = original_chars - optimized_chars
+
             # 更新总体数据
             self.stats["total_original"] += original
             self.stats["total_optimized"] += optimized
             self.stats["total_saved"] += saved
-            
+            self.stats["total_original_chars"] += original_chars
+            self.stats["total_optimized_chars"] += optimized_chars
+            self.stats["total_saved_chars"] += saved_chars
+
             # 更新厂商数据
             if provider not in self.stats["providers"]:
-                self.stats["providers"][provider] = {"original": 0, "optimized": 0, "saved": 0}
-            self.stats["providers"][provider]["original"] += original
-            self.stats["providers"][provider]["optimized"] += optimized
-            self.stats["providers"][provider]["saved"] += saved
-            
+                self.stats["providers"][provider] = {
+                    "original": 0, "optimized": 0, "saved": 0,
+                    "original_chars": 0, "optimized_chars": 0, "saved_chars": 0
+                }
+            p_stats = self.stats["providers"][provider]
+            p_stats["original"] += original
+            p_stats["optimized"] += optimized
+            p_stats["saved"] += saved
+            p_stats["original_chars"] += original_chars
+            p_stats["optimized_chars"] += optimized_chars
+            p_stats["saved_chars"] += saved_chars
+
             # 更新场景数据
             self.stats["scenes"][scene] = self.stats["scenes"].get(scene, 0) + optimized
-            
+            self.stats["scenes_chars"][scene] = self.stats["scenes_chars"].get(scene, 0) + optimized_chars
+            self._charge(provider, scene, user, spent, avoided)
+
             # 记录历史
             entry = {
-                "timestamp": time.time(),
+                "timestamp": now,
                 "provider": provider,
                 "scene": scene,
                 "original": original,
                 "optimized": optimized,
-                "saved": saved
+                "saved": saved,
+                "original_chars": original_chars,
+                "optimized_chars": optimized_chars
             }
-            self.stats["history"].append(entry)
-            if len(self.stats["history"]) > 50:
-                self.stats["history"].pop(0)
-            
-            self._save_stats()
+            self.history.append(entry)
+
+            # 时间窗口汇总与原始事件归档
+            event = (now, provider, scene, original, optimized, original_chars, optimized_chars)
+            if self.LIVE_ROLLUPS:
+                self.rollups.add(*event)
+            self._events.append(event)
+            self._changed()
+
+    def _charge(self, provider: str, scene: Optional[str], user: Optional[str], spent: int, avoided: int,
+                deducted: int = 0):
+        """把一次费用累计到总量与厂商/场景/用户 (需持有 self.lock)；各项均单调递增，净花费为 spent - deducted"""
+        cost = self.stats["cost"]
+        cost["spent"] += spent
+        cost["avoided"] += avoided
+        if deducted:
+            cost["deducted"] = cost.get("deducted", 0) + deducted
+        for group, key in (("providers", provider), ("scenes", scene), ("users", user)):
+            if key is None:
+                continue
+            if group == "users" and key not in self._cost_users:
+                if len(self._cost_users) >= settings.COST_MAX_USERS:
+                    key = OTHER_USERS
+                self._cost_users.add(key)
+            entries = cost[group]
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = {"spent": 0, "avoided": 0}
+            entry["spent"] += spent
+            entry["avoided"] += avoided
+            if deducted:
+                entry["deducted"] = entry.get("deducted", 0) + deducted
+
+    def record_cache_lookup(self, hit: bool):
+        """记录一次压缩缓存查询"""
+        with self.lock:
+            self.stats["cache_hits" if hit else "cache_misses"] += 1
+            self._changed()
+
+    def record_prompt_cache(self, provider: str, prompt_tokens: int, cached_tokens: int, model: Optional[str] = None,
+                            scene: Optional[str] = None, user: Optional[str] = None, deduct: bool = True):
+        """
+        记录厂商回报的提示词缓存命中 (输入 Token 中按缓存价计费的部分)。
+        deduct 为 True 时该次调用的输入此前已按全价记账 (如压缩结果转发后事后上报的 usage)，
+        把缓存节省从厂商与 scene/user 的花费中扣除；调用方已在 record 中传入 cached_tokens 时传 False。
+        """
+        rates = self.prices.rates(provider, model)
+        cache_saved = round(cached_tokens * (rates.input - rates.cached_input))
+        with self.lock:
+            self.stats["cost"]["prompt_cache_saved"] += cache_saved
+            if deduct and cache_saved:
+                self._charge(provider, scene, user, 0, 0, cache_saved)
+            self.stats["prompt_tokens_reported"] += prompt_tokens
+            self.stats["prompt_cache_hit_tokens"] += cached_tokens
+            p_stats = self.stats["providers"].setdefault(provider, {
+                "original": 0, "optimized": 0, "saved": 0,
+                "original_chars": 0, "optimized_chars": 0, "saved_chars": 0
+            })
+            p_stats["prompt_tokens_reported"] = p_stats.get("prompt_tokens_reported", 0) + prompt_tokens
+            p_stats["prompt_cache_hit_tokens"] = p_stats.get("prompt_cache_hit_tokens", 0) + cached_tokens
+            self._changed()
+
+    def record_summary_call(self, provider: str, input_tokens: int, output_tokens: int, model: Optional[str] = None):
+        """
+        记录一次后台摘要的 LLM 调用成本 (与压缩节省分开统计)。
+        该调用经 LLMGateway.chat 已计入 summary 场景的花费，这里只单独累计摘要花费用于看板。
+        """
+        rates = self.prices.rates(provider, model)
+        spent = round(input_tokens * rates.input + output_tokens * rates.output)
+        with self.lock:
+            self.stats["cost"]["summary_spent"] += spent
+            summary = self.stats["summary"]
+            summary["calls"] += 1
+            summary["input_tokens"] += input_tokens
+            summary["output_tokens"] += output_tokens
+            providers = summary.setdefault("providers", {})
+            providers[provider] = providers.get(provider, 0) + input_tokens + output_tokens
+            self._changed()
+
+    def record_summary_use(self, covered_tokens: int, emitted_tokens: int):
+        """记录一次压缩结果中摘要的使用"""
+        with self.lock:
+            self.stats["summary"]["covered_tokens"] += covered_tokens
+            self.stats["summary"]["emitted_tokens"] += emitted_tokens
+            self._changed()
+
+    def _current_stats(self, history: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """已落盘的总量加上尚未落盘的增量，以及最近 history 条记录；锁内只展开增量"""
+        with self._write_lock:
+            stats = copy.deepcopy(self._totals)
+            with self.lock:
+                delta = list(_flatten_counts(self.stats))
+                recent = self.history.latest(history)
+        for path, value in delta:
+            _add_counts(stats, path, value)
+        return stats, recent
 
     def get_summary(self) -> Dict[str, Any]:
         """获取摘要数据用于看板展示"""
+        stats, history = self._current_stats(5)
+        total = stats["total_original"]
+        saved = stats["total_saved"]
+        rate = (saved / total * 100) if total > 0 else 0
+        total_chars = stats["total_original_chars"]
+        saved_chars = stats["total_saved_chars"]
+        char_rate = (saved_chars / total_chars * 100) if total_chars > 0 else 0
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        hit_rate = (stats["cache_hits"] / lookups * 100) if lookups > 0 else 0
+        reported = stats["prompt_tokens_reported"]
+        prompt_cache_rate = (stats["prompt_cache_hit_tokens"] / reported * 100) if reported > 0 else 0
+        summary = stats["summary"]
+        summary_cost = summary["input_tokens"] + summary["output_tokens"]
+        cost = stats["cost"]
+        providers = stats["providers"]
+        for provider, entry in cost["providers"].items():
+            # 费用与 Token 数并列展示
+            data = providers.setdefault(provider, {
+                "original": 0, "optimized": 0, "saved": 0,
+                "original_chars": 0, "optimized_chars": 0, "saved_chars": 0
+            })
+            data["cost_spent"] = _money(_net_spent(entry))
+            data["cost_avoided"] = _money(entry.get("avoided", 0))
+
+        return {
+            "total_original": total,
+            "total_optimized": stats["total_optimized"],
+            "total_saved": saved,
+            "savings_rate": round(rate, 1),
+            "total_original_chars": total_chars,
+            "total_optimized_chars": stats["total_optimized_chars"],
+            "total_saved_chars": saved_chars,
+            "char_savings_rate": round(char_rate, 1),
+            "cache_hits": stats["cache_hits"],
+            "cache_misses": stats["cache_misses"],
+            "cache_hit_rate": round(hit_rate, 1),
+            "prompt_tokens_reported": reported,
+            "prompt_cache_hit_tokens": stats["prompt_cache_hit_tokens"],
+            "prompt_cache_hit_rate": round(prompt_cache_rate, 1),
+            "summary_calls": summary["calls"],
+            "summary_cost_tokens": summary_cost,
+            # 摘要替代原文节省的 Token 扣除生成成本，为正说明摘要已回本
+            "summary_net_saved": summary["covered_tokens"] - summary["emitted_tokens"] - summary_cost,
+            "providers": providers,
+            "currency": self.prices.currency,
+            "cost_spent": _money(_net_spent(cost)),
+            "cost_avoided": _money(cost["avoided"]),
+            "cost_prompt_cache_saved": _money(cost["prompt_cache_saved"]),
+            "cost_summary_spent": _money(cost["summary_spent"]),
+            "cost_scenes": {k: {"spent": _money(_net_spent(v)), "avoided": _money(v.get("avoided", 0))}
+                            for k, v in cost["scenes"].items()},
+            "cost_users": {k: {"spent": _money(_net_spent(v)), "avoided": _money(v.get("avoided", 0))}
+                           for k, v in cost["users"].items()},
+            "recent_history": history
+        }
+
+    def query(self, window: str, group_by: Optional[str] = None) -> Dict[str, Any]:
+        """
+        最近 window (如 15m / 1h / 24h / 7d) 内的用量，可按 provider、scene 或 provider,scene 分组；
+        每组含请求数、Token 总和与每次请求 Token 数的 p50/p90/p95/p99。参数无效时抛出 ValueError。
+        """
+        seconds = parse_window(window)
         with self.lock:
-            total = self.stats["total_original"]
-            saved = self.stats["total_saved"]
-            rate = (saved / total * 100) if total > 0 else 0
-            
-            return {
-                "total_original": total,
-                "total_optimized": self.stats["total_optimized"],
-                "total_saved": saved,
-                "savings_rate": round(rate, 1),
-                "providers": self.stats["providers"],
-                "recent_history": self.stats["history"][-5:]
-            }
+            return self.rollups.query(seconds, group_by or None, time.time())
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """/metrics 抓取时读取累计统计，记录路径不做额外计数"""
+        stats, _ = self._current_stats(0)
+        providers = {name: (data["original"], data["optimized"]) for name, data in stats["providers"].items()}
+        scenes = dict(stats["scenes"])
+        summary = stats["summary"]
+        cost = stats["cost"]["providers"]
+        return [
+            MetricFamily("omni_shrink_cache_lookups", "counter", "压缩结果缓存查询次数",
+                         [Sample("_total", {"result": "hit"}, stats["cache_hits"]),
+                          Sample("_total", {"result": "miss"}, stats["cache_misses"])]),
+            MetricFamily("omni_prompt_tokens_reported", "counter", "厂商回报的输入 Token 数",
+                         [Sample("_total", {}, stats["prompt_tokens_reported"])]),
+            MetricFamily("omni_prompt_cache_hit_tokens", "counter", "厂商回报的命中提示词缓存的输入 Token 数",
+                         [Sample("_total", {}, stats["prompt_cache_hit_tokens"])]),
+            MetricFamily("omni_summary_tokens", "counter", "后台摘要消耗的 LLM Token 数",
+                         [Sample("_total", {"direction": "input"}, summary["input_tokens"]),
+                          Sample("_total", {"direction": "output"}, summary["output_tokens"])]),
+            MetricFamily("omni_token_stats_pending", "gauge", "尚未落盘的 Token 统计变更数",
+                         [Sample("", {}, self._pending)]),
+            MetricFamily("omni_tokens_original", "counter", "压缩前的 Token 数",
+                         [Sample("_total", {"provider": p}, v[0]) for p, v in providers.items()]),
+            MetricFamily("omni_tokens_optimized", "counter", "压缩后的 Token 数",
+                         [Sample("_total", {"provider": p}, v[1]) for p, v in providers.items()]),
+            MetricFamily("omni_scene_tokens_optimized", "counter", "各场景压缩后的 Token 数",
+                         [Sample("_total", {"scene": k}, v) for k, v in scenes.items()]),
+            MetricFamily("omni_cost_spent", "counter", f"按价格表计算的花费 ({self.prices.currency})，未扣除事后上报的缓存命中",
+                         [Sample("_total", {"provider": p}, v.get("spent", 0) * COST_UNIT) for p, v in cost.items()]),
+            MetricFamily("omni_cost_deducted", "counter", f"事后上报的提示词缓存命中从花费中扣除的部分 ({self.prices.currency})",
+                         [Sample("_total", {"provider": p}, v.get("deducted", 0) * COST_UNIT) for p, v in cost.items()]),
+            MetricFamily("omni_cost_avoided", "counter", f"压缩避免的花费 ({self.prices.currency})",
+                         [Sample("_total", {"provider": p}, v.get("avoided", 0) * COST_UNIT) for p, v in cost.items()]),
+        ]
+
+def _net_spent(entry: Dict[str, int]) -> int:
+    """扣除事后上报的缓存节省后的净花费"""
+    return entry.get("spent", 0) - entry.get("deducted", 0)
+
+def _money(amount: int) -> float:
+    """COST_UNIT 整数换算为货币金额"""
+    return round(amount * COST_UNIT, 6)
+
+def _flatten_counts(stats: Dict[str, Any], prefix: Tuple[str, ...] = ()) -> Iterator[Tuple[Tuple[str, ...], int]]:
+    """把嵌套的计数字典展开为 (路径, 值)；只包含整数计数"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten_counts(value, prefix + (key,))
+        elif isinstance(value, int) and not isinstance(value, bool) and (prefix or key != "version"):
+            yield prefix + (key,), value
+
+def _add_counts(stats: Dict[str, Any], path: Sequence[str], value: int):
+    node = stats
+    for key in path[:-1]:
+        node = node.setdefault(key, {})
+    node[path[-1]] = node.get(path[-1], 0) + value
+
+class SQLiteTokenTracker(TokenTracker):
+    """
+    多进程共享的 Token 统计 (SQLite WAL)：每个进程照常只在内存中累加增量，
+    后台写盘时在一个事务内以 UPSERT (value = value + ?) 原子累加到共享计数表，并写入共享事件日志，
+    因此 sidecar、MCP、Telegram 与 Celery 进程记录到同一份总量而不会互相覆盖。
+    读取看板时合并数据库中的总量与本进程未落盘的增量；WAL 模式下读事务不阻塞其他进程写入。
+    时间窗口汇总从事件日志增量同步，包含所有进程的记录。
+    """
+    LIVE_ROLLUPS = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, provider TEXT NOT NULL, scene TEXT NOT NULL,
+            original INTEGER NOT NULL, optimized INTEGER NOT NULL,
+            original_chars INTEGER NOT NULL, optimized_chars INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rollups (id INTEGER PRIMARY KEY CHECK (id = 1), as_of INTEGER NOT NULL, data TEXT NOT NULL);
+    """
+
+    def __init__(self, storage_path: str = "token_stats.db", flush_interval: Optional[float] = None,
+                 flush_events: Optional[int] = None, prices: Optional[PriceCatalog] = None):
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last_event = 0  # 已计入汇总的最大事件 id
+        super().__init__(storage_path, flush_interval, flush_events, prices)
+
+    def _connect(self) -> sqlite3.Connection:
+        """打开连接 (关闭后再次使用时重新连接)；连接只在持有 self._write_lock 时使用"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.storage_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.storage_path, timeout=settings.TOKEN_STATS_BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _load_stats(self) -> Dict[str, Any]:
+        # self.stats 只保存本进程尚未落盘的增量，总量在数据库中
+        with self._write_lock:
+            self._import_legacy_json()
+        return self._empty_stats()
+
+    def _import_legacy_json(self):
+        """首次使用时导入同名的旧版 JSON 统计 (如 token_stats.db 对应 token_stats.json)"""
+        legacy_path = os.path.splitext(self.storage_path)[0] + ".json"
+        conn = self._connect()
+        if not os.path.exists(legacy_path) or conn.execute("SELECT 1 FROM counters LIMIT 1").fetchone():
+            return
+        legacy = self._read_stats_file(legacy_path)
+        events = [
+            (e["timestamp"], e["provider"], e["scene"], e["original"], e["optimized"],
+             e.get("original_chars", 0), e.get("optimized_chars", 0))
+            for e in legacy.get("history", []) if e.get("original") is not None
+        ]
+        self._write(list(_flatten_counts(legacy)), events)
+        logger.info(f"Imported legacy token stats {legacy_path} into {self.storage_path}")
+
+    def _write(self, counts: List[Tuple[Tuple[str, ...], int]], events: Sequence[Tuple]):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                [(json.dumps(path, ensure_ascii=False), value) for path, value in counts if value]
+            )
+            conn.executemany(
+                "INSERT INTO events (ts, provider, scene, original, optimized, original_chars, optimized_chars) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", events
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _load_rollups(self) -> Tuple[Rollups, float]:
+        with self._write_lock:
+            rollups = self._read_rollups()
+        return rollups, time.time()
+
+    def _read_rollups(self) -> Rollups:
+        """读取汇总快照，并从共享事件日志补齐快照之后的事件 (需持有 self._write_lock)"""
+        rollups, self._last_event = Rollups(), 0
+        row = self._connect().execute("SELECT as_of, data FROM rollups WHERE id = 1").fetchone()
+        if row:
+            try:
+                rollups, self._last_event = Rollups.from_dict(json.loads(row[1])), row[0]
+            except Exception as e:
+                logger.error(f"Failed to load token rollups from {self.storage_path}: {e}")
+        for row in self._new_events():
+            rollups.add(*row[1:])
+            self._last_event = row[0]
+        return rollups
+
+    def _new_events(self) -> List[Tuple]:
+        return self._connect().execute(
+            "SELECT id, ts, provider, scene, original, optimized, original_chars, optimized_chars "
+            "FROM events WHERE id > ? ORDER BY id", (self._last_event,)
+        ).fetchall()
+
+    def _sync_rollups(self):
+        """把所有进程新写入的事件计入汇总 (需持有 self._write_lock)"""
+        first = self._connect().execute("SELECT MIN(id) FROM events").fetchone()[0]
+        if self._last_event and first is not None and first > self._last_event + 1:
+            # 长时间未同步，所需事件已被其他进程清理：从最新快照重建
+            rollups = self._read_rollups()
+            with self.lock:
+                self.rollups = rollups
+            return
+        rows = self._new_events()
+        if not rows:
+            return
+        with self.lock:
+            for row in rows:
+                self.rollups.add(*row[1:])
+        self._last_event = rows[-1][0]
+
+    def flush(self) -> bool:
+        """把本进程的增量原子累加到共享计数表，并写入事件日志与列式归档"""
+        with self._write_lock:
+            with self.lock:
+                if not self._pending:
+                    return True
+                pending, self._pending = self._pending, 0
+                delta, self.stats = self.stats, self._empty_stats()
+                events, self._events = self._events, []
+            start_ns = time.perf_counter_ns()
+            try:
+                self._write(list(_flatten_counts(delta)), events)
+            except Exception as e:
+                logger.error(f"Failed to save token stats: {e}")
+                with self.lock:
+                    for path, value in _flatten_counts(delta):
+                        _add_counts(self.stats, path, value)
+                    self._events[:0] = events
+                    self._pending += pending
+                return False
+            try:
+                self.archive.append(events)
+            except Exception as e:
+                logger.error(f"Failed to archive token usage events: {e}")
+            try:
+                self._sync_rollups()
+                self._save_rollups()
+            except Exception as e:
+                logger.error(f"Failed to sync token rollups: {e}")
+            FLUSH_DURATION.observe_ns(time.perf_counter_ns() - start_ns)
+            return True
+
+    def _save_rollups(self):
+        """定期保存汇总快照 (较新的快照不会被其他进程较旧的覆盖)，并清理快照已覆盖的旧事件"""
+        now = time.time()
+        if now - self._rollups_saved < settings.TOKEN_ROLLUP_SAVE_INTERVAL:
+            return
+        self._rollups_saved = now
+        with self.lock:
+            data = json.dumps(self.rollups.to_dict(), ensure_ascii=False)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO rollups (id, as_of, data) VALUES (1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET as_of = excluded.as_of, data = excluded.data "
+                "WHERE excluded.as_of > rollups.as_of", (self._last_event, data)
+            )
+            # 保留最近的记录 (看板历史) 与 EVENT_LOG_SECONDS 内的事件，供其他进程增量同步
+            conn.execute("DELETE FROM events WHERE id <= ? AND id <= (SELECT MAX(id) FROM events) - ? AND ts < ?",
+                         (self._last_event, HISTORY_SIZE, now - EVENT_LOG_SECONDS))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _current_stats(self, history: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """数据库中的总量加上本进程未落盘的增量；最近记录来自共享事件日志"""
+        with self._write_lock:
+            conn = self._connect()
+            stats = self._empty_stats()
+            for key, value in conn.execute("SELECT key, value FROM counters"):
+                _add_counts(stats, json.loads(key), value)
+            rows = conn.execute(
+                "SELECT ts, provider, scene, original, optimized, original_chars, optimized_chars "
+                "FROM events ORDER BY id DESC LIMIT ?", (history,)
+            ).fetchall()
+            with self.lock:
+                for path, value in _flatten_counts(self.stats):
+                    _add_counts(stats, path, value)
+                local = self.history.latest(min(history, len(self._events)))
+        recent = [self._history_entry(*row) for row in reversed(rows)] + local
+        return stats, recent[max(len(recent) - history, 0):]
+
+    @staticmethod
+    def _history_entry(ts: float, provider: str, scene: str, original: int, optimized: int,
+                       original_chars: int, optimized_chars: int) -> Dict[str, Any]:
+        return {
+            "timestamp": ts,
+            "provider": provider,
+            "scene": scene,
+            "original": original,
+            "optimized": optimized,
+            "saved": original - optimized,
+            "original_chars": original_chars,
+            "optimized_chars": optimized_chars
+        }
+
+    def query(self, window: str, group_by: Optional[str] = None) -> Dict[str, Any]:
+        # 先落盘本进程的记录，再同步其他进程的事件
+        self.flush()
+        with self._write_lock:
+            self._sync_rollups()
+        return super().query(window, group_by)
+
+    def close(self):
+        super().close()
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def open_token_tracker(storage_path: str) -> TokenTracker:
+    """按文件后缀选择存储后端：.db/.sqlite 为 SQLite (多进程共享)，其余为 JSON 快照 (单进程)"""
+    if storage_path.lower().endswith(SQLITE_SUFFIXES):
+        return SQLiteTokenTracker(storage_path)
+    return TokenTracker(storage_path)
+
+def prompt_cache_usage(usage: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """
+    从厂商返回的 usage 中解析 (输入 Token 总数, 命中缓存的 Token 数)；没有缓存信息时返回 None。
+    兼容 DeepSeek (prompt_cache_hit_tokens)、OpenAI 兼容接口 (prompt_tokens_details.cached_tokens)
+    与 Anthropic (cache_read_input_tokens，其 input_tokens 不含缓存部分)。
+    """
+    if not usage:
+        return None
+    if "prompt_cache_hit_tokens" in usage:
+        cached = usage["prompt_cache_hit_tokens"] or 0
+        total = usage.get("prompt_tokens", cached + (usage.get("prompt_cache_miss_tokens") or 0))
+        return total, cached
+    details = usage.get("prompt_tokens_details") or {}
+    if "cached_tokens" in details:
+        return usage.get("prompt_tokens", 0), details["cached_tokens"] or 0
+    if "cache_read_input_tokens" in usage or "cache_creation_input_tokens" in usage:
+        cached = usage.get("cache_read_input_tokens") or 0
+        total = (usage.get("input_tokens") or 0) + cached + (usage.get("cache_creation_input_tokens") or 0)
+        return total, cached
+    return None
+
+class _LazyTokenTracker:
+    """全局单例的延迟代理：首次使用时才按 settings.TOKEN_STATS_PATH 打开存储，导入模块不会创建文件"""
+    def __init__(self):
+        self._tracker: Optional[TokenTracker] = None
+        self._lock = Lock()
+
+    def _get(self) -> TokenTracker:
+        if self._tracker is None:
+            with self._lock:
+                if self._tracker is None:
+                    self._tracker = open_token_tracker(settings.TOKEN_STATS_PATH)
+        return self._tracker
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get(), name)
 
 # 全局单例
-token_tracker = TokenTracker()
+token_tracker = _LazyTokenTracker()
+registry.register_collector(lambda: token_tracker.collect_metrics())
@@ -0,0 +1,155 @@
+import base64
+import logging
+import math
+import os
+import re
+from threading import Lock
+from typing import Dict, List, Optional
+
+from core.config import settings
+
+logger = logging.getLogger("omni.core.tokenizer")
+
+# 厂商 -> 分词器家族。同一家族共享词表与估算参数
+PROVIDER_FAMILIES = {
+    "openai": "cl100k",
+    "groq": "cl100k",
+    "gemini": "cl100k",
+    "claude": "claude",
+    "deepseek": "deepseek",
+    "qwen": "qwen",
+    "hunyuan": "qwen",
+    "zhipu": "qwen",
+    "wenxin": "qwen",
+}
+DEFAULT_FAMILY = "cl100k"
+
+# 无词表时的离线估算参数: (每个中日韩字符的 Token 数, 其他字符每 Token 的字符数)
+HEURISTIC_PARAMS = {
+    "cl100k": (1.2, 4.0),
+    "claude": (1.3, 3.5),
+    "deepseek": (0.6, 3.3),   # 官方口径：1 个中文字符 ≈ 0.6 Token，1 个英文字符 ≈ 0.3 Token
+    "qwen": (0.7, 3.8),
+}
+
+CJK_RUN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]+')
+# 预分词规则 (近似 tiktoken cl100k 的切分方式，兼容标准库 re)
+PRETOKEN_RE = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+""")
+
+class TokenCounter:
+    """Token 计数器基类"""
+    family: str = DEFAULT_FAMILY
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+class HeuristicCounter(TokenCounter):
+    """离线估算器：按中日韩字符与其他字符分别折算，无需词表"""
+    def __init__(self, family: str):
+        self.family = family
+        self.cjk_ratio, self.chars_per_token = HEURISTIC_PARAMS.get(family, HEURISTIC_PARAMS[DEFAULT_FAMILY])
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk = sum(len(run) for run in CJK_RUN_RE.findall(text))
+        return math.ceil(cjk * self.cjk_ratio + (len(text) - cjk) / self.chars_per_token)
+
+class BPETokenizer(TokenCounter):
+    """
+    字节级 BPE 分词器，读取 tiktoken 格式的词表文件 (每行: base64 编码的 token 与 rank)。
+    预分词后的片段编码结果会被缓存，重复出现的词只需一次字典查找。
+    """
+    CACHE_SIZE = 65536
+
+    def __init__(self, family: str, ranks: Dict[bytes, int]):
+        self.family = family
+        self.ranks = ranks
+        self._cache: Dict[str, List[int]] = {}
+
+    @classmethod
+    def from_file(cls, family: str, path: str) -> "BPETokenizer":
+        ranks: Dict[bytes, int] = {}
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                token, rank = line.split()
+                ranks[base64.b64decode(token)] = int(rank)
+        return cls(family, ranks)
+
+    def encode(self, text: str) -> List[int]:
+        ids: List[int] = []
+        for piece in PRETOKEN_RE.findall(text):
+            ids.extend(self._encode_piece(piece))
+        return ids
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return sum(len(self._encode_piece(piece)) for piece in PRETOKEN_RE.findall(text))
+
+    def _encode_piece(self, piece: str) -> List[int]:
+        cached = self._cache.get(piece)
+        if cached is not None:
+            return cached
+        ids = self._bpe(piece.encode("utf-8"))
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[piece] = ids
+        return ids
+
+    def _bpe(self, data: bytes) -> List[int]:
+        rank = self.ranks.get(data)
+        if rank is not None:
+            return [rank]
+        parts = [data[i:i + 1] for i in range(len(data))]
+        while len(parts) > 1:
+            best_rank, best_idx = None, -1
+            for i in range(len(parts) - 1):
+                r = self.ranks.get(parts[i] + parts[i + 1])
+                if r is not None and (best_rank is None or r < best_rank):
+                    best_rank, best_idx = r, i
+            if best_rank is None:
+                break
+            parts[best_idx:best_idx + 2] = [parts[best_idx] + parts[best_idx + 1]]
+        # 词表未覆盖的单字节按 1 个 Token 计
+        return [self.ranks.get(p, -1) for p in parts]
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = Lock()
+
+def register_counter(family: str, counter: TokenCounter):
+    """注册 (或替换) 某个家族的计数器，便于接入自定义分词器"""
+    with _counters_lock:
+        _counters[family] = counter
+
+def get_counter(provider: str) -> TokenCounter:
+    """
+    获取厂商对应的计数器：优先加载 TOKENIZER_DIR 下的 `<family>.tiktoken` 词表，
+    不存在时退化为离线估算器。结果按家族缓存，进程内共享。
+    """
+    family = PROVIDER_FAMILIES.get(provider, DEFAULT_FAMILY)
+    counter = _counters.get(family)
+    if counter is not None:
+        return counter
+    with _counters_lock:
+        counter = _counters.get(family)
+        if counter is None:
+            counter = _load_counter(family)
+            _counters[family] = counter
+        return counter
+
+def _load_counter(family: str) -> TokenCounter:
+    path = os.path.join(settings.TOKENIZER_DIR, f"{family}.tiktoken")
+    if os.path.exists(path):
+        try:
+            counter = BPETokenizer.from_file(family, path)
+            logger.info(f"Loaded BPE vocab for {family}: {len(counter.ranks)} tokens")
+            return counter
+        except Exception as e:
+            logger.error(f"Failed to load BPE vocab {path}: {e}")
+    return HeuristicCounter(family)
+
+def count_tokens(text: str, provider: str = "deepseek") -> int:
+    return get_counter(provider).count(text)
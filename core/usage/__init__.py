@@ -0,0 +1,6 @@
+from .archive import EventArchive
+from .prices import PriceCatalog, Rates
+from .rollup import Bucket, Rollups, parse_window
+from .sketch import DDSketch
+
+__all__ = ["DDSketch", "Bucket", "Rollups", "EventArchive", "PriceCatalog", "Rates", "parse_window"]
@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：不做跨进程加锁
+    fcntl = None
+
+import numpy as np
+
+logger = logging.getLogger("omni.core.usage.archive")
+
+# 每列一个定长类型的二进制文件；厂商与场景名字典编码为整数
+COLUMNS = (
+    ("ts", "<f8"),
+    ("provider", "<u2"),
+    ("scene", "<u2"),
+    ("original", "<i8"),
+    ("optimized", "<i8"),
+    ("original_chars", "<i8"),
+    ("optimized_chars", "<i8"),
+)
+SUM_COLUMNS = ("original", "optimized", "original_chars", "optimized_chars")
+DAY_SECONDS = 86400
+# 名字编号为 u2：每类名字最多 65536 个；达到上限后新名字计入 OTHER_NAME
+MAX_NAMES = 1 << 16
+OTHER_NAME = "other"
+
+# (时间戳, 厂商, 场景, original, optimized, original_chars, optimized_chars)
+Event = Tuple[float, str, str, int, int, int, int]
+
+class EventArchive:
+    """
+    原始用量事件的列式归档：按 UTC 日期分段，每段每列一个追加写的二进制文件 (如 20261017.original.i8)。
+    读取时 np.fromfile 直接得到列数组，任意时间范围的聚合由 NumPy 向量化完成。
+    崩溃可能使各列长度不一致，读取时按最短列对齐，追加前截掉多出的部分。
+    多个进程共用同一目录时，追加 (含名字字典的更新) 在文件锁内进行。
+    厂商与场景名各自最多登记 max_names 个 (不超过编号宽度允许的 MAX_NAMES)，之后的新名字计入 other。
+    """
+    def __init__(self, directory: str, retention_days: int = 90, max_names: int = MAX_NAMES):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.max_names = max(1, min(max_names, MAX_NAMES))
+        self._names_path = os.path.join(directory, "names.json")
+        self.providers: List[str] = []
+        self.scenes: List[str] = []
+        self._ids: Dict[str, Dict[str, int]] = {"provider": {}, "scene": {}}
+        self._expired_day: Optional[int] = None
+        self._load_names()
+
+    def _load_names(self):
+        if not os.path.exists(self._names_path):
+            return
+        try:
+            with open(self._names_path, "r", encoding="utf-8") as f:
+                names = json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load usage archive names {self._names_path}: {e}")
+            return
+        self.providers, self.scenes = names.get("providers", []), names.get("scenes", [])
+        self._ids["provider"] = {name: i for i, name in enumerate(self.providers)}
+        self._ids["scene"] = {name: i for i, name in enumerate(self.scenes)}
+
+    def _save_names(self):
+        tmp = self._names_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"providers": self.providers, "scenes": self.scenes}, f, ensure_ascii=False)
+        os.replace(tmp, self._names_path)
+
+    def _encode(self, kind: str, name: str) -> Tuple[int, bool]:
+        ids = self._ids[kind]
+        if name in ids:
+            return ids[name], False
+        names = self.providers if kind == "provider" else self.scenes
+        if len(names) >= self.max_names - 1 and name != OTHER_NAME:
+            # 保留最后一个编号给 other
+            name = OTHER_NAME
+            if name in ids:
+                return ids[name], False
+        ids[name] = len(names)
+        names.append(name)
+        return ids[name], True
+
+    def _path(self, day: int, column: str, dtype: str) -> str:
+        stamp = time.strftime("%Y%m%d", time.gmtime(day * DAY_SECONDS))
+        return os.path.join(self.directory, f"{stamp}.{column}.{dtype[1:]}")
+
+    def _rows(self, day: int) -> int:
+        rows = []
+        for column, dtype in COLUMNS:
+            path = self._path(day, column, dtype)
+            rows.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        return min(rows)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, ".lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def append(self, events: Sequence[Event]):
+        """把一批事件按日期追加到对应的列文件"""
+        if not events:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._file_lock():
+            # 其他进程可能已登记了新名字，编码前重新读取字典
+            self._load_names()
+            encoded, new_names = [], False
+            for ts, provider, scene, *values in events:
+                provider_id, new_provider = self._encode("provider", provider)
+                scene_id, new_scene = self._encode("scene", scene)
+                new_names = new_names or new_provider or new_scene
+                encoded.append((ts, provider_id, scene_id, *values))
+            if new_names:
+                # 先写名字字典，保证列文件中的编号总能被解析
+                self._save_names()
+            table = np.array(encoded, dtype=list(COLUMNS))
+            days = (table["ts"] // DAY_SECONDS).astype(np.int64)
+            for day in np.unique(days):
+                self._append_day(int(day), table[days == day])
+
+    def _append_day(self, day: int, rows: np.ndarray):
+        self._truncate_torn(day)
+        if self._expired_day != day:
+            self._expired_day = day
+            self._expire(day)
+        for column, dtype in COLUMNS:
+            with open(self._path(day, column, dtype), "ab") as f:
+                f.write(np.ascontiguousarray(rows[column]).tobytes())
+
+    def _truncate_torn(self, day: int):
+        rows = self._rows(day)
+        for column, dtype in COLUMNS:
+            path = self._path(day, column, dtype)
+            if os.path.exists(path) and os.path.getsize(path) > rows * np.dtype(dtype).itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+
+    def _expire(self, today: int):
+        """删除超出保留天数的分段"""
+        cutoff = time.strftime("%Y%m%d", time.gmtime((today - self.retention_days) * DAY_SECONDS))
+        for name in os.listdir(self.directory):
+            stamp = name.split(".", 1)[0]
+            if stamp.isdigit() and len(stamp) == 8 and stamp < cutoff:
+                os.remove(os.path.join(self.directory, name))
+
+    def load(self, start: float, end: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """读取 [start, end) 内的事件，返回 列名 -> 数组"""
+        end = time.time() if end is None else end
+        self._load_names()
+        parts: Dict[str, List[np.ndarray]] = {column: [] for column, _ in COLUMNS}
+        for day in range(int(start // DAY_SECONDS), int(end // DAY_SECONDS) + 1):
+            rows = self._rows(day)
+            if not rows:
+                continue
+            columns = {column: np.fromfile(self._path(day, column, dtype), dtype=dtype, count=rows)
+                       for column, dtype in COLUMNS}
+            mask = (columns["ts"] >= start) & (columns["ts"] < end)
+            for column, values in columns.items():
+                parts[column].append(values[mask])
+        return {column: np.concatenate(values) if values else np.empty(0, dtype=dtype)
+                for (column, dtype), values in zip(COLUMNS, parts.values())}
+
+    def events(self, start: float, end: Optional[float] = None) -> List[Event]:
+        """以事件元组形式读取 [start, end) 内的事件 (用于重建汇总)"""
+        columns = self.load(start, end)
+        providers, scenes = self.providers, self.scenes
+        return [
+            (float(ts), providers[p], scenes[s], int(o), int(q), int(oc), int(qc))
+            for ts, p, s, o, q, oc, qc in zip(*(columns[column].tolist() for column, _ in COLUMNS))
+        ]
+
+    def aggregate(self, start: float, end: Optional[float] = None,
+                  group_by: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """按厂商和/或场景聚合 [start, end) 内的事件：请求数与各列总和 (NumPy 分组求和)"""
+        columns = self.load(start, end)
+        if group_by is None:
+            keys = np.zeros(len(columns["ts"]), dtype=np.int64)
+            labels = lambda key: "all"
+        elif group_by == "provider":
+            keys = columns["provider"].astype(np.int64)
+            labels = lambda key: self.providers[key]
+        elif group_by == "scene":
+            keys = columns["scene"].astype(np.int64)
+            labels = lambda key: self.scenes[key]
+        elif group_by == "provider,scene":
+            width = max(len(self.scenes), 1)
+            keys = columns["provider"].astype(np.int64) * width + columns["scene"]
+            labels = lambda key: f"{self.providers[key // width]}/{self.scenes[key % width]}"
+        else:
+            raise ValueError("group_by 只支持: provider, scene, provider,scene")
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(uniq))
+        sums = {column: np.bincount(inverse, weights=columns[column], minlength=len(uniq)) for column in SUM_COLUMNS}
+        return {
+            labels(int(key)): dict({"requests": int(counts[i])},
+                                   **{column: int(sums[column][i]) for column in SUM_COLUMNS})
+            for i, key in enumerate(uniq)
+        }
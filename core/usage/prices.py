@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("omni.core.usage.prices")
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prices.json")
+# 费用以整数的十亿分之一货币单位 (如纳美元) 累计：多进程原子累加时没有浮点误差
+COST_UNIT = 1e-9
+DEFAULT_MODEL = "*"
+# 解析结果缓存的 (厂商, 模型) 组合上限，模型名来自调用方
+MAX_RESOLVED = 1024
+
+class Rates(NamedTuple):
+    """每个 Token 的价格 (单位 COST_UNIT)"""
+    input: float
+    output: float
+    cached_input: float
+
+ZERO_RATES = Rates(0.0, 0.0, 0.0)
+
+def _rates(entry: Dict[str, float]) -> Rates:
+    # 配置中为每百万 Token 的价格
+    scale = round(1e-6 / COST_UNIT)
+    input_price = float(entry.get("input", 0.0))
+    return Rates(input_price * scale, float(entry.get("output", 0.0)) * scale,
+                 float(entry.get("cached_input", input_price)) * scale)
+
+class PriceCatalog:
+    """
+    按厂商与模型的价格表 (每百万 Token 的输入、输出与缓存命中输入价格)。
+    未列出的模型使用厂商的 "*" 默认价格，未列出的厂商费用记为 0。
+    rates 的结果按 (厂商, 模型) 缓存，记账时只有一次字典查找。
+    """
+    def __init__(self, providers: Dict[str, Dict[str, Dict[str, float]]], currency: str = "USD"):
+        self.currency = currency
+        self.providers = {
+            provider: {model: _rates(entry) for model, entry in models.items()}
+            for provider, models in providers.items()
+        }
+        self._resolved: Dict[Tuple[str, Optional[str]], Rates] = {}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "PriceCatalog":
+        """读取内置价格表，再以 path 指定的文件按模型覆盖"""
+        data = cls._read(DEFAULT_CATALOG)
+        providers = data.get("providers", {})
+        currency = data.get("currency", "USD")
+        if path:
+            override = cls._read(path)
+            currency = override.get("currency", currency)
+            for provider, models in override.get("providers", {}).items():
+                providers.setdefault(provider, {}).update(models)
+        return cls(providers, currency)
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, Any]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load price catalog {path}: {e}")
+            return {}
+
+    def rates(self, provider: str, model: Optional[str] = None) -> Rates:
+        key = (provider, model)
+        rates = self._resolved.get(key)
+        if rates is None:
+            models = self.providers.get(provider, {})
+            rates = models.get(model) or models.get(DEFAULT_MODEL) or ZERO_RATES
+            if len(self._resolved) < MAX_RESOLVED:
+                self._resolved[key] = rates
+        return rates
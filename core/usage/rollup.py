@@ -0,0 +1,163 @@
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.usage.sketch import DDSketch, sketch_key
+
+# 时间粒度: (名称, 桶宽秒数, 保留桶数)；桶按 UTC 对齐
+RESOLUTIONS = (
+    ("minute", 60, 24 * 60),
+    ("hour", 3600, 14 * 24),
+    ("day", 86400, 400),
+)
+# 查询时选择桶数不超过该值的最细粒度，查询代价与事件数无关
+MAX_QUERY_BUCKETS = 180
+GROUP_BY = (None, "provider", "scene", "provider,scene")
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99))
+
+_WINDOW_RE = re.compile(r'^(\d+)\s*([smhd])$')
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_window(window: str) -> int:
+    """把 15m / 1h / 24h / 7d 形式的时间窗口解析为秒数，格式错误时抛出 ValueError"""
+    match = _WINDOW_RE.match(window.strip().lower())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"无效的时间窗口: {window} (示例: 15m, 1h, 24h, 7d)")
+    return int(match.group(1)) * _WINDOW_UNITS[match.group(2)]
+
+class Bucket:
+    """一个时间桶内某个 (厂商, 场景) 的请求数、Token/字符总和，以及每次请求 Token 数的分位数草图"""
+    __slots__ = ("count", "original", "optimized", "original_chars", "optimized_chars",
+                 "original_sketch", "optimized_sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.original = 0
+        self.optimized = 0
+        self.original_chars = 0
+        self.optimized_chars = 0
+        self.original_sketch = DDSketch()
+        self.optimized_sketch = DDSketch()
+
+    def add(self, original: int, optimized: int, original_chars: int, optimized_chars: int,
+            original_key: Optional[int], optimized_key: Optional[int]):
+        self.count += 1
+        self.original += original
+        self.optimized += optimized
+        self.original_chars += original_chars
+        self.optimized_chars += optimized_chars
+        self.original_sketch.add_key(original_key)
+        self.optimized_sketch.add_key(optimized_key)
+
+    def merge(self, other: "Bucket"):
+        self.count += other.count
+        self.original += other.original
+        self.optimized += other.optimized
+        self.original_chars += other.original_chars
+        self.optimized_chars += other.optimized_chars
+        self.original_sketch.merge(other.original_sketch)
+        self.optimized_sketch.merge(other.optimized_sketch)
+
+    def summary(self) -> Dict[str, Any]:
+        saved = self.original - self.optimized
+        return {
+            "requests": self.count,
+            "original": self.original,
+            "optimized": self.optimized,
+            "saved": saved,
+            "savings_rate": round(saved / self.original * 100, 1) if self.original > 0 else 0,
+            "original_chars": self.original_chars,
+            "optimized_chars": self.optimized_chars,
+            # 每次请求的 Token 数分位数 (相对误差 1%)
+            "optimized_quantiles": {name: round(self.optimized_sketch.quantile(q)) for name, q in QUANTILES},
+            "original_quantiles": {name: round(self.original_sketch.quantile(q)) for name, q in QUANTILES},
+        }
+
+    def to_list(self) -> List[Any]:
+        return [self.count, self.original, self.optimized, self.original_chars, self.optimized_chars,
+                self.original_sketch.to_list(), self.optimized_sketch.to_list()]
+
+    @classmethod
+    def from_list(cls, data: List[Any]) -> "Bucket":
+        bucket = cls()
+        bucket.count, bucket.original, bucket.optimized, bucket.original_chars, bucket.optimized_chars = data[:5]
+        bucket.original_sketch = DDSketch.from_list(data[5])
+        bucket.optimized_sketch = DDSketch.from_list(data[6])
+        return bucket
+
+class Rollups:
+    """
+    按分钟、小时、天三种粒度滚动汇总用量：每个粒度为 桶起始时间 -> {(厂商, 场景): Bucket}，
+    超出保留期的桶在新桶创建时淘汰。查询合并窗口内的桶，代价只与桶数有关。
+    """
+    def __init__(self):
+        self.series: Dict[str, Dict[int, Dict[Tuple[str, str], Bucket]]] = {name: {} for name, _, _ in RESOLUTIONS}
+
+    def add(self, ts: float, provider: str, scene: str, original: int, optimized: int,
+            original_chars: int, optimized_chars: int):
+        original_key, optimized_key = sketch_key(original), sketch_key(optimized)
+        group = (provider, scene)
+        for name, step, keep in RESOLUTIONS:
+            series = self.series[name]
+            start = int(ts // step) * step
+            buckets = series.get(start)
+            if buckets is None:
+                buckets = series[start] = {}
+                self._prune(series, start - keep * step)
+            bucket = buckets.get(group)
+            if bucket is None:
+                bucket = buckets[group] = Bucket()
+            bucket.add(original, optimized, original_chars, optimized_chars, original_key, optimized_key)
+
+    @staticmethod
+    def _prune(series: Dict[int, Any], cutoff: int):
+        # 桶按创建顺序 (即时间顺序) 排列，从最早的开始淘汰
+        while series:
+            oldest = next(iter(series))
+            if oldest > cutoff:
+                break
+            del series[oldest]
+
+    def query(self, window: int, group_by: Optional[str], now: float) -> Dict[str, Any]:
+        """汇总最近 window 秒 (含当前未结束的桶) 的用量，按 group_by 分组"""
+        if group_by not in GROUP_BY:
+            raise ValueError("group_by 只支持: provider, scene, provider,scene")
+        for name, step, keep in RESOLUTIONS:
+            if window <= step * MAX_QUERY_BUCKETS or name == RESOLUTIONS[-1][0]:
+                break
+        count = min(math.ceil(window / step), keep)
+        last = int(now // step) * step
+        first = last - (count - 1) * step
+        series = self.series[name]
+        groups: Dict[str, Bucket] = {}
+        for start in range(first, last + step, step):
+            for (provider, scene), bucket in series.get(start, {}).items():
+                label = {None: "all", "provider": provider, "scene": scene,
+                         "provider,scene": f"{provider}/{scene}"}[group_by]
+                total = groups.get(label)
+                if total is None:
+                    total = groups[label] = Bucket()
+                total.merge(bucket)
+        return {
+            "window_seconds": window,
+            "resolution": name,
+            "from": first,
+            "to": last + step,
+            "group_by": group_by,
+            "groups": {label: bucket.summary() for label, bucket in sorted(groups.items())},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            name: [[start, [[provider, scene, bucket.to_list()] for (provider, scene), bucket in buckets.items()]]
+                   for start, buckets in series.items()]
+            for name, series in self.series.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Rollups":
+        rollups = cls()
+        for name, series in rollups.series.items():
+            for start, buckets in sorted(data.get(name, []), key=lambda item: item[0]):
+                series[start] = {(provider, scene): Bucket.from_list(bucket) for provider, scene, bucket in buckets}
+        return rollups
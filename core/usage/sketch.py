@@ -0,0 +1,72 @@
+import math
+from typing import Dict, List, Optional
+
+# 分位数的相对误差上限
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+LOG_GAMMA = math.log(GAMMA)
+
+def sketch_key(value: float) -> Optional[int]:
+    """值所在的对数桶编号；非正值计入零桶，返回 None"""
+    if value <= 0:
+        return None
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+class DDSketch:
+    """
+    DDSketch 分位数草图：值按对数分桶 (桶宽随值增大)，任意分位数的相对误差不超过 ALPHA。
+    两个草图逐桶相加即可合并，合并结果与直接统计全部数据相同，适合按时间桶汇总后再合并查询。
+    """
+    __slots__ = ("bins", "zero", "count")
+
+    def __init__(self):
+        self.bins: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, value: float):
+        self.add_key(sketch_key(value))
+
+    def add_key(self, key: Optional[int], count: int = 1):
+        """按预先计算的桶编号计数 (同一个值写入多个时间粒度时只算一次对数)"""
+        if key is None:
+            self.zero += count
+        else:
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.count += count
+
+    def merge(self, other: "DDSketch"):
+        bins = self.bins
+        for key, count in other.bins.items():
+            bins[key] = bins.get(key, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """第 q 分位数 (0 <= q <= 1)；空草图返回 0"""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * GAMMA ** key / (GAMMA + 1)
+        return 2 * GAMMA ** max(self.bins) / (GAMMA + 1)
+
+    def to_list(self) -> List[int]:
+        """紧凑序列化：[零桶计数, 桶号, 计数, 桶号, 计数, ...]"""
+        out = [self.zero]
+        for key, count in self.bins.items():
+            out.extend((key, count))
+        return out
+
+    @classmethod
+    def from_list(cls, data: List[int]) -> "DDSketch":
+        sketch = cls()
+        sketch.zero = data[0]
+        sketch.bins = {data[i]: data[i + 1] for i in range(1, len(data), 2)}
+        sketch.count = sketch.zero + sum(sketch.bins.values())
+        return sketch
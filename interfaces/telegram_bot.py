@@ -44,8 +44,8 @@ class OmniBot:
         user_input = update.message.text
         await update.message.reply_chat_action("typing")
         
-        # 调用核心引擎执行
-        res = await omni_engine.execute_task(user_input)
+        # 调用核心引擎执行 (每个聊天使用独立的记忆命名空间)
+        res = await omni_engine.execute_task(user_input, namespace=f"telegram:{update.effective_chat.id}")
         await update.message.reply_text(f"✅ *执行结果:*\n\n{res}", parse_mode='Markdown')
 
     def run(self):
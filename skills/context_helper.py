@@ -12,9 +12,16 @@ class ContextHelperSkill(BaseSkill):
     def force_shrink(self, text: str) -> str:
         return omni_engine.compress_context(text)
 
-    @skill_tool(name="recall_memory", description="检索本地长效记忆中的关键信息")
-    def recall_memory(self) -> str:
-        mems = omni_engine.memory.memory.get("long_term_facts", [])
+    @skill_tool(name="recall_memory", description="检索本地长效记忆中与查询相关的关键信息 (不提供查询时返回最近的记忆)")
+    def recall_memory(self, query: str = "", namespace: str = "") -> str:
+        memory = omni_engine.memory_for(namespace or None)
+        mems = memory.search(query, 10) if query else memory.recent_facts(10)
         if not mems:
-            return "记忆库目前为空。"
-        return "🧠 检索到的长效记忆:\n" + "\n".join([f"- {m}" for m in mems[-10:]])
+            return "未检索到相关记忆。" if query and memory.recent_facts(1) else "记忆库目前为空。"
+        return "🧠 检索到的长效记忆:\n" + "\n".join([f"- {m}" for m in mems])
+
+    @skill_tool(name="pin_memory", description="置顶一条长效记忆 (置顶的记忆不会因容量上限被归档)，unpin 为真时取消置顶")
+    def pin_memory(self, fact: str, namespace: str = "", unpin: bool = False) -> str:
+        if not omni_engine.memory_for(namespace or None).pin(fact, not unpin):
+            return "未找到该条记忆。"
+        return "已取消置顶。" if unpin else "已置顶。"
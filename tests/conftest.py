@@ -0,0 +1,14 @@
+import os
+import shutil
+import tempfile
+
+from core.config import settings
+
+# 全局单例 (TokenTracker、OmniEngine 的 MemoryBank) 在首次使用时按 settings 打开存储：
+# 测试期间指向临时目录，不在仓库根目录留下 token_stats.db 与 data/memory.db
+_DATA_DIR = tempfile.mkdtemp(prefix="omni-tests-")
+settings.TOKEN_STATS_PATH = os.path.join(_DATA_DIR, "token_stats.db")
+settings.MEMORY_PATH = os.path.join(_DATA_DIR, "memory.db")
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
@@ -0,0 +1,26 @@
+from benchmarks.corpus import generate_transcript
+from benchmarks.shrink_bench import run, compare, parse_size
+
+def test_corpus_generator_is_deterministic_and_sized():
+    corpus = generate_transcript(20 * 1024, seed=7)
+    assert corpus.size >= 20 * 1024
+    assert corpus.text == generate_transcript(20 * 1024, seed=7).text
+    assert all(k in corpus.text for k in corpus.keys)
+    assert corpus.latest_code is None or corpus.latest_code in corpus.text
+
+def test_bench_report_and_regression_check():
+    """基准结果为机器可读格式，且能发现相对基线的回退"""
+    report = run([parse_size("8K")], ["default"], repeats=1)
+    result = report["results"][0]
+    assert result["mode"] == "default" and result["throughput_mb_s"] > 0
+    assert compare(report, report) == []
+
+    baseline = {"results": [dict(result, throughput_mb_s=result["throughput_mb_s"] * 10)]}
+    assert any("throughput" in r for r in compare(report, baseline))
+
+def test_compressor_bench_on_typed_corpus():
+    """专用压缩器在各自类型的语料上单独测量"""
+    report = run([parse_size("8K")], [], repeats=1, compressors=["json", "log", "trace"])
+    results = {r["mode"]: r for r in report["results"]}
+    assert set(results) == {"compressor:json", "compressor:log", "compressor:trace"}
+    assert all(r["char_ratio"] < 1 for r in results.values())
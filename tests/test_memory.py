@@ -0,0 +1,338 @@
+import asyncio
+import json
+from core.memory import MemoryStore
+
+def test_memory_journal_replays_after_restart(tmp_path):
+    """变更以追加日志写入，重启后回放；快照文件保持原有格式"""
+    path = tmp_path / "memory.json"
+    store = MemoryStore(str(path))
+    store.add_fact("我喜欢简洁的回答")
+    store.add_fact("我喜欢简洁的回答")
+    store.update_profile("name", "Ada")
+    assert store.flush(timeout=5)
+    assert not path.exists()
+    lines = (tmp_path / "memory.json.journal").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["op"] for line in lines] == ["fact", "profile"]
+
+    reloaded = MemoryStore(str(path))
+    assert reloaded.memory["long_term_facts"] == ["我喜欢简洁的回答"]
+    assert reloaded.memory["user_profile"] == {"name": "Ada"}
+    assert reloaded.facts_version == 1
+
+    reloaded.save()
+    assert json.loads(path.read_text(encoding="utf-8"))["long_term_facts"] == ["我喜欢简洁的回答"]
+    assert (tmp_path / "memory.json.journal").read_text(encoding="utf-8") == ""
+
+def test_memory_journal_survives_torn_write_and_compacts(tmp_path, monkeypatch):
+    """崩溃留下的半行记录被跳过，日志超过阈值后在后台压实为快照"""
+    path = tmp_path / "memory.json"
+    journal = tmp_path / "memory.json.journal"
+    journal.write_text('{"op": "fact", "fact": "a"}\n{"op": "fact", "fa', encoding="utf-8")
+    store = MemoryStore(str(path))
+    assert store.memory["long_term_facts"] == ["a"]
+
+    store.journal.compact_records = 5
+    for i in range(5):
+        store.add_fact(f"fact {i}")
+    assert store.flush(timeout=5)
+    assert len(json.loads(path.read_text(encoding="utf-8"))["long_term_facts"]) == 6
+    store.add_fact("after")
+    store.close()
+    assert MemoryStore(str(path)).memory["long_term_facts"] == ["a"] + [f"fact {i}" for i in range(5)] + ["after"]
+
+def test_memory_journal_skips_records_covered_by_snapshot(tmp_path):
+    """快照替换后、清空日志前崩溃：旧日志中快照已包含的记录 (含命中次数) 回放时跳过，不会重复计入"""
+    path = tmp_path / "memory.json"
+    journal = tmp_path / "memory.json.journal"
+    store = MemoryStore(str(path))
+    store.add_fact("the deploy script lives in /opt/deploy")
+    for _ in range(3):
+        assert store.search("deploy script", 1, mode="bm25")
+    assert store.flush(timeout=5)
+    stale = journal.read_text(encoding="utf-8")
+    store.save()
+    store.add_fact("after the snapshot")
+    store.close()
+    # 模拟崩溃：快照已替换，但日志没有被清空
+    journal.write_text(stale + journal.read_text(encoding="utf-8"), encoding="utf-8")
+
+    reloaded = MemoryStore(str(path))
+    assert reloaded.memory["long_term_facts"] == ["the deploy script lives in /opt/deploy", "after the snapshot"]
+    assert reloaded.memory["fact_meta"]["the deploy script lives in /opt/deploy"]["hits"] == 3
+    assert reloaded.facts_version == 2
+    reloaded.add_fact("after restart")
+    reloaded.close()
+    assert MemoryStore(str(path)).memory["long_term_facts"][-1] == "after restart"
+
+def test_memory_search_ranks_relevant_facts(tmp_path):
+    """BM25 检索：按相关度返回事实，新增事实增量进入索引，重复事实 O(1) 去重"""
+    store = MemoryStore(str(tmp_path / "memory.json"))
+    store.add_fact("我喜欢简洁的回答")
+    store.add_fact("生产服务器的部署脚本在 /opt/deploy/run.sh")
+    assert store.search("部署到生产服务器", 2) == ["生产服务器的部署脚本在 /opt/deploy/run.sh"]
+    store.add_fact("测试服务器的部署需要先备份数据库")
+    store.add_fact("测试服务器的部署需要先备份数据库")
+    assert store.facts_version == 3
+    assert store.search("测试服务器怎么部署", 2) == [
+        "测试服务器的部署需要先备份数据库", "生产服务器的部署脚本在 /opt/deploy/run.sh"
+    ]
+    assert store.search("天气", 3) == []
+    assert store.search("RUN.sh", 1) == ["生产服务器的部署脚本在 /opt/deploy/run.sh"]
+
+def test_memory_hint_injects_only_relevant_facts(tmp_path, monkeypatch):
+    """压缩时只注入与对话末尾相关的记忆"""
+    from core.omni_engine import OmniEngine
+    monkeypatch.setattr("core.omni_engine.token_tracker.record", lambda *a, **k: None)
+    engine = OmniEngine()
+    engine.memory = MemoryStore(str(tmp_path / "memory.json"))
+    engine.memory.add_fact("数据库备份保存在 /backup/db")
+    engine.memory.add_fact("我喜欢猫")
+    lines = ["System: 助手", "User: 开始"] + [f"User: 第{i}轮 讨论前端页面样式调整" for i in range(30)]
+    assert "[长效记忆提示" not in engine.compress_context("\n".join(lines))
+    result = engine.compress_context("\n".join(lines + ["User: 数据库备份在哪里？"]))
+    assert "[长效记忆提示: 数据库备份保存在 /backup/db]" in result
+
+def test_vector_recall_uses_appended_memory_mapped_matrix(tmp_path, monkeypatch):
+    """向量检索补足关键词检索漏掉的事实；向量追加写入文件，重启后直接映射已有矩阵"""
+    store = MemoryStore(str(tmp_path / "memory.json"))
+    store.add_fact("the deploy script lives in /opt/deploy")
+    store.add_fact("我喜欢简洁的回答")
+    assert store.search("deployment scripts", 3, mode="bm25") == []
+    assert store.search("deployment scripts", 3) == ["the deploy script lives in /opt/deploy"]
+    vectors = tmp_path / "memory.json.vectors"
+    assert vectors.stat().st_size == 2 * 256 * 4
+
+    store.add_fact("数据库备份保存在 /backup/db")
+    assert store.search("数据库备份在哪里", 1, mode="vector") == ["数据库备份保存在 /backup/db"]
+    assert vectors.stat().st_size == 3 * 256 * 4
+    store.close()
+
+    reloaded = MemoryStore(str(tmp_path / "memory.json"))
+    index = reloaded._vector_index()
+    assert len(index) == 3 and index._matrix is None
+
+def test_vector_index_ivf_partitions(tmp_path):
+    """行数达到阈值后使用 IVF 分区检索，结果与暴力检索一致"""
+    from core.memory.vectors import HashingEmbedder, VectorIndex
+    texts = [f"fact {i} about service{i % 50} and region{i % 7}" for i in range(400)]
+    brute = VectorIndex(str(tmp_path / "a.vectors"), HashingEmbedder(), ivf_min_rows=10 ** 9)
+    ivf = VectorIndex(str(tmp_path / "b.vectors"), HashingEmbedder(), ivf_min_rows=100, nprobe=20)
+    brute.append(texts)
+    ivf.append(texts)
+    expected = brute.search("service7 region0", 1)
+    assert ivf.search("service7 region0", 1) == expected
+    assert ivf._ivf is not None
+    ivf.append(["service7 region0"])
+    assert ivf.search("service7 region0", 1)[0][0] == 400
+
+def test_sqlite_memory_namespaces_are_isolated(tmp_path):
+    """SQLite 后端：WAL 模式，各命名空间的事实与画像互不可见，重启后只加载本命名空间"""
+    from core.memory import SQLiteMemoryStore
+    path = str(tmp_path / "memory.db")
+    alice = SQLiteMemoryStore(path, "telegram:1")
+    bob = SQLiteMemoryStore(path, "telegram:2")
+    alice.add_fact("我喜欢简洁的回答")
+    alice.add_fact("我喜欢简洁的回答")
+    alice.update_profile("name", "Alice")
+    bob.add_fact("数据库备份保存在 /backup/db")
+    assert alice._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert alice.facts_version == 1 and bob.facts_version == 1
+    assert alice.search("数据库备份", 3) == []
+    assert bob.search("数据库备份", 3) == ["数据库备份保存在 /backup/db"]
+    alice.close()
+
+    reloaded = SQLiteMemoryStore(path, "telegram:1")
+    assert reloaded.memory["long_term_facts"] == ["我喜欢简洁的回答"]
+    assert reloaded.memory["user_profile"] == {"name": "Alice"}
+    assert reloaded._vectors_path() != bob._vectors_path()
+
+def test_sqlite_memory_sees_writes_from_other_connections(tmp_path, monkeypatch):
+    """多个连接 (模拟多个进程) 同时写入同一命名空间：不丢更新，读取时增量拉取对方的新事实"""
+    import threading
+    from core.memory import SQLiteMemoryStore
+    monkeypatch.setattr("core.memory.store.settings.MEMORY_CONSOLIDATE_EVERY", 0)
+    path = str(tmp_path / "memory.db")
+    stores = [SQLiteMemoryStore(path, "shared") for _ in range(3)]
+
+    def writer(n):
+        for i in range(20):
+            stores[n].add_fact(f"worker{n} 写入的事实 item{i}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for store in stores:
+        assert store.facts_version == 60
+        assert store.recent_facts(100) == stores[0].recent_facts(100)
+    assert stores[1].search("worker2 item7", 1) == ["worker2 写入的事实 item7"]
+
+def test_sqlite_memory_imports_legacy_json(tmp_path):
+    """首次打开 memory.db 时导入同目录下旧版 memory.json 的默认命名空间"""
+    from core.memory import MemoryBank
+    legacy = MemoryStore(str(tmp_path / "memory.json"))
+    legacy.add_fact("我喜欢猫")
+    legacy.update_profile("name", "Ada")
+    legacy.close()
+    bank = MemoryBank(str(tmp_path / "memory.db"), max_open=1)
+    store = bank.get()
+    assert store.memory["long_term_facts"] == ["我喜欢猫"]
+    assert store.memory["user_profile"] == {"name": "Ada"}
+    other = bank.get("telegram:1")
+    assert other.memory["long_term_facts"] == []
+    # 默认命名空间常驻；其余命名空间被淘汰后释放连接，再次使用时重新连接
+    bank.get("telegram:2")
+    store.add_fact("我喜欢狗")
+    assert bank.get() is store
+    assert bank.get().recent_facts(2) == ["我喜欢猫", "我喜欢狗"]
+    other.add_fact("我喜欢鸟")
+    assert bank.get("telegram:1").recent_facts(1) == ["我喜欢鸟"]
+
+def test_engine_default_memory_survives_bank_eviction(tmp_path, monkeypatch):
+    """默认命名空间不随 LRU 淘汰关闭：打开大量其他命名空间后仍可写入 (JSON 后端)；引擎创建时不打开存储"""
+    from core.memory import MemoryBank
+    from core.omni_engine import OmniEngine
+    monkeypatch.setattr("core.omni_engine.settings.MEMORY_PATH", str(tmp_path / "lazy" / "memory.db"))
+    engine = OmniEngine()
+    assert not (tmp_path / "lazy").exists()
+    engine.memories = MemoryBank(str(tmp_path / "memory.json"), max_open=4)
+    for i in range(10):
+        engine.memory_for(f"telegram:{i}").add_fact(f"用户 {i} 的事实")
+    engine.memory.add_fact("我喜欢猫")
+    assert engine.memory_for(None) is engine.memory
+    assert engine.memory.recent_facts(1) == ["我喜欢猫"]
+    engine.memories.close()
+
+def test_engine_memory_namespaces(tmp_path, monkeypatch):
+    """不同命名空间的记忆只注入各自的压缩结果，缓存键区分命名空间"""
+    from core.memory import MemoryBank
+    from core.omni_engine import OmniEngine
+    monkeypatch.setattr("core.omni_engine.token_tracker.record", lambda *a, **k: None)
+    engine = OmniEngine()
+    engine.memories = MemoryBank(str(tmp_path / "memory.db"))
+    engine.memory = engine.memories.get()
+    asyncio.run(engine.execute_task("记住 数据库备份保存在 /backup/db", namespace="telegram:1"))
+    lines = ["System: 助手", "User: 开始"] + [f"User: 第{i}轮 讨论前端页面样式调整" for i in range(30)]
+    context = "\n".join(lines + ["User: 数据库备份在哪里？"])
+    assert "/backup/db" in engine.compress_context(context, namespace="telegram:1")
+    assert "[长效记忆提示" not in engine.compress_context(context, namespace="telegram:2")
+    assert "[长效记忆提示" not in engine.compress_context(context)
+
+def test_memory_cap_archives_lowest_value_facts(tmp_path, monkeypatch):
+    """超过容量上限时归档价值最低的事实：置顶与常被检索命中的事实保留，向量行号随之压实"""
+    monkeypatch.setattr("core.memory.store.settings.MEMORY_MAX_FACTS", 10)
+    monkeypatch.setattr("core.memory.store.settings.MEMORY_CONSOLIDATE_EVERY", 0)
+    path = tmp_path / "memory.json"
+    store = MemoryStore(str(path))
+    store.add_fact("数据库备份保存在 /backup/db", pinned=True)
+    store.add_fact("the deploy script lives in /opt/deploy")
+    for i in range(3):
+        assert store.search("deploy script", 1, mode="bm25") == ["the deploy script lives in /opt/deploy"]
+    assert store.search("deployment scripts", 1, mode="vector") == ["the deploy script lives in /opt/deploy"]
+    for i in range(9):
+        store.add_fact(f"topic{i} 的临时笔记 note{i}")
+    facts = store.recent_facts(100)
+    assert len(facts) == 9
+    assert facts[:2] == ["数据库备份保存在 /backup/db", "the deploy script lives in /opt/deploy"]
+    assert "topic0 的临时笔记 note0" not in facts
+    archived = [json.loads(line) for line in (tmp_path / "memory.json.archive.jsonl").read_text("utf-8").splitlines()]
+    assert [a["fact"] for a in archived] == [f"topic{i} 的临时笔记 note{i}" for i in range(2)]
+    assert archived[0]["reason"] == "evict"
+    # 删除后向量文件按新行号压实，向量检索仍返回正确的事实
+    assert store.search("deployment scripts", 1, mode="vector") == ["the deploy script lives in /opt/deploy"]
+    assert store.search("note8", 1, mode="vector") == ["topic8 的临时笔记 note8"]
+    store.close()
+    assert MemoryStore(str(path)).recent_facts(100) == facts
+
+def test_memory_consolidation_merges_near_duplicates(tmp_path, monkeypatch):
+    """近重复事实合并进最新的一条：命中次数与置顶随之合并，被并入的事实进入归档"""
+    from core.memory import SQLiteMemoryStore
+    monkeypatch.setattr("core.memory.store.settings.MEMORY_CONSOLIDATE_EVERY", 0)
+    for store in (MemoryStore(str(tmp_path / "facts.json")), SQLiteMemoryStore(str(tmp_path / "memory.db"))):
+        store.add_fact("我喜欢简洁的回答", pinned=True)
+        store.add_fact("我喜欢猫")
+        assert store.search("简洁的回答", 1) == ["我喜欢简洁的回答"]
+        store.add_fact("我喜欢简洁的回答。")
+        store.add_fact("我喜欢狗")
+        version = store.facts_version
+        assert store.consolidate() == 1
+        assert store.recent_facts(10) == ["我喜欢猫", "我喜欢简洁的回答。", "我喜欢狗"]
+        store.flush()
+        meta = store._fact_metas_locked()["我喜欢简洁的回答。"]
+        assert meta["hits"] == 1 and meta["pinned"]
+        assert store.facts_version == version + 1
+        assert store.consolidate() == 0
+
+    other = SQLiteMemoryStore(str(tmp_path / "memory.db"))
+    assert other.recent_facts(10) == ["我喜欢猫", "我喜欢简洁的回答。", "我喜欢狗"]
+    store.add_fact("我喜欢狗。")
+    assert store.consolidate() == 1
+    # 其他连接的代数变化：重新加载整个命名空间
+    assert other.recent_facts(10) == ["我喜欢猫", "我喜欢简洁的回答。", "我喜欢狗。"]
+    archived = other._conn.execute("SELECT fact, merged_into FROM archive ORDER BY id").fetchall()
+    assert archived == [("我喜欢简洁的回答", "我喜欢简洁的回答。"), ("我喜欢狗", "我喜欢狗。")]
+
+def test_evicted_stores_are_released(tmp_path):
+    """被 MemoryBank 淘汰的存储不再被持有时可以被回收，不被退出钩子或日志线程长期持有"""
+    import gc
+    import weakref
+    from core.memory import MemoryBank
+    bank = MemoryBank(str(tmp_path / "memory.json"), max_open=2)
+    refs = []
+    for i in range(50):
+        store = bank.get(f"telegram:{i}")
+        store.add_fact(f"用户 {i} 的事实")
+        refs.append(weakref.ref(store))
+    del store
+    gc.collect()
+    assert sum(ref() is not None for ref in refs) <= 2
+    bank.close()
+
+def test_memory_bank_eviction_keeps_held_stores_usable(tmp_path):
+    """被淘汰的存储只释放线程与文件句柄：持有者可以继续写入，再次访问取回同一个实例"""
+    from core.memory import MemoryBank
+    bank = MemoryBank(str(tmp_path / "memory.json"), max_open=1)
+    held = bank.get("telegram:1")
+    held.add_fact("我喜欢猫")
+    bank.get("telegram:2")
+    assert held.journal._thread is None and not held.journal.closed
+    held.add_fact("我喜欢狗")
+    assert bank.get("telegram:1") is held
+    assert held.recent_facts(2) == ["我喜欢猫", "我喜欢狗"]
+    bank.close()
+    assert MemoryStore(str(tmp_path / "memory.json"), namespace="telegram:1").recent_facts(2) == ["我喜欢猫", "我喜欢狗"]
+
+def test_cold_hybrid_search_builds_vectors_in_background(tmp_path, monkeypatch):
+    """大量事实尚未向量化时，首次 hybrid 检索只走 BM25，向量与 IVF 分区在后台补齐"""
+    import threading
+    import core.memory.store as store_mod
+    from core.config import settings
+    from core.memory.vectors import HashingEmbedder
+    monkeypatch.setattr(store_mod, "VECTOR_INLINE_FACTS", 8)
+    monkeypatch.setattr(store_mod, "VECTOR_BUILD_BATCH", 50)
+    monkeypatch.setattr(settings, "MEMORY_IVF_MIN_ROWS", 100)
+    monkeypatch.setattr(settings, "MEMORY_MAX_FACTS", 0)
+    monkeypatch.setattr(settings, "MEMORY_CONSOLIDATE_EVERY", 0)
+    store = MemoryStore(str(tmp_path / "memory.json"))
+    for i in range(300):
+        store.add_fact(f"service{i} runs in region{i % 7}")
+    store.add_fact("the deploy script lives in /opt/deploy")
+    vectors = tmp_path / "memory.json.vectors"
+
+    release = threading.Event()
+    embed = HashingEmbedder.embed
+    def slow_embed(self, texts):
+        if len(texts) > 1:
+            release.wait(10)
+        return embed(self, texts)
+    monkeypatch.setattr(HashingEmbedder, "embed", slow_embed)
+
+    assert store.search("deployment scripts", 3) == []
+    assert not vectors.exists()
+    release.set()
+    store._vector_thread.join(10)
+    assert vectors.stat().st_size == 301 * 256 * 4
+    assert store._vectors._ivf is not None
+    assert store.search("deployment scripts", 3) == ["the deploy script lives in /opt/deploy"]
+    store.close()
@@ -0,0 +1,65 @@
+import pytest
+from fastapi.testclient import TestClient
+from core.metrics import MetricsRegistry
+from core.skill import BaseSkill, skill_tool
+from core.skill_manager import SkillManager
+from core.token_tracker import TokenTracker
+
+def test_registry_renders_openmetrics():
+    """计数器导出 _total，直方图导出累计 le 桶、_count 与 _sum，以 # EOF 结尾"""
+    registry = MetricsRegistry()
+    calls = registry.counter("demo_calls", "调用次数", ("provider",))
+    latency = registry.histogram("demo_seconds", "耗时", ("provider",), buckets=(0.01, 0.1))
+    calls.labels("deepseek").inc()
+    calls.labels("deepseek").inc(2)
+    latency.labels("deepseek").observe(0.05)
+    latency.labels("deepseek").observe_ns(500_000_000)
+    text = registry.render()
+    assert 'demo_calls_total{provider="deepseek"} 3' in text
+    assert 'demo_seconds_bucket{provider="deepseek",le="0.01"} 0' in text
+    assert 'demo_seconds_bucket{provider="deepseek",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{provider="deepseek",le="+Inf"} 2' in text
+    assert 'demo_seconds_count{provider="deepseek"} 2' in text
+    assert text.endswith("# EOF\n")
+    assert registry.counter("demo_calls", "调用次数", ("provider",)) is calls
+    with pytest.raises(ValueError):
+        registry.histogram("demo_calls", "重名")
+
+def test_label_cardinality_is_capped():
+    """标签组合超过上限后计入 other，标签值中的引号被转义"""
+    registry = MetricsRegistry()
+    calls = registry.counter("demo_methods", "方法调用", ("method",))
+    calls.max_series = 2
+    for method in ("a", 'b"x', "c", "d"):
+        calls.labels(method).inc()
+    text = registry.render()
+    assert 'demo_methods_total{method="b\\"x"} 1' in text
+    assert 'demo_methods_total{method="other"} 2' in text
+
+def test_skill_execution_and_token_stats_exported(tmp_path):
+    """技能工具耗时按 skill/tool/status 记录，TokenTracker 的累计值在抓取时导出"""
+    class EchoSkill(BaseSkill):
+        name = "echo"
+        description = "测试技能"
+
+        @skill_tool(description="原样返回")
+        def say(self, text: str) -> str:
+            return text
+
+    manager = SkillManager(str(tmp_path / "skills"))
+    manager._skills["echo"] = EchoSkill()
+    assert manager.execute("echo", "say", text="hi") == "hi"
+    with pytest.raises(ValueError):
+        manager.execute("echo", "missing")
+    from core.fastapi_gateway import app
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/openmetrics-text")
+    assert 'omni_skill_duration_seconds_count{skill="echo",tool="say",status="success"} 1' in response.text
+    assert 'omni_skill_duration_seconds_count{skill="echo",tool="missing",status="error"} 1' in response.text
+
+    tracker = TokenTracker(str(tmp_path / "stats.json"))
+    tracker.record("deepseek", "agent", 100, 40)
+    families = {family.name: family for family in tracker.collect_metrics()}
+    assert families["omni_tokens_optimized"].samples[0].value == 40
+    assert families["omni_token_stats_pending"].samples[0].value == 1
@@ -0,0 +1,483 @@
+import asyncio
+import json
+import time
+import pytest
+from core.omni_engine import OmniEngine, MemoryStore
+from core.compression import ShrinkSessionStore, ShrinkCache, ShrinkResult, ShrinkPool
+from core.compression.dedup import dedup_text
+from core.compression.pipeline import shrink_text
+
+def make_dialogue(turns: int) -> str:
+    lines = ["System: 你是 Clawdbot 的本地助手。", "User: 你好，我们开始配置吧。"]
+    for i in range(turns):
+        lines.append(f"User: 第{i}轮 请检查路径 /opt/app/run_{i}.py 的状态")
+        lines.append(f"AI: 已检查 Config 文件，结果正常 {i}")
+    return "\n".join(lines)
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """使用临时记忆文件的引擎实例，避免污染本地数据"""
+    monkeypatch.setattr("core.omni_engine.token_tracker.record", lambda *a, **k: None)
+    eng = OmniEngine()
+    eng.memory = MemoryStore(str(tmp_path / "memory.json"))
+    return eng
+
+def test_incremental_matches_full_compression(engine):
+    """增量压缩的结果应与一次性压缩完整对话一致 (增量模式不做去重)"""
+    context = make_dialogue(12)
+    lines = context.split("\n")
+    result = None
+    for i in range(0, len(lines), 3):
+        result = engine.compress_incremental("s1", "\n".join(lines[i:i + 3]))
+    assert result == engine.compress_context(context, dedup=False)
+
+def test_incremental_returns_raw_below_threshold(engine):
+    """未达到压缩阈值时原样返回累计内容"""
+    assert engine.compress_incremental("s2", "User: hi") == "User: hi"
+    assert engine.compress_incremental("s2", "AI: hello") == "User: hi\nAI: hello"
+
+def test_incremental_keeps_code_block_across_deltas(engine):
+    """跨多次追加的代码块也能被完整保留"""
+    engine.compress_incremental("s3", make_dialogue(10) + "\n```python\nprint('a')")
+    result = engine.compress_incremental("s3", "print('b')\n```\nUser: 继续")
+    assert "```python\nprint('a')\nprint('b')\n```" in result
+
+def test_incremental_reset(engine):
+    engine.compress_incremental("s4", make_dialogue(10))
+    assert engine.compress_incremental("s4", "User: new", reset=True) == "User: new"
+
+def test_session_store_evicts_lru_and_idle(monkeypatch):
+    store = ShrinkSessionStore(max_sessions=2, idle_ttl=10)
+    clock = [100.0]
+    monkeypatch.setattr("core.compression.session.time.monotonic", lambda: clock[0])
+    store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")  # 超出容量，淘汰最久未访问的 b
+    assert "b" not in store and "a" in store and "c" in store
+    clock[0] += 11
+    assert store.evict_idle() == 2
+    assert len(store) == 0
+
+def test_cache_hit_skips_recomputation(engine, monkeypatch):
+    """相同内容的第二次压缩直接命中缓存"""
+    context = make_dialogue(12)
+    first = engine.compress_context(context)
+    monkeypatch.setattr(engine, "_shrink", lambda *a: pytest.fail("cache miss"))
+    assert engine.compress_context(context) == first
+    assert engine.cache.stats()["hits"] == 1
+
+def test_cache_key_normalises_options(engine, monkeypatch):
+    """参数顺序、省略的默认值与数值类型不影响缓存键"""
+    context = make_dialogue(12)
+    first = engine.compress_context(context, target_ratio=1, layout="default")
+    monkeypatch.setattr(engine, "_shrink", lambda *a, **k: pytest.fail("cache miss"))
+    assert engine.compress_context(context, dedup=True, target_ratio=1.0) == first
+    assert engine.compress_context(context, layout="default", alias=False, target_ratio=1.0,
+                                   structured=True) == first
+
+def test_cache_invalidated_by_new_memory_fact(engine):
+    context = make_dialogue(12)
+    engine.compress_context(context)
+    engine.memory.add_fact("检查 Config 文件时我喜欢简洁的回答")
+    assert "检查 Config 文件时我喜欢简洁的回答" in engine.compress_context(context)
+
+def test_cache_lru_byte_limit_and_disk_tier(tmp_path):
+    cache = ShrinkCache(max_bytes=300, disk_dir=str(tmp_path / "cache"))
+    for i in range(5):
+        cache.put(f"{i:064d}", ShrinkResult(text="x" * 100))
+    assert cache.stats()["bytes"] <= 300
+    # 新实例模拟进程重启：内存层为空，从磁盘层恢复
+    restarted = ShrinkCache(max_bytes=300, disk_dir=str(tmp_path / "cache"))
+    assert restarted.get(f"{0:064d}").text == "x" * 100
+
+def test_cache_disk_tier_is_bounded_and_results_are_copied(tmp_path):
+    """磁盘层按字节数 LRU 淘汰 (重启后依然生效)；修改返回的消息数组不影响后续命中"""
+    cache = ShrinkCache(max_bytes=1 << 20, disk_dir=str(tmp_path / "cache"), disk_max_bytes=1000)
+    for i in range(20):
+        cache.put(f"{i:064d}", ShrinkResult(text="x" * 100))
+    assert 0 < cache.stats()["disk_bytes"] <= 1000
+    files = list((tmp_path / "cache").rglob("*.json"))
+    assert len(files) == cache.stats()["disk_entries"] < 20
+    restarted = ShrinkCache(max_bytes=1 << 20, disk_dir=str(tmp_path / "cache"), disk_max_bytes=500)
+    assert restarted.stats()["disk_bytes"] <= 500
+    assert restarted.get(f"{19:064d}") is not None and restarted.get(f"{0:064d}") is None
+
+    messages = [{"role": "user", "content": "hi"}]
+    cache.put("m" * 64, ShrinkResult(text="", messages=messages))
+    messages[0]["content"] = "changed by caller"
+    first = cache.get("m" * 64)
+    first.messages.append({"role": "assistant", "content": "mutated"})
+    assert cache.get("m" * 64).messages == [{"role": "user", "content": "hi"}]
+
+def test_budget_mode_respects_target_tokens(engine):
+    """预算模式的输出不超过目标 Token 数，且保留的句子保持原文顺序"""
+    from core.tokenizer import count_tokens
+    context = make_dialogue(60)
+    result = engine.compress_context(context, target_tokens=400)
+    assert count_tokens(result) <= 400
+    kept = [line for line in result.split("\n") if line.startswith("User: 第")]
+    assert kept == sorted(kept, key=context.index)
+
+def test_budget_mode_prefers_sentences_relevant_to_tail(engine):
+    filler = [f"AI: 普通闲聊内容第{i}条。" for i in range(40)]
+    lines = ["System: 助手", "User: 开始"] + filler[:20] + ["AI: Redis 连接池配置为 max_connections=50。"] + filler[20:]
+    lines += ["User: 请回顾 Redis 连接池的 max_connections 设置"] + [f"AI: 好的{i}" for i in range(5)]
+    result = engine.compress_context("\n".join(lines), target_tokens=150)
+    assert "max_connections=50" in result
+
+def test_budget_mode_returns_context_that_already_fits(engine):
+    context = make_dialogue(12)
+    assert engine.compress_context(context, target_ratio=1.0) == context
+
+@pytest.mark.asyncio
+async def test_compress_batch_matches_single_and_keeps_order(engine):
+    """批量压缩结果与逐条压缩一致，并按输入顺序返回"""
+    engine.pool = ShrinkPool(max_workers=2)
+    contexts = [make_dialogue(10 + i) for i in range(4)] + ["short"]
+    try:
+        summaries = await engine.compress_batch(contexts)
+    finally:
+        engine.pool.shutdown()
+    assert summaries[-1] == "short"
+    engine.cache.clear()
+    assert summaries[:4] == [engine.compress_context(c) for c in contexts[:4]]
+
+def test_shrink_pool_reused_across_event_loops():
+    """同一个进程池可以在不同的事件循环中使用 (信号量按事件循环创建)"""
+    pool = ShrinkPool(max_workers=1, max_inflight=1)
+    jobs = [{"context": make_dialogue(10 + i)} for i in range(2)]
+    try:
+        first = asyncio.run(pool.map(jobs))
+        second = asyncio.run(pool.map(jobs))
+    finally:
+        pool.shutdown()
+    assert [r.text for r in first] == [r.text for r in second]
+
+def test_dedup_keeps_latest_occurrence():
+    """近重复的日志行与代码块只保留最新一次，较早的替换为回溯引用"""
+    log = "2024-05-01 12:00:{:02d} INFO worker-1 processed job batch in {}ms"
+    code = "```python\ndef handler(event):\n    return event.get('field', 0)\n```"
+    lines = ["System: 助手", "User: 开始"]
+    lines += [log.format(i, 100 + i) for i in range(5)]
+    lines += [code, "User: 中间的问题需要保留", code, log.format(59, 999)]
+    text, removed = dedup_text("\n".join(lines))
+    assert removed == 9
+    assert text.count("```python") == 1
+    assert "[≈ 已省略 9 行重复内容" in text
+    assert text.rstrip().endswith(log.format(59, 999))
+    assert "User: 中间的问题需要保留" in text
+
+def test_dedup_preserves_distinct_entities():
+    """受保护实体不同的相似行不会被合并"""
+    lines = ["System: 助手", "User: 开始"]
+    lines += [f"AI: 已经修改配置文件 /srv/app/config_{i}.yaml 中的参数" for i in range(4)]
+    text, removed = dedup_text("\n".join(lines))
+    assert removed == 0
+    assert all(f"config_{i}.yaml" in text for i in range(4))
+
+def _app_version(n: int) -> str:
+    body = [f"def handler(event):", "    value = event.get('field', 0)"]
+    body += [f"    step_{i} = value + {i}" for i in range(8)]
+    body += [f"    return value * {n}"]
+    return "```python app.py\n" + "\n".join(body) + "\n```"
+
+def test_code_diff_keeps_latest_full_and_earlier_as_diffs():
+    """同一文件的多个版本：最新版本保留全文，旧版本以 diff 表示"""
+    lines = ["System: 助手", "User: 开始"]
+    for n in range(1, 4):
+        lines += [f"AI: 第 {n} 版代码：", _app_version(n), "User: 请继续修改返回值。"]
+    lines += [f"User: 尾部对话 {i}" for i in range(6)]
+    context = "\n".join(lines)
+
+    plain = shrink_text(context, dedup=False).text
+    assert plain.count("```python app.py") == 1
+    assert "```diff" not in plain
+
+    result = shrink_text(context, dedup=False, code_diff=True).text
+    assert result.count("```python app.py") == 1
+    assert _app_version(3) in result
+    assert "[代码演进: app.py 共 3 个版本]" in result
+    assert result.count("```diff") == 2
+    assert "-    return value * 1\n+    return value * 2" in result
+
+def test_code_diff_groups_unnamed_blocks_by_similarity():
+    """无文件名的代码块按相似度归组，完全不同的代码各自保留最新版本"""
+    similar = [_app_version(n).replace("```python app.py", "```python") for n in (1, 2)]
+    other = "```sql\nSELECT id, status FROM jobs WHERE status = 'failed';\n```"
+    lines = ["System: 助手", "User: 开始", similar[0], other, similar[1]]
+    lines += [f"User: 尾部对话 {i}" for i in range(8)]
+    result = shrink_text("\n".join(lines), dedup=False, code_diff=True).text
+    assert other in result
+    assert similar[1] in result and similar[0] not in result
+    assert result.count("```diff") == 1
+    assert result.index(other) < result.index(similar[1])
+
+def test_cache_layout_prefix_is_stable_across_turns(engine):
+    """缓存友好布局：对话增长时已有前缀逐字节不变，增量与全量结果一致"""
+    engine.memory.add_fact("检查 Config 文件时我喜欢简洁的回答")
+    outputs = []
+    for turns in (150, 151, 190, 400):
+        text = engine.compress_context(make_dialogue(turns), layout="cache")
+        outputs.append(text)
+    for earlier, later in zip(outputs, outputs[1:]):
+        frozen = earlier[:earlier.index("[近期上下文摘要")]
+        assert later.startswith(frozen)
+    assert "[历史摘要: " in outputs[-1]
+    assert "[长效记忆提示" in outputs[-1].split("[近期上下文摘要")[1]
+
+    dialogue = make_dialogue(400).split("\n")
+    for start in range(0, len(dialogue), 37):
+        incremental = engine.compress_incremental("s-cache", "\n".join(dialogue[start:start + 37]), layout="cache")
+    assert incremental == outputs[-1]
+
+def test_frozen_segments_merge_deterministically():
+    """冻结段超限后两两合并，增量推入与一次性推入结果相同"""
+    from core.compression.layout import FrozenSegments, MAX_FROZEN_SEGMENTS
+    segments = FrozenSegments()
+    for i in range(MAX_FROZEN_SEGMENTS * 3):
+        segments.push([f"kw{i}"])
+        assert len(segments.frozen) <= MAX_FROZEN_SEGMENTS
+    assert segments.level == 2
+    assert segments.frozen[0] == ["kw0", "kw1", "kw2", "kw3"]
+
+def make_messages(turns: int):
+    messages = [{"role": "system", "content": "你是 Clawdbot 的本地助手。"}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"第{i}轮 请检查路径 /opt/app/run_{i}.py 的状态"})
+        messages.append({"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{i}", "type": "function", "function": {"name": "read_file", "arguments": "{}"}}
+        ]})
+        log = "\n".join(f"2024-05-01 INFO worker-{j} processed job {i * 100 + j}" for j in range(30))
+        messages.append({"role": "tool", "tool_call_id": f"call_{i}", "content": log})
+        messages.append({"role": "assistant", "content": f"已检查 Config 文件，结果正常 {i}"})
+    return messages
+
+def test_messages_mode_role_policies(engine):
+    """消息数组模式：system 固定，最近 N 轮原样保留，较早历史合并为一条摘要"""
+    messages = make_messages(20)
+    result = engine.compress_messages(messages, keep_turns=2)
+    assert result[0] == messages[0]
+    assert result[1]["role"] == "system" and result[1]["content"].startswith("[Omni Optimized Context]")
+    assert result[2:] == messages[-8:]
+    assert "processed job 100" not in result[1]["content"]
+    assert engine.compress_messages(messages, keep_turns=2) == result
+
+def test_messages_mode_keeps_short_conversations(engine):
+    messages = make_messages(2)
+    assert engine.compress_messages(messages, keep_turns=3) == messages
+
+def test_alias_substitution_is_reversible(engine):
+    """别名模式：重复的长路径替换为短句柄，别名表可把模型输出还原"""
+    deep = "C:\\Users\\dev\\projects\\omnigate\\core\\compression\\pipeline.py"
+    lines = ["System: 助手", f"User: 请打开 {deep}"]
+    lines += [f"AI: 第{i}步 已读取 /home/dev/projects/omnigate/data/memory.json 的内容" for i in range(12)]
+    lines += [f"User: 再检查 {deep} 和 /home/dev/projects/omnigate/data/memory.json"] * 2
+    context = "\n".join(lines)
+
+    plain = engine.compress_context(context)
+    result = engine.compress_context_result(context, alias=True)
+    aliased = result.text
+    assert len(aliased) < len(plain)
+    assert "§P1" in aliased and "[别名表: " in aliased
+    assert aliased.count(deep) == 1
+    assert engine.expand_aliases("RUN: type §P1", result.aliases) == f"RUN: type {deep}"
+    assert engine.expand_aliases("§P9 不存在", result.aliases) == "§P9 不存在"
+    # 别名表只随各自的压缩结果返回，不存在进程级的"最近一次"别名表
+    assert engine.expand_aliases("RUN: type §P1", None) == "RUN: type §P1"
+    assert not hasattr(engine, "aliases")
+
+def test_structured_json_minified_tabled_and_sampled():
+    """JSON：压缩空白，对象数组提取表头，长数组只保留首尾样本"""
+    from core.compression.structured import compress_json
+    payload = json.dumps({"items": [{"id": i, "status": "ok"} for i in range(20)], "total": 20}, indent=2)
+    out = json.loads(compress_json(payload))
+    assert out["items"]["_cols"] == ["id", "status"]
+    assert [row[0] for row in out["items"]["_rows"]] == [0, 1, 2, 3, 4, 18, 19]
+    assert out["items"]["_omitted"] == 13
+    assert out["total"] == 20
+
+def test_structured_logs_and_traces_collapse():
+    """日志按模板聚类为 "模板 ×N"，堆栈折叠中间帧，代码块不受影响"""
+    from core.compression.structured import compress_structured
+    logs = [f"2024-05-01 12:00:{i:02d} INFO worker-{i % 3} processed job {1000 + i}" for i in range(12)]
+    frames = []
+    for depth in range(10):
+        frames += [f'  File "/srv/app/mod_{depth}.py", line {depth + 1}, in f{depth}', f"    f{depth + 1}()"]
+    trace = ["Tool: Traceback (most recent call last):"] + frames + ["RecursionError: maximum recursion depth"]
+    code = ["```text", "2024-05-01 12:00:00 INFO keep", "2024-05-01 12:00:01 INFO keep", "2024-05-01 12:00:02 INFO keep", "```"]
+    text, rewritten = compress_structured("\n".join(["System: 助手", "User: 开始"] + logs + trace + code))
+    assert rewritten == 2
+    assert "<*> <*> INFO <*> processed job <*> ×12" in text
+    assert "... 省略 7 层调用 ..." in text and "mod_0.py" in text and "mod_9.py" in text
+    assert "RecursionError: maximum recursion depth" in text
+    assert "\n".join(code) in text
+
+def test_structured_skips_bracket_prefixed_chat_and_tail():
+    """"[12:01] ..." 形式的聊天前缀不触发多行 JSON 扫描，最近的 TAIL_LINES 行保持原样"""
+    from core.compression.structured import compress_structured
+    chat = [f"[12:{i % 60:02d}] user{i % 7}: 第 {i} 条消息" for i in range(3000)]
+    start = time.perf_counter()
+    text, rewritten = compress_structured("\n".join(chat))
+    assert time.perf_counter() - start < 1.0
+    assert rewritten == 0 and text == "\n".join(chat)
+
+    payload = json.dumps({"items": [{"id": i, "status": "ok"} for i in range(20)]}, indent=2)
+    head = ["System: 助手", "User: 开始", "Tool:"] + payload.split("\n")
+    text, rewritten = compress_structured("\n".join(head + [f"User: 第 {i} 轮" for i in range(6)]))
+    assert rewritten == 1 and '"_omitted":13' in text
+    tail_text, tail_rewritten = compress_structured("\n".join(["System: 助手", "User: 开始", "Tool:", '{"a": [1,  2]}']))
+    assert tail_rewritten == 0 and tail_text.endswith('{"a": [1,  2]}')
+
+def test_segmenter_extracts_terms_ranked_by_frequency(tmp_path):
+    """中文按词典切分为词语，过滤停用词，关键词按词频排序"""
+    from core.compression.keywords import extract_keywords, count_keywords, top_keywords
+    from core.segmenter import Segmenter, builtin_freqs
+
+    keywords = extract_keywords("数据库连接已经迁移到容器镜像。DeepSeek 依赖于第三方服务。")
+    assert keywords == ["数据库", "连接", "迁移", "容器镜像", "DeepSeek", "依赖", "第三方服务"]
+    counts = count_keywords(extract_keywords("缓存策略需要检查。部署脚本需要检查。检查缓存。"))
+    assert top_keywords(counts, 2) == ["检查", "缓存"]
+
+    dict_path = tmp_path / "dict.txt"
+    dict_path.write_text("灰度发布 500 n\n", encoding="utf-8")
+    segmenter = Segmenter.from_file(str(dict_path), builtin_freqs())
+    assert segmenter.cut("开始灰度发布") == ("开始", "灰度发布")
+
+class FakeGateway:
+    """记录提示词并返回固定摘要的 LLM 网关"""
+    def __init__(self):
+        self.prompts = []
+
+    def cheapest_provider(self, order):
+        return order[0] if order else None
+
+    async def chat(self, provider, prompt, user_id, model=None, scene="llm_call"):
+        self.prompts.append(prompt)
+        return {"status": "success", "provider": provider, "text": f"摘要{len(self.prompts)}",
+                "input_tokens": 100, "output_tokens": 5}
+
+def test_summary_tree_merges_levels_and_covers_ready_nodes():
+    """兄弟节点全部就绪后产生合并任务，cover 优先使用最高层摘要并跳过未就绪段"""
+    from core.compression.abstractive import SummaryTree
+    tree = SummaryTree(fanout=2)
+    jobs = [tree.add_segment(f"段{i}", 10) for i in range(3)]
+    assert tree.complete(0, 0, "a", 10) is None
+    assert tree.complete(0, 1, "b", 10) == (1, 0, "a\nb", 20)
+    assert tree.cover() == [("a", 10), ("b", 10)]
+    tree.complete(1, 0, "ab", 20)
+    tree.release_children(1, 0)
+    assert jobs[2][:2] == (0, 2)
+    assert tree.cover() == [("ab", 20)]
+    tree.complete(0, 2, "c", 10)
+    assert tree.cover() == [("ab", 20), ("c", 10)]
+
+def test_incremental_uses_background_summaries(engine, monkeypatch):
+    """长会话的旧段在后台生成摘要并逐层合并，请求只使用已就绪的摘要"""
+    from core.compression.abstractive import SUMMARY_FANOUT
+    from core.summarizer import SummaryWorker
+    monkeypatch.setattr("core.summarizer.token_tracker.record_summary_call", lambda *a, **k: None)
+    monkeypatch.setattr("core.omni_engine.token_tracker.record_summary_use", lambda *a, **k: None)
+    gateway = FakeGateway()
+    engine.summarizer = SummaryWorker(gateway=gateway)
+    engine.sessions.summary_chars = 2000
+
+    first = engine.compress_incremental("s-sum", make_dialogue(300))
+    assert "[对话摘要" not in first
+    assert engine.summarizer.join(timeout=10)
+    segments = sum(1 for p in gateway.prompts if "概括以下对话片段" in p)
+    merges = len(gateway.prompts) - segments
+    assert SUMMARY_FANOUT <= segments < SUMMARY_FANOUT ** 2
+    assert merges == segments // SUMMARY_FANOUT
+
+    result = engine.compress_incremental("s-sum", "User: 继续")
+    assert result.count("[对话摘要: ") == merges + segments % SUMMARY_FANOUT
+    assert result.index("[对话摘要: ") < result.index("[历史上下文压缩摘要")
+
+def test_summary_skips_mock_providers(monkeypatch):
+    """摘要只选用接入真实 API 的厂商，模拟回复被丢弃"""
+    import asyncio
+    from core.summarizer import SummaryWorker
+    monkeypatch.setattr("core.summarizer.settings.SUMMARY_PROVIDERS", "qwen,deepseek")
+    gateway = FakeGateway()
+    worker = SummaryWorker(gateway=gateway)
+    assert worker.provider() == "deepseek"
+    monkeypatch.setattr("core.summarizer.settings.SUMMARY_PROVIDERS", "qwen,zhipu")
+    assert worker.provider() is None
+
+    async def mock_chat(provider, prompt, user_id, model=None, scene="llm_call"):
+        return {"status": "success", "provider": provider, "text": "[来自 DEEPSEEK 的回复] ...", "mock": True}
+    monkeypatch.setattr("core.summarizer.settings.SUMMARY_PROVIDERS", "deepseek")
+    gateway.chat = mock_chat
+    assert asyncio.run(worker._summarize(0, "User: 你好")) is None
+
+def test_stream_shrink_matches_incremental_and_reads_gzip_files(engine, tmp_path):
+    """流式压缩与增量会话结果一致，与分块位置无关，.gz 文件按内存映射分块解压"""
+    import gzip
+    context = make_dialogue(200) + "\n```python\nprint('latest')\n```\nUser: 结束"
+    expected = engine.compress_incremental("s-stream", context)
+    data = context.encode("utf-8")
+    for size in (7, 4096):
+        shrinker = engine.open_stream()
+        for start in range(0, len(data), size):
+            shrinker.feed(data[start:start + size])
+        assert engine.finish_stream(shrinker) == expected
+
+    path = tmp_path / "transcript.log.gz"
+    path.write_bytes(gzip.compress(data))
+    assert engine.compress_file(str(path)) == expected
+    shrinker = engine.open_stream(encoding="gzip")
+    shrinker.feed(gzip.compress(b"User: hi"))
+    assert engine.finish_stream(shrinker) == "User: hi"
+
+def test_shrink_endpoint_limits_files_and_inflated_bodies(tmp_path, monkeypatch):
+    """文件模式只读取 SHRINK_FILE_ROOT 内的文件，未配置时禁用；解压后超过上限的请求体返回 413"""
+    import gzip
+    from fastapi.testclient import TestClient
+    from core.fastapi_gateway import app
+    client = TestClient(app)
+    (tmp_path / "notes.txt").write_text("User: hi", encoding="utf-8")
+    monkeypatch.setattr("core.fastapi_gateway.settings.SHRINK_FILE_ROOT", "")
+    assert client.post("/shrink", json={"path": str(tmp_path / "notes.txt")}).status_code == 403
+    monkeypatch.setattr("core.fastapi_gateway.settings.SHRINK_FILE_ROOT", str(tmp_path))
+    assert client.post("/shrink", json={"path": "notes.txt"}).json()["summary"] == "User: hi"
+    assert client.post("/shrink", json={"path": "/etc/passwd"}).status_code == 403
+    assert client.post("/shrink", json={"path": "../outside.txt"}).status_code == 403
+    assert client.post("/shrink", json={"path": "missing.txt"}).status_code == 404
+
+    monkeypatch.setattr("core.fastapi_gateway.settings.SHRINK_MAX_INFLATED_BYTES", 1 << 20)
+    bomb = gzip.compress(b'{"context": "' + b" " * (4 << 20) + b'"}')
+    response = client.post("/shrink", content=bomb,
+                           headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    assert response.status_code == 413
+    small = gzip.compress(json.dumps({"context": "User: hi"}).encode("utf-8"))
+    response = client.post("/shrink", content=small,
+                           headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+    assert response.json()["summary"] == "User: hi"
+
+def test_shrink_endpoints_reject_invalid_budgets():
+    """target_tokens 须为正数，target_ratio 须在 (0, 1] 内，否则返回 422"""
+    from fastapi.testclient import TestClient
+    from core.fastapi_gateway import app
+    client = TestClient(app)
+    for body in ({"target_tokens": 0}, {"target_tokens": -5}, {"target_ratio": 0}, {"target_ratio": 1.5}):
+        assert client.post("/shrink", json=dict(body, context="User: hi")).status_code == 422
+        assert client.post("/shrink/batch", json=dict(body, contexts=["User: hi"])).status_code == 422
+    assert client.post("/shrink", json={"context": "User: hi", "target_ratio": 1}).status_code == 200
+    assert client.post("/shrink/batch", json={"contexts": ["User: hi"], "target_tokens": 10}).status_code == 200
+
+def test_shrink_json_body_honours_query_parameters(monkeypatch):
+    """JSON 请求体同样接受 provider/scene/layout/namespace 查询参数，请求体中的同名字段优先"""
+    from fastapi.testclient import TestClient
+    from core.fastapi_gateway import app, omni_engine
+    seen = []
+    def fake(context, provider="deepseek", scene="general", namespace=None, **options):
+        seen.append((provider, scene, options.get("layout"), namespace))
+        return ShrinkResult(text=context, compressed=False)
+    monkeypatch.setattr(omni_engine, "compress_context_result", fake)
+    client = TestClient(app)
+    body = {"context": "User: hi"}
+    assert client.post("/shrink?provider=openai&scene=agent&layout=cache&namespace=u1", json=body).status_code == 200
+    assert client.post("/shrink?provider=openai&layout=cache", json=dict(body, provider="claude")).status_code == 200
+    assert client.post("/shrink?layout=bogus", json=body).status_code == 422
+    assert seen == [("openai", "agent", "cache", "u1"), ("claude", "general", "cache", None)]
@@ -0,0 +1,290 @@
+import base64
+import json
+import multiprocessing
+import random
+import pytest
+from core.token_tracker import SQLiteTokenTracker, TokenTracker, open_token_tracker, prompt_cache_usage
+from core.usage import DDSketch, EventArchive, PriceCatalog, Rollups, parse_window
+from core.tokenizer import BPETokenizer, HeuristicCounter, get_counter
+
+def test_heuristic_counter_cjk_aware():
+    """中文按字折算，英文按字符数折算"""
+    counter = HeuristicCounter("deepseek")
+    assert counter.count("") == 0
+    assert counter.count("你好世界") == 3          # 4 * 0.6 向上取整
+    assert counter.count("hello world") < len("hello world")
+
+def test_bpe_tokenizer_merges_and_caches(tmp_path):
+    vocab = [b"h", b"e", b"l", b"o", b" ", b"he", b"ll", b"hell", b"hello", b" hello"]
+    path = tmp_path / "test.tiktoken"
+    path.write_bytes(b"\n".join(base64.b64encode(t) + b" " + str(i).encode() for i, t in enumerate(vocab)))
+    tok = BPETokenizer.from_file("test", str(path))
+    assert tok.encode("hello hello") == [8, 9]
+    assert tok.encode("hell") == [7]
+    assert tok.count("hello hello") == 2
+    assert "hello" in tok._cache
+
+def test_get_counter_falls_back_without_vocab():
+    assert isinstance(get_counter("unknown-provider"), (HeuristicCounter, BPETokenizer))
+
+def test_tracker_records_tokens_and_chars(tmp_path):
+    tracker = TokenTracker(str(tmp_path / "stats.json"))
+    tracker.record("deepseek", "general", 100, 40, 300, 120)
+    summary = tracker.get_summary()
+    assert summary["total_saved"] == 60
+    assert summary["total_saved_chars"] == 180
+    assert summary["providers"]["deepseek"]["optimized_chars"] == 120
+
+def test_tracker_migrates_legacy_char_stats(tmp_path):
+    """旧版字符统计迁移到 *_chars 字段，保持历史可比"""
+    path = tmp_path / "stats.json"
+    path.write_text(json.dumps({
+        "total_original": 1000, "total_optimized": 400, "total_saved": 600,
+        "providers": {"deepseek": {"original": 1000, "optimized": 400, "saved": 600}},
+        "scenes": {"general": 400},
+        "history": [{"timestamp": 1.0, "provider": "deepseek", "scene": "general",
+                     "original": 1000, "optimized": 400, "saved": 600}]
+    }))
+    tracker = TokenTracker(str(path))
+    summary = tracker.get_summary()
+    assert summary["total_original"] == 0
+    assert summary["total_original_chars"] == 1000
+    assert summary["char_savings_rate"] == 60.0
+    tracker.record("deepseek", "general", 10, 5, 30, 15)
+    assert tracker.get_summary()["providers"]["deepseek"]["original_chars"] == 1030
+
+def test_prompt_cache_usage_parsing_and_recording(tmp_path):
+    """兼容各厂商 usage 格式，记录提示词缓存命中 Token"""
+    assert prompt_cache_usage({"prompt_tokens": 100, "prompt_cache_hit_tokens": 80, "prompt_cache_miss_tokens": 20}) == (100, 80)
+    assert prompt_cache_usage({"prompt_tokens": 50, "prompt_tokens_details": {"cached_tokens": 10}}) == (50, 10)
+    assert prompt_cache_usage({"input_tokens": 5, "cache_read_input_tokens": 90, "cache_creation_input_tokens": 5}) == (100, 90)
+    assert prompt_cache_usage({"prompt_tokens": 10}) is None
+
+    tracker = TokenTracker(str(tmp_path / "stats.json"))
+    tracker.record_prompt_cache("deepseek", 100, 80)
+    summary = tracker.get_summary()
+    assert summary["prompt_cache_hit_tokens"] == 80
+    assert summary["prompt_cache_hit_rate"] == 80.0
+    assert summary["providers"]["deepseek"]["prompt_cache_hit_tokens"] == 80
+
+def test_summary_cost_tracked_separately(tmp_path):
+    """后台摘要的 LLM 成本与其替代原文节省的 Token 分开统计"""
+    tracker = TokenTracker(str(tmp_path / "stats.json"))
+    tracker.record_summary_call("deepseek", 900, 100)
+    tracker.record_summary_use(covered_tokens=3000, emitted_tokens=200)
+    summary = tracker.get_summary()
+    assert summary["summary_calls"] == 1
+    assert summary["summary_cost_tokens"] == 1000
+    assert summary["summary_net_saved"] == 1800
+    assert summary["total_original"] == 0
+    assert tracker.flush()
+    reloaded, _ = TokenTracker(str(tmp_path / "stats.json"))._current_stats(0)
+    assert reloaded["summary"]["providers"] == {"deepseek": 1000}
+
+def test_tracker_records_in_memory_and_flushes_in_background(tmp_path):
+    """record 只更新内存与环形缓冲；后台线程累计到阈值后原子写盘，重启后历史按时间顺序恢复"""
+    import time
+    path = tmp_path / "stats.json"
+    tracker = TokenTracker(str(path), flush_interval=60, flush_events=100)
+    for i in range(99):
+        tracker.record("deepseek", "general", 100 + i, 40)
+    assert not path.exists()
+    assert len(tracker.history) == 50
+    assert [e["original"] for e in tracker.get_summary()["recent_history"]] == [194, 195, 196, 197, 198]
+    tracker.record("deepseek", "general", 199, 40)
+    deadline = time.time() + 5
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.01)
+    reloaded = TokenTracker(str(path))
+    assert reloaded.get_summary()["total_original"] == sum(range(100, 200))
+    assert [e["original"] for e in reloaded.history.latest()] == list(range(150, 200))
+    assert not (tmp_path / "stats.json.tmp").exists()
+
+def test_ddsketch_quantiles_within_relative_error_and_mergeable():
+    """分位数相对误差在 1% 内；两个草图合并等同于直接统计全部数据"""
+    rng = random.Random(0)
+    values = [rng.lognormvariate(6, 1.5) for _ in range(20000)]
+    left, right, whole = DDSketch(), DDSketch(), DDSketch()
+    for i, value in enumerate(values):
+        (left if i % 2 else right).add(value)
+        whole.add(value)
+    left.merge(right)
+    assert left.bins == whole.bins and left.count == whole.count
+    ordered = sorted(values)
+    for q in (0.5, 0.95, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(whole.quantile(q) - exact) / exact <= 0.011
+    assert DDSketch.from_list(whole.to_list()).bins == whole.bins
+
+def test_rollups_answer_windows_by_group():
+    """按窗口选择粒度，只统计窗口内的桶，可按厂商/场景分组"""
+    now = 1_700_000_000.0
+    rollups = Rollups()
+    rollups.add(now - 2 * 86400, "openai", "agent", 500, 100, 1500, 300)
+    for i in range(10):
+        rollups.add(now - i * 60, "deepseek", "telegram", 100 * (i + 1), 40, 300, 120)
+    hour = rollups.query(parse_window("1h"), None, now)
+    assert hour["resolution"] == "minute"
+    assert hour["groups"]["all"]["requests"] == 10
+    assert hour["groups"]["all"]["optimized"] == 400
+    assert 490 <= hour["groups"]["all"]["original_quantiles"]["p50"] <= 610
+    week = rollups.query(parse_window("7d"), "provider", now)
+    assert week["resolution"] == "hour"
+    assert set(week["groups"]) == {"deepseek", "openai"}
+    assert rollups.query(parse_window("30d"), "provider,scene", now)["resolution"] == "day"
+    restored = Rollups.from_dict(json.loads(json.dumps(rollups.to_dict())))
+    assert restored.query(3600, "scene", now)["groups"] == rollups.query(3600, "scene", now)["groups"]
+    with pytest.raises(ValueError):
+        parse_window("soon")
+    with pytest.raises(ValueError):
+        rollups.query(3600, "model", now)
+
+def test_event_archive_roundtrip_and_aggregate(tmp_path):
+    """事件按天分列存储，聚合与逐条求和一致，残缺行按最短列对齐"""
+    archive = EventArchive(str(tmp_path / "events"))
+    day = 86400 * 19000
+    archive.append([(day + 10, "deepseek", "agent", 100, 40, 300, 120),
+                    (day + 86400 + 5, "openai", "agent", 50, 20, 150, 60),
+                    (day + 86400 + 6, "deepseek", "telegram", 10, 5, 30, 15)])
+    reopened = EventArchive(str(tmp_path / "events"))
+    assert len(reopened.events(day, day + 2 * 86400)) == 3
+    totals = reopened.aggregate(day, day + 2 * 86400, "provider")
+    assert totals["deepseek"] == {"requests": 2, "original": 110, "optimized": 45,
+                                  "original_chars": 330, "optimized_chars": 135}
+    assert reopened.aggregate(day + 86400, day + 2 * 86400)["all"]["requests"] == 2
+    # 模拟崩溃：只有 ts 列多写了一行
+    with open(reopened._path(19001, "ts", "<f8"), "ab") as f:
+        f.write(b"\0" * 8)
+    assert len(reopened.events(day, day + 2 * 86400)) == 3
+    reopened.append([(day + 86400 + 7, "openai", "scan", 1, 1, 1, 1)])
+    assert reopened.aggregate(day, day + 2 * 86400, "scene")["scan"]["requests"] == 1
+
+def test_tracker_rollups_survive_restart(tmp_path):
+    """汇总快照之后的事件在重启时从归档重放"""
+    path = str(tmp_path / "stats.json")
+    tracker = TokenTracker(path, flush_interval=60)
+    for _ in range(3):
+        tracker.record("deepseek", "agent", 100, 40)
+    tracker.flush()
+    tracker.record("qwen", "agent", 80, 30)
+    tracker.close()
+    window = tracker.query("1h", "provider")
+    assert window["groups"]["deepseek"]["requests"] == 3
+    restarted = TokenTracker(path, flush_interval=60)
+    assert restarted.query("1h", "provider")["groups"] == window["groups"]
+    assert restarted.query("15m")["groups"]["all"]["saved"] == 3 * 60 + 50
+
+def _record_in_process(path, worker, count):
+    tracker = SQLiteTokenTracker(path, flush_interval=0.01, flush_events=7)
+    for i in range(count):
+        tracker.record(f"provider{worker % 2}", "agent", 10, 4)
+        tracker.record_cache_lookup(i % 2 == 0)
+    tracker.close()
+
+def test_sqlite_tracker_shared_across_processes(tmp_path):
+    """多个进程写同一个库：总量逐次累加不丢失，汇总包含所有进程的记录"""
+    path = str(tmp_path / "stats.db")
+    workers = [multiprocessing.get_context("spawn").Process(target=_record_in_process, args=(path, n, 200))
+               for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    reader = open_token_tracker(path)
+    assert isinstance(reader, SQLiteTokenTracker)
+    reader.record("provider0", "agent", 10, 4)  # 未落盘的增量同样计入读取结果
+    summary = reader.get_summary()
+    assert summary["total_original"] == 601 * 10
+    assert summary["total_saved"] == 601 * 6
+    assert summary["cache_hits"] + summary["cache_misses"] == 600
+    assert summary["providers"]["provider0"]["original"] == 401 * 10
+    assert len(summary["recent_history"]) == 5
+    assert reader.query("1h", "provider")["groups"]["provider1"]["requests"] == 200
+    assert reader.archive.aggregate(0, None, "provider")["provider0"]["requests"] == 401
+    reader.close()
+
+def test_sqlite_tracker_imports_legacy_json(tmp_path):
+    """首次打开时导入同名的旧版 JSON 统计，之后的记录继续累加"""
+    legacy = TokenTracker(str(tmp_path / "stats.json"))
+    legacy.record("deepseek", "general", 100, 40)
+    legacy.record_summary_call("deepseek", 30, 10)
+    legacy.close()
+    tracker = SQLiteTokenTracker(str(tmp_path / "stats.db"))
+    tracker.record("deepseek", "general", 50, 20)
+    tracker.flush()
+    restarted = SQLiteTokenTracker(str(tmp_path / "stats.db"))
+    summary = restarted.get_summary()
+    assert summary["total_saved"] == 90
+    assert summary["summary_cost_tokens"] == 40
+    assert [entry["original"] for entry in summary["recent_history"]] == [100, 50]
+    assert restarted.query("1h")["groups"]["all"]["requests"] == 2
+
+def test_price_catalog_falls_back_to_provider_default(tmp_path):
+    """未列出的模型用厂商默认价格，未列出的厂商为 0；覆盖文件按模型合并"""
+    override = tmp_path / "prices.json"
+    override.write_text(json.dumps({"providers": {"deepseek": {"deepseek-chat": {"input": 1.0, "output": 2.0}}}}))
+    catalog = PriceCatalog.load(str(override))
+    assert catalog.rates("deepseek", "deepseek-chat").input == 1000      # 1 美元/百万 Token = 1000 纳美元/Token
+    assert catalog.rates("deepseek", "deepseek-chat").cached_input == 1000
+    assert catalog.rates("deepseek", "unknown-model") == catalog.rates("deepseek")
+    assert catalog.rates("nobody").output == 0
+
+def test_tracker_accounts_cost_per_provider_scene_and_user(tmp_path):
+    """花费按实际发送的输入/输出 Token 计价 (缓存命中的输入按缓存价)，压缩减少的输入 Token 计为避免的花费"""
+    catalog = PriceCatalog({"deepseek": {"*": {"input": 1.0, "output": 4.0, "cached_input": 0.25}}})
+    tracker = TokenTracker(str(tmp_path / "stats.json"), prices=catalog)
+    tracker.record("deepseek", "agent", 1_000_000, 400_000, user="telegram:1")
+    # 直接调用：200k 输入命中缓存，在记账时按缓存价计价
+    tracker.record("deepseek", "llm_call", 400_000, 400_000, output_tokens=100_000, cached_tokens=200_000,
+                   user="telegram:2")
+    tracker.record_prompt_cache("deepseek", 300_000, 200_000, deduct=False)
+    # 压缩结果转发后事后上报：100k 输入命中缓存，缓存节省从 agent 场景与 telegram:1 的花费中扣除
+    tracker.record_prompt_cache("deepseek", 400_000, 100_000, scene="agent", user="telegram:1")
+    tracker.record("unpriced", "agent", 100, 50)
+    summary = tracker.get_summary()
+    assert summary["currency"] == "USD"
+    assert summary["cost_spent"] == 0.325 + 0.55
+    assert summary["cost_avoided"] == 0.6
+    assert summary["cost_prompt_cache_saved"] == 0.225
+    assert summary["providers"]["deepseek"]["cost_spent"] == 0.875
+    assert summary["providers"]["unpriced"]["cost_spent"] == 0
+    assert summary["cost_scenes"]["agent"] == {"spent": 0.325, "avoided": 0.6}
+    assert summary["cost_users"]["telegram:2"]["spent"] == 0.55
+    tracker.flush()
+    restarted = SQLiteTokenTracker(str(tmp_path / "stats.db"), prices=catalog)
+    assert restarted.get_summary()["cost_users"]["telegram:1"] == {"spent": 0.325, "avoided": 0.6}
+
+def test_flush_swaps_out_delta_and_tracker_can_be_collected(tmp_path):
+    """写盘时锁内只换出增量，总量在锁外累加；追踪器不被退出钩子或后台线程强引用"""
+    import gc
+    import weakref
+    tracker = TokenTracker(str(tmp_path / "stats.json"), flush_interval=0.05)
+    tracker.record("deepseek", "chat", 100, 40, user="alice")
+    delta = tracker.stats
+    assert tracker.flush()
+    assert tracker.stats is not delta and tracker.stats["total_original"] == 0
+    tracker.record("deepseek", "chat", 50, 20, user="bob")
+    summary = tracker.get_summary()
+    assert summary["total_original"] == 150
+    assert set(summary["cost_users"]) == {"alice", "bob"}
+
+    ref = weakref.ref(tracker)
+    del tracker, delta
+    gc.collect()
+    assert ref() is None
+
+def test_event_archive_caps_name_cardinality(tmp_path):
+    """厂商/场景名超过上限 (默认为 u2 编号的 65536 个) 后计入 other，编号不会溢出"""
+    now = 86400 * 19000 + 10
+    archive = EventArchive(str(tmp_path / "events"))
+    archive.append([(now, f"p{i}", "chat", 1, 1, 1, 1) for i in range(70000)])
+    assert len(archive.providers) == 65536 and archive.providers[-1] == "other"
+    by_provider = EventArchive(str(tmp_path / "events")).aggregate(now - 1, now + 1, "provider")
+    assert by_provider["p65534"]["requests"] == 1
+    assert by_provider["other"]["requests"] == 70000 - 65535
+
+    capped = EventArchive(str(tmp_path / "capped"), max_names=3)
+    capped.append([(now, "deepseek", f"scene{i}", 10, 5, 20, 10) for i in range(5)])
+    assert capped.scenes == ["scene0", "scene1", "other"]
+    assert capped.aggregate(now - 1, now + 1, "scene")["other"]["original"] == 30